@@ -0,0 +1,307 @@
+"""
+Admission control for the heavy endpoints (/analyze, /simulate/export-energyplus).
+Each request declares an estimated memory cost. It is admitted while the
+shared budget (ADMISSION_MEMORY_MB and ADMISSION_MAX_CONCURRENT) and its
+route's own concurrency limit have room, otherwise it waits in a FIFO queue
+for at most ADMISSION_MAX_WAIT_SECONDS.
+A full queue, a wait that would exceed the maximum or an expired wait is
+answered with 429 and a Retry-After estimate, and so is a user who emptied
+their token bucket
+(ADMISSION_USER_RATE requests per second, bursts of ADMISSION_USER_BURST).
+Under overload the server keeps working at capacity with bounded latency
+instead of buffering requests until it runs out of memory.
+"""
+import os
+import math
+import time
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Optional
+from fastapi import HTTPException, status
+import metrics
+from jobs import ANALYSIS_WORKERS
+
+# ADMISSION_ENABLED=0 admits everything (e.g. to compare under load)
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "1") == "1"
+ADMISSION_MEMORY_MB = float(os.environ.get("ADMISSION_MEMORY_MB", "2048"))
+ADMISSION_MAX_CONCURRENT = int(os.environ.get("ADMISSION_MAX_CONCURRENT", "16"))
+ADMISSION_MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", "32"))
+ADMISSION_MAX_WAIT_SECONDS = float(os.environ.get("ADMISSION_MAX_WAIT_SECONDS", "2"))
+# Per-route limits within the global one. Exports run on the API process's
+# CPU, so more of them at once only makes each slower; an analysis holds its
+# share while its job is queued or running on the pool.
+ANALYZE_ROUTE = "/analyze"
+EXPORT_ROUTE = "/simulate/export-energyplus"
+ADMISSION_ANALYZE_CONCURRENT = int(os.environ.get("ADMISSION_ANALYZE_CONCURRENT", str(2 * ANALYSIS_WORKERS)))
+ADMISSION_EXPORT_CONCURRENT = int(os.environ.get("ADMISSION_EXPORT_CONCURRENT", "4"))
+# Per-user token bucket; a rate of 0 disables it
+ADMISSION_USER_RATE = float(os.environ.get("ADMISSION_USER_RATE", "2"))
+ADMISSION_USER_BURST = float(os.environ.get("ADMISSION_USER_BURST", "10"))
+
+# Memory estimates: a parsed IFC model takes several times its file size, an
+# export holds the scene body plus the epJSON document built from it
+ADMISSION_IFC_MEMORY_FACTOR = float(os.environ.get("ADMISSION_IFC_MEMORY_FACTOR", "8"))
+ADMISSION_IFC_DEFAULT_MB = float(os.environ.get("ADMISSION_IFC_DEFAULT_MB", "256"))
+ADMISSION_EXPORT_MEMORY_FACTOR = float(os.environ.get("ADMISSION_EXPORT_MEMORY_FACTOR", "6"))
+ADMISSION_MIN_COST_MB = 1.0
+
+# Buckets kept for the most recently seen users; a dropped bucket starts full again
+MAX_TRACKED_USERS = 10000
+MAX_RETRY_AFTER = 60
+MB = 1024 * 1024
+
+
+def ifc_cost_mb(size: Optional[int]) -> float:
+    """Estimated memory of analysing an IFC file of `size` bytes (None: unknown)."""
+    if size is None:
+        return ADMISSION_IFC_DEFAULT_MB
+    return max(ADMISSION_MIN_COST_MB, size / MB * ADMISSION_IFC_MEMORY_FACTOR)
+
+
+def export_cost_mb(content_length: Optional[int]) -> float:
+    """Estimated memory of an export whose request body has `content_length` bytes."""
+    return max(ADMISSION_MIN_COST_MB, (content_length or 0) / MB * ADMISSION_EXPORT_MEMORY_FACTOR)
+
+
+class TokenBucket:
+    """`rate` tokens per second, holding at most `burst`."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Take a token. Returns 0 on success, else the seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class Permit:
+    """The share of the budget held by one admitted request. release() is idempotent."""
+
+    def __init__(self, controller: "AdmissionController", route: str, cost_mb: float):
+        self.controller = controller
+        self.route = route
+        self.cost_mb = cost_mb
+        self.granted_at: Optional[float] = None
+        self.released = False
+
+    def release(self):
+        self.controller._release(self)
+
+
+class _Waiter:
+    def __init__(self, permit: Permit, loop: asyncio.AbstractEventLoop):
+        self.permit = permit
+        self.loop = loop
+        self.future = loop.create_future()
+        self.granted = False
+
+
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class AdmissionController:
+    """
+    A memory and concurrency budget shared by the heavy routes, with optional
+    per-route concurrency limits, a bounded FIFO queue and per-user token
+    buckets. Permits may be released from any thread (analysis jobs release
+    theirs when the job's future completes).
+    """
+
+    def __init__(
+        self,
+        memory_mb: float,
+        max_concurrent: int,
+        max_queue: int,
+        max_wait_seconds: float,
+        user_rate: float,
+        user_burst: float,
+        route_limits: Optional[Dict[str, int]] = None,
+        enabled: bool = True,
+    ):
+        self.memory_mb = memory_mb
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.route_limits = dict(route_limits or {})
+        self.enabled = enabled
+        self._queue: Deque[_Waiter] = deque()
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.route_in_flight: Dict[str, int] = {}
+        self.reserved_mb = 0.0
+        # Moving average per route of how long a permit is held, to predict waits
+        self._hold_seconds: Dict[str, float] = {}
+
+    def _route_full(self, route: str) -> bool:
+        limit = self.route_limits.get(route)
+        return limit is not None and self.route_in_flight.get(route, 0) >= limit
+
+    def _fits(self, cost_mb: float) -> bool:
+        # A request larger than the whole budget still runs, alone
+        return self.in_flight < self.max_concurrent and (
+            self.in_flight == 0 or self.reserved_mb + cost_mb <= self.memory_mb
+        )
+
+    def _grant(self, permit: Permit):
+        self.in_flight += 1
+        self.route_in_flight[permit.route] = self.route_in_flight.get(permit.route, 0) + 1
+        self.reserved_mb += permit.cost_mb
+        permit.granted_at = time.monotonic()
+
+    def _dispatch(self):
+        """
+        Admit queued requests in order. Requests of a route at its limit are
+        passed over; the first one that does not fit the global budget stops
+        the scan, so smaller requests cannot starve it.
+        """
+        for waiter in list(self._queue):
+            if self._route_full(waiter.permit.route):
+                continue
+            if not self._fits(waiter.permit.cost_mb):
+                break
+            self._queue.remove(waiter)
+            waiter.granted = True
+            self._grant(waiter.permit)
+            waiter.loop.call_soon_threadsafe(_wake, waiter.future)
+
+    def _take_token(self, user_key: str) -> float:
+        if self.user_rate <= 0:
+            return 0.0
+        bucket = self._buckets.get(user_key)
+        if bucket is None:
+            bucket = self._buckets[user_key] = TokenBucket(self.user_rate, self.user_burst)
+            if len(self._buckets) > MAX_TRACKED_USERS:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(user_key)
+        return bucket.take()
+
+    def _expected_wait(self, route: str, ahead: int) -> float:
+        """Seconds until `ahead` queued requests of the route have been admitted, roughly."""
+        slots = min(self.max_concurrent, self.route_limits.get(route, self.max_concurrent))
+        return self._hold_seconds.get(route, 1.0) * ahead / max(slots, 1)
+
+    def _retry_after(self, route: str) -> float:
+        """Seconds until the route's queue has probably drained."""
+        return self._expected_wait(route, sum(1 for waiter in self._queue if waiter.permit.route == route) + 1)
+
+    def _reject(self, route: str, outcome: str, retry_after: float, detail: str) -> HTTPException:
+        metrics.admission_requests.inc(route=route, outcome=outcome)
+        seconds = max(1, min(MAX_RETRY_AFTER, math.ceil(retry_after)))
+        return HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"{detail} Retry in {seconds} s.",
+            headers={"Retry-After": str(seconds)},
+        )
+
+    async def acquire(self, route: str, user_key: str, cost_mb: float) -> Permit:
+        """
+        Wait for room in the budget and return the permit.
+        Raises HTTPException 429 (with Retry-After) if the user is over their
+        rate, the queue is full, or room is not expected to (or did not) free
+        up within the maximum wait.
+        """
+        permit = Permit(self, route, cost_mb)
+        if not self.enabled:
+            return permit
+        with self._lock:
+            wait = self._take_token(user_key)
+            if wait:
+                raise self._reject(route, "rate_limited", wait, "Too many requests.")
+            waiter = _Waiter(permit, asyncio.get_running_loop())
+            self._queue.append(waiter)
+            self._dispatch()
+            if waiter.granted:
+                metrics.admission_requests.inc(route=route, outcome="admitted")
+                return permit
+            if len(self._queue) > self.max_queue:
+                self._queue.remove(waiter)
+                raise self._reject(route, "queue_full", self._retry_after(route), "Server busy.")
+            ahead = sum(1 for queued in self._queue if queued.permit.route == route) - 1
+            if self._expected_wait(route, ahead) > self.max_wait_seconds:
+                # Would time out anyway; answer now instead of holding the connection
+                self._queue.remove(waiter)
+                raise self._reject(route, "shed", self._retry_after(route), "Server busy.")
+
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.max_wait_seconds)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._lock:
+                granted = waiter.granted
+                if not granted:
+                    self._queue.remove(waiter)
+                    # Requests behind this one may fit now
+                    self._dispatch()
+                    retry_after = self._retry_after(route)
+            if isinstance(e, asyncio.CancelledError):
+                if granted:
+                    permit.release()
+                raise
+            if not granted:
+                raise self._reject(route, "timed_out", retry_after, "Server busy.")
+        metrics.admission_wait.observe(time.monotonic() - started, route=route)
+        metrics.admission_requests.inc(route=route, outcome="admitted")
+        return permit
+
+    def _release(self, permit: Permit):
+        with self._lock:
+            if permit.granted_at is None or permit.released:
+                return
+            permit.released = True
+            self.in_flight -= 1
+            self.route_in_flight[permit.route] -= 1
+            self.reserved_mb -= permit.cost_mb
+            held = time.monotonic() - permit.granted_at
+            average = self._hold_seconds.get(permit.route, held)
+            self._hold_seconds[permit.route] = average + 0.2 * (held - average)
+            self._dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "in_flight": self.in_flight,
+                "max_concurrent": self.max_concurrent,
+                "routes": {
+                    route: {
+                        "in_flight": self.route_in_flight.get(route, 0),
+                        "max_concurrent": limit,
+                        "average_hold_seconds": round(self._hold_seconds.get(route, 0.0), 3),
+                    }
+                    for route, limit in self.route_limits.items()
+                },
+                "reserved_mb": round(self.reserved_mb, 1),
+                "memory_mb": self.memory_mb,
+                "queued": len(self._queue),
+                "max_queue": self.max_queue,
+                "max_wait_seconds": self.max_wait_seconds,
+                "tracked_users": len(self._buckets),
+            }
+
+
+admission = AdmissionController(
+    ADMISSION_MEMORY_MB,
+    ADMISSION_MAX_CONCURRENT,
+    ADMISSION_MAX_QUEUE,
+    ADMISSION_MAX_WAIT_SECONDS,
+    ADMISSION_USER_RATE,
+    ADMISSION_USER_BURST,
+    route_limits={ANALYZE_ROUTE: ADMISSION_ANALYZE_CONCURRENT, EXPORT_ROUTE: ADMISSION_EXPORT_CONCURRENT},
+    enabled=ADMISSION_ENABLED,
+)
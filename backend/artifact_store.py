@@ -0,0 +1,320 @@
+"""
+Local content-addressed artifact store, shared by all processes on the host.
+Raw IFC downloads, analysis reports and epJSON exports are kept here instead
+of per process, so an artifact produced by one uvicorn worker or job worker
+(or before a restart) is reused by all the others.
+
+Artifacts are files under ARTIFACT_STORE_DIR/<kind>/<key[:2]>/<key>. Keys are
+SHA-256 digests over the source content and the version of the pipeline that
+produced the artifact (see artifact_key), so a changed input or pipeline never
+reads an old artifact. Files are written under a temporary name and renamed
+into place, so a reader sees a complete file or none at all. Reports and
+exports are fsynced first; IFC copies and refs are not, since they can be
+fetched from storage again (a copy cut short by a crash is caught by its size,
+see ifc_loader.stored_ifc_path).
+
+The total size is capped at ARTIFACT_STORE_MAX_BYTES. Every hit refreshes the
+file's mtime; a write that takes the store over the cap evicts the least
+recently used files down to ARTIFACT_STORE_LOW_WATER of it. Writes and
+eviction serialise on an flock()ed lock file; reads take no lock (a file
+evicted while open stays readable through the open handle).
+"""
+import os
+import time
+import uuid
+import fcntl
+import tempfile
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import IO, Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from jobs import register_worker_stats
+
+# ARTIFACT_STORE_DIR: shared by every process that should reuse the artifacts
+# ARTIFACT_STORE_MAX_BYTES: size cap (0 disables the store)
+# ARTIFACT_STORE_LOW_WATER: eviction frees down to this fraction of the cap
+ARTIFACT_STORE_DIR = os.environ.get("ARTIFACT_STORE_DIR") or os.path.join(tempfile.gettempdir(), "voxel-artifacts")
+ARTIFACT_STORE_MAX_BYTES = int(os.environ.get("ARTIFACT_STORE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+ARTIFACT_STORE_LOW_WATER = float(os.environ.get("ARTIFACT_STORE_LOW_WATER", "0.9"))
+# Temporary files older than this are left over from crashed writers
+STALE_TEMP_SECONDS = 3600
+READ_CHUNK_SIZE = 1024 * 1024
+
+# Artifact kinds
+IFC = "ifc"            # raw IFC bytes, by content SHA-256
+REFS = "refs"          # content SHA-256 of a storage object version
+ANALYSIS = "analysis"  # analysis reports (JSON)
+EPJSON = "epjson"      # EnergyPlus exports (JSON)
+KINDS = (IFC, REFS, ANALYSIS, EPJSON)
+# Copies of what is in Supabase Storage: written without fsync
+REFETCHABLE_KINDS = (IFC, REFS)
+
+
+def artifact_key(*parts: str) -> str:
+    """SHA-256 over the parts (e.g. pipeline name and version, source hash)."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ArtifactWriter:
+    """A file being written into the store; commit(key) publishes it, abort() drops it."""
+
+    def __init__(self, store: "ArtifactStore", kind: str):
+        self.kind = kind
+        self.durable = kind not in REFETCHABLE_KINDS
+        self.size = 0
+        self._store = store
+        self.path = store._temp_path()
+        self._file = open(self.path, "wb")
+
+    def write(self, data: bytes):
+        self.size += self._file.write(data)
+
+    def commit(self, key: str) -> str:
+        """Publish under key and return the artifact's path."""
+        if self.durable:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._file.close()
+        return self._store._publish(self.kind, key, self.path, self.size)
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class ArtifactStore:
+    """Size-capped LRU directory of artifacts, safe to share between processes."""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._counters: Dict[str, int] = {f"{kind}_{name}": 0 for kind in KINDS for name in ("hits", "misses", "writes")}
+        self._counters["evictions"] = 0
+        self._counters["evicted_bytes"] = 0
+        self._lock = threading.Lock()
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counters[name] += amount
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def path(self, kind: str, key: str) -> str:
+        return os.path.join(self.directory, kind, key[:2], key)
+
+    def _temp_path(self) -> str:
+        directory = os.path.join(self.directory, "tmp")
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, f"{os.getpid()}-{uuid.uuid4().hex}")
+
+    # --- reading ---
+
+    def lookup(self, kind: str, key: str) -> Optional[str]:
+        """Path of the artifact, marked as recently used, or None. Counts a hit or a miss."""
+        if not self.enabled:
+            return None
+        path = self.path(kind, key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self._count(f"{kind}_misses")
+            return None
+        self._count(f"{kind}_hits")
+        return path
+
+    def open(self, kind: str, key: str) -> Optional[IO[bytes]]:
+        """The artifact opened for reading, or None."""
+        path = self.lookup(kind, key)
+        if path is None:
+            return None
+        try:
+            return open(path, "rb")
+        except FileNotFoundError:
+            # Evicted in between
+            return None
+
+    def get(self, kind: str, key: str) -> Optional[bytes]:
+        """The artifact's contents, or None."""
+        source = self.open(kind, key)
+        if source is None:
+            return None
+        with source:
+            return source.read()
+
+    def chunks(self, kind: str, key: str) -> Optional[Iterator[bytes]]:
+        """The artifact as an iterator of chunks (the file is opened now), or None."""
+        source = self.open(kind, key)
+        if source is None:
+            return None
+
+        def read() -> Iterator[bytes]:
+            with source:
+                while True:
+                    chunk = source.read(READ_CHUNK_SIZE)
+                    if not chunk:
+                        return
+                    yield chunk
+        return read()
+
+    # --- writing ---
+
+    def writer(self, kind: str) -> ArtifactWriter:
+        return ArtifactWriter(self, kind)
+
+    def put(self, kind: str, key: str, data: bytes) -> Optional[str]:
+        """Store data under key and return its path (None if the store is disabled)."""
+        if not self.enabled:
+            return None
+        writer = self.writer(kind)
+        try:
+            writer.write(data)
+        except BaseException:
+            writer.abort()
+            raise
+        return writer.commit(key)
+
+    def tee(self, kind: str, key: str, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """Pass chunks through while writing them to the store; published only once all were consumed."""
+        if not self.enabled:
+            yield from chunks
+            return
+        writer = self.writer(kind)
+        try:
+            for chunk in chunks:
+                writer.write(chunk)
+                yield chunk
+        except BaseException:
+            # Includes GeneratorExit when a client stops reading a streamed response
+            writer.abort()
+            raise
+        writer.commit(key)
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(self.directory, exist_ok=True)
+        descriptor = os.open(os.path.join(self.directory, ".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(descriptor, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(descriptor)
+
+    def _publish(self, kind: str, key: str, temp_path: str, size: int) -> str:
+        destination = self.path(kind, key)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        with self._locked():
+            usage = self._read_usage()
+            try:
+                existing = os.path.getsize(destination)
+            except FileNotFoundError:
+                existing = None
+            if existing == size:
+                # Same key, same contents: another process was faster
+                os.remove(temp_path)
+            else:
+                # New, or a file that was not fsynced and got cut short by a crash
+                os.replace(temp_path, destination)
+                usage += size - (existing or 0)
+                self._count(f"{kind}_writes")
+            if usage > self.max_bytes:
+                usage = self._evict()
+            self._write_usage(usage)
+        return destination
+
+    # --- size accounting and eviction (callers hold the lock) ---
+
+    def _usage_path(self) -> str:
+        return os.path.join(self.directory, ".usage")
+
+    def _read_usage(self) -> int:
+        try:
+            with open(self._usage_path()) as source:
+                return int(source.read())
+        except (FileNotFoundError, ValueError):
+            return sum(size for _, size, _ in self._scan())
+
+    def _write_usage(self, usage: int):
+        with open(self._usage_path(), "w") as target:
+            target.write(str(usage))
+
+    def _scan(self) -> List[Tuple[float, int, str]]:
+        """(mtime, size, path) of every artifact."""
+        files = []
+        for kind in KINDS:
+            root = os.path.join(self.directory, kind)
+            if not os.path.isdir(root):
+                continue
+            for shard in os.scandir(root):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files
+
+    def _evict(self) -> int:
+        """Remove the least recently used artifacts down to the low-water mark; returns the new usage."""
+        files = sorted(self._scan())
+        usage = sum(size for _, size, _ in files)
+        target = self.max_bytes * ARTIFACT_STORE_LOW_WATER
+        for _, size, path in files:
+            if usage <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            usage -= size
+            self._count("evictions")
+            self._count("evicted_bytes", size)
+        self._remove_stale_temp_files()
+        return usage
+
+    def _remove_stale_temp_files(self):
+        directory = os.path.join(self.directory, "tmp")
+        if not os.path.isdir(directory):
+            return
+        cutoff = time.time() - STALE_TEMP_SECONDS
+        for entry in os.scandir(directory):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    # --- stats ---
+
+    def counters(self) -> Dict[str, int]:
+        """Hits, misses and writes per kind, and evictions, of this process."""
+        with self._lock:
+            return dict(self._counters)
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            with open(self._usage_path()) as source:
+                usage: Optional[int] = int(source.read())
+        except (FileNotFoundError, ValueError):
+            usage = None
+        return {
+            "directory": self.directory,
+            "enabled": self.enabled,
+            "bytes": usage,
+            "max_bytes": self.max_bytes,
+            **self.counters(),
+        }
+
+
+artifact_store = ArtifactStore(ARTIFACT_STORE_DIR, ARTIFACT_STORE_MAX_BYTES)
+register_worker_stats("artifacts", artifact_store.counters)
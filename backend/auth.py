@@ -1,15 +1,28 @@
 """
 Authentication utilities for FastAPI backend.
 Handles Supabase JWT token validation and user extraction.
+
+Verified tokens are cached by digest until their exp, so a viewer session
+sending the same token on every request is verified once. Tokens signed with
+asymmetric keys (RS256/ES256/...) are verified against the project's JWKS,
+which is cached locally and refreshed by a background thread.
+
+jwt (and the cryptography backends it loads) is imported on first use; the
+app's warm-up (warmup.py) imports it in the background after start.
 """
 import os
-from typing import Optional
-from fastapi import HTTPException, Security, status, Depends
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
+import httpx
+from fastapi import HTTPException, Security, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from supabase_client import supabase
-import jwt
 import time
 
+if TYPE_CHECKING:
+    import jwt
+
 security = HTTPBearer(auto_error=False)
 
 # Get JWT secret from environment (Supabase JWT secret)
@@ -17,6 +30,189 @@ security = HTTPBearer(auto_error=False)
 # You can find it in Supabase Dashboard -> Settings -> API -> JWT Secret
 SUPABASE_JWT_SECRET = os.environ.get("SUPABASE_JWT_SECRET")
 
+SUPABASE_URL = os.environ.get("SUPABASE_URL")
+SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
+# Public signing keys for asymmetric tokens
+SUPABASE_JWKS_URL = os.environ.get("SUPABASE_JWKS_URL") or (
+    f"{SUPABASE_URL.rstrip('/')}/auth/v1/.well-known/jwks.json" if SUPABASE_URL else None
+)
+JWKS_REFRESH_SECONDS = int(os.environ.get("JWKS_REFRESH_SECONDS", "600"))
+# A token with an unknown kid refetches the key set at most this often
+JWKS_MIN_REFETCH_SECONDS = 30
+ASYMMETRIC_ALGORITHMS = ("RS256", "RS384", "RS512", "PS256", "PS384", "PS512", "ES256", "ES384", "ES512", "EdDSA")
+
+# Verified tokens kept; tokens without exp are re-verified after AUTH_TOKEN_CACHE_MAX_TTL seconds
+AUTH_TOKEN_CACHE_SIZE = int(os.environ.get("AUTH_TOKEN_CACHE_SIZE", "10000"))
+AUTH_TOKEN_CACHE_MAX_TTL = int(os.environ.get("AUTH_TOKEN_CACHE_MAX_TTL", "300"))
+
+
+class TokenCache:
+    """Bounded LRU of verified users, keyed by token digest and dropped at the token's exp."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[bytes, Tuple[dict, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def get(self, token: str) -> Optional[dict]:
+        key = hashlib.sha256(token.encode()).digest()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= time.time():
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[0])
+
+    def put(self, token: str, user: dict, expires_at: float):
+        key = hashlib.sha256(token.encode()).digest()
+        with self._lock:
+            self._entries[key] = (dict(user), expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+            }
+
+
+class SigningKeys:
+    """
+    Locally cached JWKS. The first lookup fetches the key set and starts a
+    daemon thread that refetches it every JWKS_REFRESH_SECONDS, so key
+    rotation is picked up without blocking requests.
+    """
+
+    def __init__(self, url: Optional[str]):
+        self.url = url
+        self._keys: Dict[Optional[str], "jwt.PyJWK"] = {}
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+        self._refresher: Optional[threading.Thread] = None
+        self._fetched_at = 0.0
+        self.refreshes = 0
+        self.failures = 0
+
+    def _fetch(self):
+        import jwt
+
+        headers = {"apikey": SUPABASE_KEY} if SUPABASE_KEY else None
+        try:
+            response = httpx.get(self.url, headers=headers, timeout=10.0)
+            response.raise_for_status()
+            keys = {}
+            for data in response.json().get("keys", []):
+                try:
+                    key = jwt.PyJWK(data)
+                except jwt.PyJWKError:
+                    continue
+                keys[data.get("kid")] = key
+            with self._lock:
+                self._keys = keys
+                self.refreshes += 1
+        except Exception as e:
+            with self._lock:
+                self.failures += 1
+            print(f"JWKS refresh failed: {e}")
+        finally:
+            with self._lock:
+                self._fetched_at = time.time()
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(JWKS_REFRESH_SECONDS)
+            self._fetch()
+
+    def get(self, kid: Optional[str]) -> Optional["jwt.PyJWK"]:
+        if not self.url:
+            return None
+        with self._lock:
+            key = self._keys.get(kid)
+            start = self._refresher is None
+            if start:
+                self._refresher = threading.Thread(target=self._refresh_loop, name="jwks-refresh", daemon=True)
+        if start:
+            self._refresher.start()
+        if key is None:
+            # First use or an unknown (newly rotated) key; one thread fetches, the others wait for it
+            with self._fetch_lock:
+                with self._lock:
+                    key = self._keys.get(kid)
+                    stale = time.time() - self._fetched_at >= JWKS_MIN_REFETCH_SECONDS
+                if key is None and stale:
+                    self._fetch()
+                    with self._lock:
+                        key = self._keys.get(kid)
+        return key
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "url": self.url,
+                "keys": len(self._keys),
+                "refreshes": self.refreshes,
+                "failures": self.failures,
+                "fetched_at": self._fetched_at or None,
+            }
+
+
+token_cache = TokenCache(AUTH_TOKEN_CACHE_SIZE)
+signing_keys = SigningKeys(SUPABASE_JWKS_URL)
+
+
+def auth_stats() -> Dict[str, Any]:
+    return {"token_cache": token_cache.stats(), "jwks": signing_keys.stats()}
+
+
+def _decode(token: str) -> dict:
+    """Claims of a token, verified with the JWKS or the JWT secret depending on its algorithm."""
+    import jwt
+
+    header = jwt.get_unverified_header(token)
+    algorithm = header.get("alg")
+    if algorithm in ASYMMETRIC_ALGORITHMS:
+        key = signing_keys.get(header.get("kid"))
+        if key is None:
+            raise jwt.InvalidTokenError("Unknown signing key")
+        return jwt.decode(token, key.key, algorithms=[key.algorithm_name], audience="authenticated")
+
+    # For Supabase JWT, we can decode without secret to get claims
+    # But for production, you should verify the signature using the JWT secret
+    if SUPABASE_JWT_SECRET:
+        # Verify signature
+        return jwt.decode(
+            token,
+            SUPABASE_JWT_SECRET,
+            algorithms=["HS256"],
+            audience="authenticated"
+        )
+    # Decode without verification (less secure, but works for development)
+    # You should set SUPABASE_JWT_SECRET in production!
+    return jwt.decode(
+        token,
+        options={"verify_signature": False}
+    )
+
 def get_current_user(credentials: Optional[HTTPAuthorizationCredentials] = Security(security)) -> dict:
     """
     Extract and validate JWT token from Authorization header.
@@ -32,25 +228,14 @@ def get_current_user(credentials: Optional[HTTPAuthorizationCredentials] = Secur
         )
     
     token = credentials.credentials
+    cached = token_cache.get(token)
+    if cached is not None:
+        return cached
     
+    import jwt
+
     try:
-        # For Supabase JWT, we can decode without secret to get claims
-        # But for production, you should verify the signature using the JWT secret
-        if SUPABASE_JWT_SECRET:
-            # Verify signature
-            decoded = jwt.decode(
-                token,
-                SUPABASE_JWT_SECRET,
-                algorithms=["HS256"],
-                audience="authenticated"
-            )
-        else:
-            # Decode without verification (less secure, but works for development)
-            # You should set SUPABASE_JWT_SECRET in production!
-            decoded = jwt.decode(
-                token,
-                options={"verify_signature": False}
-            )
+        decoded = _decode(token)
         
         # Check expiration
         exp = decoded.get("exp")
@@ -70,12 +255,16 @@ def get_current_user(credentials: Optional[HTTPAuthorizationCredentials] = Secur
             )
         
         # Return user information
-        return {
+        user = {
             "id": user_id,
             "email": email,
             "role": decoded.get("role", "authenticated")
         }
+        token_cache.put(token, user, min(float(exp), time.time() + AUTH_TOKEN_CACHE_MAX_TTL) if exp else time.time() + AUTH_TOKEN_CACHE_MAX_TTL)
+        return user
     
+    except HTTPException:
+        raise
     except jwt.ExpiredSignatureError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
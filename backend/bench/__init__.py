@@ -0,0 +1 @@
+"""Benchmarks of the backend against an in-process Supabase stand-in (python -m bench)."""
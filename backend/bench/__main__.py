@@ -0,0 +1,164 @@
+"""
+Run the benchmarks: python -m bench [options] (from backend/).
+python -m bench --load runs the open-loop load test instead.
+See bench/README.md.
+"""
+import os
+import sys
+import json
+import shutil
+import asyncio
+import argparse
+import tempfile
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "baseline.json")
+SIZE_SUFFIXES = {"k": 1000, "m": 1000000}
+LATENCY_SCENARIOS = "startup,analyze,analyze-cached,export,export-cached,projects,files"
+LOAD_SCENARIOS = "export,analyze"
+JWT_SECRET = "bench-only-jwt-secret-0123456789abcdef"
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().lower()
+    if text and text[-1] in SIZE_SUFFIXES:
+        return int(float(text[:-1]) * SIZE_SUFFIXES[text[-1]])
+    return int(text)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="python -m bench", description="Benchmark the backend against an in-process Supabase stand-in.")
+    parser.add_argument("--scenarios", help=f"comma-separated scenario names (default: all; with --load: {LOAD_SCENARIOS})")
+    parser.add_argument("--sizes", help="comma-separated sizes, e.g. 1k,10k,100k (default: 1k,10k; with --load: 1k)")
+    parser.add_argument("--requests", type=int, help="measured requests per scenario and size (default: per scenario)")
+    parser.add_argument("--concurrency", type=int, default=1, help="requests in flight at once (default: 1)")
+    parser.add_argument("--supabase-latency", type=float, default=0.0, help="ms added to every stand-in response (default: 0)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline file to compare against / save to")
+    parser.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed regression ratio (default: 0.25 = +25%%)")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--startup-budget", type=float, help="fail if the startup p50 (process start to first response) exceeds this many ms")
+    load = parser.add_argument_group("load test")
+    load.add_argument("--load", action="store_true", help="start requests at fixed rates instead of measuring latency")
+    load.add_argument("--rates", default="2,5,10,20,40", help="requests per second, one step each (default: 2,5,10,20,40)")
+    load.add_argument("--duration", type=float, default=10.0, help="seconds per step (default: 10)")
+    load.add_argument("--users", type=int, default=20, help="users the requests are spread over (default: 20)")
+    load.add_argument("--no-admission", action="store_true", help="disable admission control, for comparison")
+    args = parser.parse_args(argv)
+    args.scenarios = args.scenarios or (LOAD_SCENARIOS if args.load else LATENCY_SCENARIOS)
+    args.sizes = args.sizes or ("1k" if args.load else "1k,10k")
+    return args
+
+
+async def run(args, fake) -> list:
+    from bench.harness import measure
+    from bench.load import run_load
+    from bench.scenarios import SCENARIOS, Bench
+    from bench.startup import STARTUP, STARTUP_RUNS, measure_startup
+
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS and not (name == STARTUP and not args.load)]
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(unknown)} (available: {', '.join([STARTUP, *SCENARIOS])})")
+    sizes = [parse_size(size) for size in args.sizes.split(",") if size.strip()]
+
+    bench = Bench(fake, JWT_SECRET, users=args.users if args.load else 1)
+    results = []
+    try:
+        for name in names:
+            if name == STARTUP:
+                # Fresh processes, so once rather than per size
+                print(f"{name} (process start to first response), {args.requests or STARTUP_RUNS} runs ...", flush=True)
+                results.append(measure_startup(args.requests or STARTUP_RUNS))
+                continue
+            scenario = SCENARIOS[name]
+            for size in sizes:
+                print(f"{name} ({scenario.description}), size {size} ...", flush=True)
+                if args.load:
+                    results.extend(await run_load(bench, scenario, size, [float(rate) for rate in args.rates.split(",")], args.duration))
+                else:
+                    results.append(await measure(bench, scenario, size, args.requests or scenario.requests, args.concurrency))
+    finally:
+        await bench.close()
+    return results
+
+
+def report_load(args, results) -> int:
+    from bench.load import format_load_table
+
+    print()
+    print(f"Admission control {'off' if args.no_admission else 'on'}, {args.users} users")
+    print(format_load_table(results))
+    if args.json:
+        with open(args.json, "w") as target:
+            json.dump(results, target, indent=2)
+    failed = [result for result in results if result["errors"]]
+    for result in failed:
+        print(f"{result['scenario']}/{result['size']} at {result['rate']:g}/s: {result['errors']} failed requests (first: {result['first_error']})")
+    return 1 if failed else 0
+
+
+def main(argv=None) -> int:
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+
+    from bench.fake_supabase import FakeSupabase
+
+    fake = FakeSupabase(latency=args.supabase_latency / 1000)
+    url = fake.start()
+    # The app (and the job workers it spawns) read these at import time
+    os.environ["SUPABASE_URL"] = url
+    os.environ["SUPABASE_KEY"] = "bench-service-role-key"
+    os.environ["SUPABASE_JWT_SECRET"] = JWT_SECRET
+    os.environ.setdefault("ANALYSIS_MAX_JOBS_PER_USER", str(max(2, args.concurrency)))
+    # A fresh artifact store, so results do not depend on earlier runs
+    artifacts = tempfile.mkdtemp(prefix="voxel-bench-artifacts-")
+    os.environ["ARTIFACT_STORE_DIR"] = artifacts
+    if args.no_admission:
+        os.environ["ADMISSION_ENABLED"] = "0"
+    if not args.load:
+        # Latency runs send every request as one user
+        os.environ.setdefault("ADMISSION_USER_RATE", "0")
+
+    from bench.harness import compare, format_table, load_baseline, save_baseline
+    from bench.startup import STARTUP, format_startup
+
+    try:
+        results = asyncio.run(run(args, fake))
+    finally:
+        fake.stop()
+        shutil.rmtree(artifacts, ignore_errors=True)
+
+    if args.load:
+        return report_load(args, results)
+    baseline = None if args.save_baseline else load_baseline(args.baseline)
+    print()
+    print(format_table(results, baseline))
+    for result in results:
+        if result["scenario"] == STARTUP and not result["errors"]:
+            print()
+            print(format_startup(result))
+    if args.json:
+        with open(args.json, "w") as target:
+            json.dump(results, target, indent=2)
+
+    regressions = compare(results, baseline, args.tolerance)
+    for result in results:
+        if result["scenario"] == STARTUP and args.startup_budget is not None and result["p50_ms"] > args.startup_budget:
+            regressions.append(f"{STARTUP}: p50_ms {result['p50_ms']} over the budget of {args.startup_budget:g} ms")
+    if args.save_baseline:
+        save_baseline(args.baseline, results)
+        print(f"\nBaseline written to {args.baseline}")
+    elif baseline is None:
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline to create one.")
+    if regressions:
+        print(f"\n{'!' * 72}\nREGRESSIONS (tolerance {args.tolerance:.0%}):")
+        for regression in regressions:
+            print(f"  {regression}")
+        print("!" * 72)
+        return 1
+    if baseline is not None:
+        print(f"\nNo regressions against {args.baseline}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
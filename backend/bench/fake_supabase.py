@@ -0,0 +1,689 @@
+"""
+In-process stand-in for Supabase, for benchmarks.
+Serves the subset of PostgREST and Storage the backend uses from in-memory
+tables and buckets, on a local port in a background thread. The backend's
+own clients (data_access, supabase_client, ifc_loader, job workers) talk to
+it over HTTP like to the real project, so their request handling is part of
+what is measured.
+
+Supported PostgREST: select with `*`/column lists and one level of embedded
+children (`project_access!inner(permission)`, joined on `<parent>_id`),
+filters eq/neq/lt/lte/gt/gte/in/is/cs/like/ilike with `not.` and nested
+`or=(...and(...))`, order/limit/offset, `Prefer: count=exact`, single-object
+responses, insert/update/delete. project_access is derived from projects,
+shares and memberships the way the database triggers maintain it.
+
+Supported Storage: object download (with Range), HEAD, upload, list (one
+folder level), signed download URLs (single and batch), signed upload URLs
+and delete. /auth/v1/.well-known/jwks.json returns an empty key set.
+"""
+import json
+import re
+import threading
+import time
+import uuid
+import email.utils
+import urllib.parse
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+def now_iso() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f+00:00")
+
+
+def _split_top_level(text: str, separator: str = ",") -> List[str]:
+    """Split at separators outside parentheses, braces and double quotes."""
+    parts, depth, quoted, current = [], 0, False, []
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char in "({":
+            depth += 1
+        elif not quoted and char in ")}":
+            depth -= 1
+        if char == separator and depth == 0 and not quoted:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+    if current or parts:
+        parts.append("".join(current))
+    return parts
+
+
+def _unquote(value: str) -> str:
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        return value[1:-1].replace('\\"', '"').replace("\\\\", "\\")
+    return value
+
+
+def _like_regex(pattern: str, flags: int = 0) -> "re.Pattern":
+    regex, escaped = [], False
+    for char in pattern:
+        if escaped:
+            regex.append(re.escape(char))
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char in "%*":
+            regex.append(".*")
+        elif char == "_":
+            regex.append(".")
+        else:
+            regex.append(re.escape(char))
+    return re.compile("".join(regex) + r"\Z", flags | re.DOTALL)
+
+
+def _compare(op: str, actual: Any, expected: str) -> bool:
+    if op == "is":
+        target = {"null": None, "true": True, "false": False}.get(expected.lower(), expected)
+        return actual is target if target is None or isinstance(target, bool) else actual == target
+    if op == "in":
+        values = {_unquote(value) for value in _split_top_level(expected.strip()[1:-1])}
+        return actual is not None and str(actual) in values
+    if op == "cs":
+        wanted = {_unquote(value) for value in _split_top_level(expected.strip()[1:-1]) if value}
+        return actual is not None and wanted.issubset(set(actual))
+    if actual is None:
+        return False
+    expected = _unquote(expected)
+    if op in ("like", "ilike"):
+        return bool(_like_regex(expected, re.IGNORECASE if op == "ilike" else 0).match(str(actual)))
+    if isinstance(actual, bool):
+        actual = str(actual).lower()
+    elif isinstance(actual, (int, float)):
+        try:
+            expected = type(actual)(expected)
+        except ValueError:
+            actual = str(actual)
+    return {
+        "eq": lambda: actual == expected,
+        "neq": lambda: actual != expected,
+        "lt": lambda: actual < expected,
+        "lte": lambda: actual <= expected,
+        "gt": lambda: actual > expected,
+        "gte": lambda: actual >= expected,
+    }[op]()
+
+
+class Condition:
+    """One PostgREST filter: `column=op.value`, `or=(...)`, `and=(...)`, optionally negated."""
+
+    def __init__(self, column: Optional[str], op: str, value: Any, negate: bool = False):
+        self.column = column
+        self.op = op
+        self.value = value
+        self.negate = negate
+
+    @classmethod
+    def parse(cls, column: str, expression: str) -> "Condition":
+        negate = expression.startswith("not.")
+        if negate:
+            expression = expression[4:]
+        if column in ("or", "and"):
+            return cls(None, column, [cls.parse_nested(part) for part in _split_top_level(expression[1:-1])], negate)
+        op, _, value = expression.partition(".")
+        return cls(column, op, value, negate)
+
+    @classmethod
+    def parse_nested(cls, expression: str) -> "Condition":
+        expression = expression.strip()
+        for group in ("or", "and", "not.or", "not.and"):
+            if expression.startswith(group + "("):
+                return cls.parse(group.split(".")[-1], ("not." if group.startswith("not.") else "") + expression[len(group):])
+        column, _, rest = expression.partition(".")
+        return cls.parse(column, rest)
+
+    def matches(self, row: dict) -> bool:
+        if self.op == "or":
+            result = any(condition.matches(row) for condition in self.value)
+        elif self.op == "and":
+            result = all(condition.matches(row) for condition in self.value)
+        else:
+            result = _compare(self.op, row.get(self.column), self.value)
+        return not result if self.negate else result
+
+
+class Query:
+    """A parsed PostgREST read: columns, embedded children, filters per table, order and range."""
+
+    def __init__(self, table: str, params: List[Tuple[str, str]]):
+        self.table = table
+        self.columns: List[str] = ["*"]
+        # embedded table -> (columns, inner)
+        self.embeds: Dict[str, Tuple[List[str], bool]] = {}
+        self.filters: List[Condition] = []
+        self.embed_filters: Dict[str, List[Condition]] = {}
+        self.order: List[Tuple[str, bool]] = []
+        self.limit: Optional[int] = None
+        self.offset = 0
+        for key, value in params:
+            if key == "select":
+                self._parse_select(value)
+            elif key == "order":
+                for term in value.split(","):
+                    column, *modifiers = term.split(".")
+                    self.order.append((column, "desc" in modifiers))
+            elif key == "limit":
+                self.limit = int(value)
+            elif key == "offset":
+                self.offset = int(value)
+            elif key in ("columns", "on_conflict"):
+                continue
+            else:
+                embed, _, column = key.rpartition(".")
+                if embed and embed not in ("or", "and"):
+                    self.embed_filters.setdefault(embed, []).append(Condition.parse(column, value))
+                else:
+                    self.filters.append(Condition.parse(key, value))
+
+    def _parse_select(self, value: str):
+        self.columns = []
+        for term in _split_top_level(value):
+            term = term.strip()
+            if not term:
+                continue
+            if "(" in term:
+                name, _, inner_columns = term.partition("(")
+                table, _, hint = name.partition("!")
+                columns = [column.strip() for column in inner_columns.rstrip(")").split(",") if column.strip()]
+                self.embeds[table.strip()] = (columns, hint == "inner")
+            else:
+                self.columns.append(term)
+
+    @staticmethod
+    def project(row: dict, columns: List[str]) -> dict:
+        if "*" in columns:
+            return dict(row)
+        return {column: row.get(column) for column in columns}
+
+
+class Tables:
+    """In-memory tables with hash indexes on demand (dropped on every write)."""
+
+    def __init__(self):
+        self.rows: Dict[str, List[dict]] = {}
+        self._indexes: Dict[Tuple[str, str], Dict[Any, List[dict]]] = {}
+        self._access_dirty = True
+        self.lock = threading.RLock()
+
+    # --- writes ---
+
+    def _written(self, table: str):
+        self._indexes = {key: index for key, index in self._indexes.items() if key[0] != table}
+        if table in ("projects", "project_shares", "team_members", "company_members", "teams", "companies"):
+            self._access_dirty = True
+            self._indexes = {key: index for key, index in self._indexes.items() if key[0] != "project_access"}
+
+    def insert(self, table: str, rows: Iterable[dict], merge: bool = False) -> List[dict]:
+        """Append rows; with merge (an upsert), a row whose id exists updates that row instead."""
+        created = []
+        with self.lock:
+            target = self.rows.setdefault(table, [])
+            by_id = {existing.get("id"): existing for existing in target} if merge else {}
+            for row in rows:
+                row = dict(row)
+                existing = by_id.get(row.get("id"))
+                if existing is not None:
+                    existing.update(row)
+                    created.append(existing)
+                    continue
+                if table != "project_access":
+                    row.setdefault("id", str(uuid.uuid4()))
+                    row.setdefault("created_at", now_iso())
+                    if table in ("projects", "teams", "companies", "marketplace_items"):
+                        row.setdefault("updated_at", row["created_at"])
+                target.append(row)
+                created.append(row)
+            self._written(table)
+        return created
+
+    def update(self, table: str, conditions: List[Condition], values: dict) -> List[dict]:
+        with self.lock:
+            updated = [row for row in self.rows.get(table, []) if all(c.matches(row) for c in conditions)]
+            for row in updated:
+                row.update(values)
+            self._written(table)
+        return updated
+
+    def delete(self, table: str, conditions: List[Condition]) -> List[dict]:
+        with self.lock:
+            rows = self.rows.get(table, [])
+            deleted = [row for row in rows if all(c.matches(row) for c in conditions)]
+            if deleted:
+                removed = {id(row) for row in deleted}
+                self.rows[table] = [row for row in rows if id(row) not in removed]
+            self._written(table)
+        return deleted
+
+    # --- project_access, as maintained by the database triggers ---
+
+    def _refresh_access(self):
+        if not self._access_dirty:
+            return
+        members: Dict[Tuple[str, str], List[dict]] = {}
+        for table, key in (("team_members", "team_id"), ("company_members", "company_id")):
+            for row in self.rows.get(table, []):
+                members.setdefault((table, row[key]), []).append(row)
+        owners = {
+            (table, row["id"]): row.get("owner_id")
+            for table in ("teams", "companies") for row in self.rows.get(table, [])
+        }
+        grants: Dict[Tuple[str, str, str], Optional[str]] = {}
+
+        def grant(user_id, project_id, permission, expires_at=None):
+            if not user_id:
+                return
+            key = (user_id, project_id, permission)
+            if key in grants:
+                current = grants[key]
+                grants[key] = None if current is None or expires_at is None else max(current, expires_at)
+            else:
+                grants[key] = expires_at
+
+        def member_permission(role):
+            return "admin" if role in ("owner", "admin") else "read"
+
+        for project in self.rows.get("projects", []):
+            grant(project.get("owner_user_id"), project["id"], "owner")
+            for column, table, members_table in (
+                ("owner_team_id", "teams", "team_members"), ("owner_company_id", "companies", "company_members")
+            ):
+                if project.get(column):
+                    grant(owners.get((table, project[column])), project["id"], "owner")
+                    for member in members.get((members_table, project[column]), []):
+                        grant(member["user_id"], project["id"], member_permission(member.get("role")))
+        now = now_iso()
+        for share in self.rows.get("project_shares", []):
+            expires_at = share.get("expires_at")
+            if expires_at is not None and expires_at <= now:
+                continue
+            permission = share.get("permission") or "read"
+            grant(share.get("shared_with_user_id"), share["project_id"], permission, expires_at)
+            for column, members_table in (("shared_with_team_id", "team_members"), ("shared_with_company_id", "company_members")):
+                for member in members.get((members_table, share.get(column)), []) if share.get(column) else []:
+                    grant(member["user_id"], share["project_id"], permission, expires_at)
+        self.rows["project_access"] = [
+            {"user_id": user_id, "project_id": project_id, "permission": permission, "expires_at": expires_at}
+            for (user_id, project_id, permission), expires_at in grants.items()
+        ]
+        self._access_dirty = False
+
+    # --- reads ---
+
+    def _index(self, table: str, column: str) -> Dict[Any, List[dict]]:
+        key = (table, column)
+        index = self._indexes.get(key)
+        if index is None:
+            index = {}
+            for row in self.rows.get(table, []):
+                value = row.get(column)
+                if isinstance(value, list):
+                    continue
+                index.setdefault(value, []).append(row)
+            self._indexes[key] = index
+        return index
+
+    def _candidates(self, table: str, conditions: List[Condition]) -> List[dict]:
+        """Rows matching conditions, narrowed through an index when there is an eq/in filter."""
+        for condition in conditions:
+            if condition.negate or condition.column is None:
+                continue
+            if condition.op == "eq":
+                rows = self._index(table, condition.column).get(_unquote(condition.value), [])
+                break
+            if condition.op == "in":
+                index = self._index(table, condition.column)
+                rows = [row for value in _split_top_level(condition.value.strip()[1:-1]) for row in index.get(_unquote(value), [])]
+                break
+        else:
+            rows = self.rows.get(table, [])
+        return [row for row in rows if all(condition.matches(row) for condition in conditions)]
+
+    def select(self, query: Query) -> Tuple[List[dict], int]:
+        """Rows of a read (projected, with embedded children) and the total before limit/offset."""
+        with self.lock:
+            if query.table == "project_access" or "project_access" in query.embeds:
+                self._refresh_access()
+            foreign_key = query.table.rstrip("s") + "_id"
+            children: Dict[str, Dict[Any, List[dict]]] = {}
+            rows = None
+            for embed, (columns, inner) in query.embeds.items():
+                matching = self._candidates(embed, query.embed_filters.get(embed, []))
+                by_parent: Dict[Any, List[dict]] = {}
+                for child in matching:
+                    by_parent.setdefault(child.get(foreign_key), []).append(child)
+                children[embed] = by_parent
+                if inner:
+                    parents = self._index(query.table, "id")
+                    allowed = [parent for parent_id in by_parent for parent in parents.get(parent_id, [])]
+                    rows = allowed if rows is None else [row for row in rows if row.get("id") in by_parent]
+            if rows is None:
+                rows = self._candidates(query.table, query.filters)
+            else:
+                rows = [row for row in rows if all(condition.matches(row) for condition in query.filters)]
+
+        for column, descending in reversed(query.order):
+            present = [row for row in rows if row.get(column) is not None]
+            missing = [row for row in rows if row.get(column) is None]
+            present.sort(key=lambda row: row[column], reverse=descending)
+            # PostgreSQL puts nulls last ascending and first descending
+            rows = missing + present if descending else present + missing
+        total = len(rows)
+        end = None if query.limit is None else query.offset + query.limit
+        rows = rows[query.offset:end]
+
+        result = []
+        for row in rows:
+            item = Query.project(row, query.columns)
+            for embed, (columns, _) in query.embeds.items():
+                item[embed] = [Query.project(child, columns) for child in children[embed].get(row.get("id"), [])]
+            result.append(item)
+        return result, total
+
+
+class Buckets:
+    """In-memory storage objects: {bucket: {path: (data, updated_at, content_type)}}."""
+
+    def __init__(self):
+        self.objects: Dict[str, Dict[str, Tuple[bytes, float, str]]] = {}
+        self._folders: Dict[Tuple[str, str], List[str]] = {}
+        self.lock = threading.Lock()
+
+    def put(self, bucket: str, path: str, data: bytes, content_type: str = "application/octet-stream"):
+        with self.lock:
+            self.objects.setdefault(bucket, {})[path] = (data, time.time(), content_type)
+            self._folders.pop((bucket, path.rpartition("/")[0]), None)
+
+    def put_many(self, bucket: str, items: Iterable[Tuple[str, bytes]], content_type: str = "application/octet-stream"):
+        with self.lock:
+            objects = self.objects.setdefault(bucket, {})
+            stamp = time.time()
+            for path, data in items:
+                objects[path] = (data, stamp, content_type)
+            self._folders = {key: names for key, names in self._folders.items() if key[0] != bucket}
+
+    def get(self, bucket: str, path: str) -> Optional[Tuple[bytes, float, str]]:
+        return self.objects.get(bucket, {}).get(path)
+
+    def remove(self, bucket: str, paths: Iterable[str]) -> List[str]:
+        removed = []
+        with self.lock:
+            objects = self.objects.get(bucket, {})
+            for path in paths:
+                if objects.pop(path, None) is not None:
+                    removed.append(path)
+                    self._folders.pop((bucket, path.rpartition("/")[0]), None)
+        return removed
+
+    def list(self, bucket: str, folder: str) -> List[str]:
+        """Sorted entry names directly inside a folder (files and sub-folders)."""
+        folder = folder.strip("/")
+        with self.lock:
+            names = self._folders.get((bucket, folder))
+            if names is None:
+                prefix = folder + "/" if folder else ""
+                found = set()
+                for path in self.objects.get(bucket, {}):
+                    if path.startswith(prefix):
+                        found.add(path[len(prefix):].split("/", 1)[0])
+                names = self._folders[(bucket, folder)] = sorted(found)
+        return names
+
+
+class FakeSupabase:
+    """The stand-in server. `latency` seconds are added to every request to emulate the network round trip."""
+
+    def __init__(self, latency: float = 0.0):
+        self.tables = Tables()
+        self.buckets = Buckets()
+        self.latency = latency
+        self.requests = 0
+        # Time spent inside the stand-in (excluding the emulated latency), so reports can subtract it
+        self.busy_seconds = 0.0
+        self._stats_lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self, port: int = 0) -> str:
+        fake = self
+
+        class Handler(_Handler):
+            server_fake = fake
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-supabase", daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def reset(self):
+        """Drop all rows and objects."""
+        self.tables = Tables()
+        self.buckets = Buckets()
+
+    def record(self, seconds: float):
+        with self._stats_lock:
+            self.requests += 1
+            self.busy_seconds += seconds
+
+    def counters(self) -> Tuple[int, float]:
+        with self._stats_lock:
+            return self.requests, self.busy_seconds
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without TCP_NODELAY each
+    # response would wait for the client's delayed ACK (~40 ms)
+    disable_nagle_algorithm = True
+    server_fake: FakeSupabase = None
+
+    def log_message(self, *args):
+        pass
+
+    # --- plumbing ---
+
+    def _body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, status: int, body: bytes = b"", content_type: str = "application/json", headers: Optional[Dict[str, str]] = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if body and self.command != "HEAD":
+            view = memoryview(body)
+            for start in range(0, len(view), 1024 * 1024):
+                self.wfile.write(view[start:start + 1024 * 1024])
+
+    def _json(self, status: int, payload: Any, headers: Optional[Dict[str, str]] = None):
+        self._send(status, json.dumps(payload).encode(), headers=headers)
+
+    def _dispatch(self):
+        fake = self.server_fake
+        if fake.latency:
+            time.sleep(fake.latency)
+        started = time.perf_counter()
+        try:
+            url = urllib.parse.urlsplit(self.path)
+            path = urllib.parse.unquote(url.path)
+            if path.startswith("/rest/v1/"):
+                self._rest(path[len("/rest/v1/"):], urllib.parse.parse_qsl(url.query, keep_blank_values=True))
+            elif path.startswith("/storage/v1/"):
+                self._storage(path[len("/storage/v1/"):])
+            elif path == "/auth/v1/.well-known/jwks.json":
+                self._json(200, {"keys": []})
+            else:
+                self._json(404, {"message": f"Not found: {path}"})
+        except Exception as e:
+            self._json(500, {"message": f"{type(e).__name__}: {e}"})
+        finally:
+            fake.record(time.perf_counter() - started)
+
+    do_GET = do_HEAD = do_POST = do_PUT = do_PATCH = do_DELETE = _dispatch
+
+    # --- PostgREST ---
+
+    def _rest(self, table: str, params: List[Tuple[str, str]]):
+        tables = self.server_fake.tables
+        prefer = self.headers.get("Prefer", "")
+        single = "vnd.pgrst.object" in (self.headers.get("Accept") or "")
+
+        if self.command in ("GET", "HEAD"):
+            query = Query(table, params)
+            rows, total = tables.select(query)
+        else:
+            query = Query(table, [(key, value) for key, value in params if key != "select"])
+            if self.command == "POST":
+                payload = json.loads(self._body() or b"[]")
+                rows = tables.insert(table, payload if isinstance(payload, list) else [payload], merge="merge-duplicates" in prefer)
+            elif self.command == "PATCH":
+                rows = tables.update(table, query.filters, json.loads(self._body() or b"{}"))
+            else:
+                rows = tables.delete(table, query.filters)
+            total = len(rows)
+            if "return=minimal" in prefer:
+                self._send(201 if self.command == "POST" else 204)
+                return
+
+        headers = {}
+        if "count=" in prefer:
+            first = query.offset if self.command in ("GET", "HEAD") else 0
+            headers["Content-Range"] = f"{first}-{first + len(rows) - 1}/{total}" if rows else f"*/{total}"
+        if single:
+            if len(rows) != 1:
+                self._json(406, {
+                    "code": "PGRST116",
+                    "message": "JSON object requested, multiple (or no) rows returned",
+                    "details": f"The result contains {len(rows)} rows",
+                    "hint": None,
+                })
+                return
+            self._json(200, rows[0], headers)
+            return
+        self._json(201 if self.command == "POST" else 200, rows, headers)
+
+    # --- Storage ---
+
+    def _storage(self, path: str):
+        buckets = self.server_fake.buckets
+        if not path.startswith("object/"):
+            self._json(404, {"statusCode": "404", "error": "not_found", "message": f"Not supported: {path}"})
+            return
+        rest = path[len("object/"):]
+        action, _, remainder = rest.partition("/")
+
+        if action == "list" and self.command == "POST":
+            options = json.loads(self._body() or b"{}")
+            bucket = remainder.strip("/")
+            folder = (options.get("prefix") or "").strip("/")
+            names = buckets.list(bucket, folder)
+            offset, limit = int(options.get("offset") or 0), int(options.get("limit") or 100)
+            rows = []
+            for name in names[offset:offset + limit]:
+                item = buckets.get(bucket, f"{folder}/{name}" if folder else name)
+                if item is None:
+                    rows.append({"name": name, "id": None, "updated_at": None, "created_at": None, "metadata": None})
+                else:
+                    stamp = datetime.fromtimestamp(item[1], timezone.utc).isoformat()
+                    rows.append({
+                        "name": name, "id": str(uuid.uuid5(uuid.NAMESPACE_URL, f"{bucket}/{folder}/{name}")),
+                        "updated_at": stamp, "created_at": stamp,
+                        "metadata": {"size": len(item[0]), "mimetype": item[2]},
+                    })
+            self._json(200, rows)
+            return
+
+        if action == "sign" and self.command == "POST":
+            options = json.loads(self._body() or b"{}")
+            bucket, _, object_path = remainder.partition("/")
+            expires = options.get("expiresIn", 3600)
+            if object_path:
+                if buckets.get(bucket, object_path) is None:
+                    self._json(400, {"statusCode": "404", "error": "not_found", "message": "Object not found"})
+                    return
+                self._json(200, {"signedURL": f"/object/sign/{bucket}/{urllib.parse.quote(object_path)}?token=fake-{expires}"})
+                return
+            self._json(200, [
+                {
+                    "path": item,
+                    "signedURL": f"/object/sign/{bucket}/{urllib.parse.quote(item)}?token=fake-{expires}"
+                    if buckets.get(bucket, item) is not None else None,
+                    "error": None if buckets.get(bucket, item) is not None else "Either the object does not exist or you do not have access to it",
+                }
+                for item in options.get("paths", [])
+            ])
+            return
+
+        if action == "upload" and remainder.startswith("sign/") and self.command == "POST":
+            bucket_path = remainder[len("sign/"):]
+            self._body()
+            self._json(200, {"url": f"/object/upload/sign/{urllib.parse.quote(bucket_path)}?token=fake-upload"})
+            return
+
+        if action in ("sign", "public", "authenticated"):
+            # Downloads through signed or public URLs
+            bucket, _, object_path = remainder.partition("/")
+        else:
+            bucket, object_path = action, remainder
+
+        if self.command == "DELETE":
+            options = json.loads(self._body() or b"{}")
+            removed = buckets.remove(bucket, options.get("prefixes") or ([object_path] if object_path else []))
+            self._json(200, [{"name": name} for name in removed])
+            return
+
+        if self.command in ("POST", "PUT"):
+            data = self._upload_data(self._body())
+            buckets.put(bucket, object_path, data, self.headers.get("Content-Type", "application/octet-stream").split(";")[0])
+            self._json(200, {"Key": f"{bucket}/{object_path}", "Id": str(uuid.uuid4())})
+            return
+
+        item = buckets.get(bucket, object_path)
+        if item is None:
+            self._json(400 if self.command == "GET" else 404, {"statusCode": "404", "error": "not_found", "message": "Object not found"})
+            return
+        data, stamp, content_type = item
+        headers = {
+            "ETag": f'"{len(data):x}-{int(stamp * 1000):x}"',
+            "Last-Modified": email.utils.formatdate(stamp, usegmt=True),
+            "Accept-Ranges": "bytes",
+        }
+        requested = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range") or "")
+        if requested:
+            start = int(requested.group(1))
+            end = int(requested.group(2)) if requested.group(2) else len(data) - 1
+            end = min(end, len(data) - 1)
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+            self._send(206, data[start:end + 1], content_type, headers)
+            return
+        self._send(200, data, content_type, headers)
+
+    def _upload_data(self, body: bytes) -> bytes:
+        """The file of a multipart upload (storage3 sends a `file` part), or the raw body."""
+        content_type = self.headers.get("Content-Type", "")
+        if not content_type.startswith("multipart/form-data"):
+            return body
+        boundary = content_type.split("boundary=", 1)[1].strip('"').encode()
+        for part in body.split(b"--" + boundary):
+            head, _, content = part.partition(b"\r\n\r\n")
+            if b'name="file"' in head:
+                return content[:-2] if content.endswith(b"\r\n") else content
+        return body
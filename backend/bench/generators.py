@@ -0,0 +1,262 @@
+"""
+Synthetic, deterministic benchmark data: IFC files, SceneModelRequest payloads
+and seed rows for the stand-in's tables and buckets.
+The same size and seed always produce the same bytes, so timings of two runs
+compare like for like.
+"""
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+import ifcopenshell.guid
+from bench.fake_supabase import FakeSupabase
+
+# Element mix of generated models: (IFC class, share, profile x, profile y, extrusion depth)
+IFC_ELEMENT_MIX = (
+    ("IfcWall", 0.5, 4.0, 0.2, 3.0),
+    ("IfcSlab", 0.15, 6.0, 6.0, 0.25),
+    ("IfcColumn", 0.15, 0.4, 0.4, 3.0),
+    ("IfcBeam", 0.1, 5.0, 0.3, 0.5),
+    ("IfcWindow", 0.05, 1.2, 0.1, 1.5),
+    ("IfcDoor", 0.05, 1.0, 0.1, 2.1),
+)
+# Classes whose IFC4 entity carries OverallHeight/OverallWidth (13 attributes instead of 9)
+_FILLING_CLASSES = ("IfcWindow", "IfcDoor")
+ELEMENTS_PER_STOREY = 2000
+
+SCENE_TYPES = ("IfcWall", "IfcWallStandardCase", "IfcWindow", "IfcDoor", "IfcSlab", "IfcFurniture")
+PROJECT_TAGS = ("residential", "office", "renovation", "retrofit", "tender", "as-built", "energy", "structural")
+
+BENCH_USER_ID = "00000000-0000-4000-8000-000000000001"
+OTHER_USER_ID = "00000000-0000-4000-8000-000000000002"
+BENCH_TEAM_ID = "00000000-0000-4000-8000-0000000000a1"
+
+
+def _guid(seed: int, number: int) -> str:
+    return ifcopenshell.guid.compress(f"{seed:08x}{number:024x}")
+
+
+def _real(value: float) -> str:
+    """STEP real literal (always with a decimal point)."""
+    text = repr(float(value))
+    return text if "." in text or "E" in text or "e" in text else text + "."
+
+
+def synthetic_ifc(elements: int, seed: int = 0, quantity_share: float = 0.5) -> bytes:
+    """
+    An IFC4 model with `elements` extruded building elements on storeys of
+    ELEMENTS_PER_STOREY, mixed as IFC_ELEMENT_MIX. Walls and slabs carry base
+    quantities with probability quantity_share; all other elements are
+    measured from their geometry by the analysis.
+    """
+    rng = random.Random(seed)
+    lines: List[str] = []
+    next_id = [0]
+
+    def add(entity: str) -> str:
+        next_id[0] += 1
+        reference = f"#{next_id[0]}"
+        lines.append(f"{reference}={entity};")
+        return reference
+
+    origin = add("IFCCARTESIANPOINT((0.,0.,0.))")
+    origin_2d = add("IFCCARTESIANPOINT((0.,0.))")
+    z_axis = add("IFCDIRECTION((0.,0.,1.))")
+    world = add(f"IFCAXIS2PLACEMENT3D({origin},$,$)")
+    profile_position = add(f"IFCAXIS2PLACEMENT2D({origin_2d},$)")
+    units = add("IFCUNITASSIGNMENT(({},{},{}))".format(
+        add("IFCSIUNIT(*,.LENGTHUNIT.,$,.METRE.)"),
+        add("IFCSIUNIT(*,.AREAUNIT.,$,.SQUARE_METRE.)"),
+        add("IFCSIUNIT(*,.VOLUMEUNIT.,$,.CUBIC_METRE.)"),
+    ))
+    context = add(f"IFCGEOMETRICREPRESENTATIONCONTEXT($,'Model',3,1.E-05,{world},$)")
+    body = add(f"IFCGEOMETRICREPRESENTATIONSUBCONTEXT('Body','Model',*,*,*,*,{context},$,.MODEL_VIEW.,$)")
+    project = add(f"IFCPROJECT('{_guid(seed, 1)}',$,'Benchmark {elements}',$,$,$,$,({context}),{units})")
+    site_placement = add(f"IFCLOCALPLACEMENT($,{world})")
+    site = add(f"IFCSITE('{_guid(seed, 2)}',$,'Site',$,$,{site_placement},$,$,.ELEMENT.,$,$,$,$,$)")
+    building_placement = add(f"IFCLOCALPLACEMENT({site_placement},{world})")
+    building = add(f"IFCBUILDING('{_guid(seed, 3)}',$,'Building',$,$,{building_placement},$,$,.ELEMENT.,$,$,$)")
+    add(f"IFCRELAGGREGATES('{_guid(seed, 4)}',$,$,$,{project},({site}))")
+    add(f"IFCRELAGGREGATES('{_guid(seed, 5)}',$,$,$,{site},({building}))")
+
+    classes = [entry[0] for entry in IFC_ELEMENT_MIX]
+    weights = [entry[1] for entry in IFC_ELEMENT_MIX]
+    shapes = {entry[0]: entry[2:] for entry in IFC_ELEMENT_MIX}
+    guid_number = 100
+    storeys = []
+    for storey_index in range(max(1, -(-elements // ELEMENTS_PER_STOREY))):
+        elevation = storey_index * 3.0
+        location = add(f"IFCCARTESIANPOINT((0.,0.,{_real(elevation)}))")
+        storey_axes = add(f"IFCAXIS2PLACEMENT3D({location},$,$)")
+        storey_placement = add(f"IFCLOCALPLACEMENT({building_placement},{storey_axes})")
+        guid_number += 1
+        storey = add(
+            f"IFCBUILDINGSTOREY('{_guid(seed, guid_number)}',$,'Level {storey_index}',$,$,{storey_placement},$,$,.ELEMENT.,{_real(elevation)})"
+        )
+        storeys.append(storey)
+
+        contained = []
+        count = min(ELEMENTS_PER_STOREY, elements - storey_index * ELEMENTS_PER_STOREY)
+        for index in range(count):
+            ifc_class = rng.choices(classes, weights)[0]
+            x_dim, y_dim, depth = shapes[ifc_class]
+            scale = rng.uniform(0.8, 1.2)
+            point = add(f"IFCCARTESIANPOINT(({_real((index % 50) * 7.0)},{_real((index // 50) * 7.0)},0.))")
+            axes = add(f"IFCAXIS2PLACEMENT3D({point},$,$)")
+            placement = add(f"IFCLOCALPLACEMENT({storey_placement},{axes})")
+            profile = add(f"IFCRECTANGLEPROFILEDEF(.AREA.,$,{profile_position},{_real(x_dim * scale)},{_real(y_dim)})")
+            solid = add(f"IFCEXTRUDEDAREASOLID({profile},{world},{z_axis},{_real(depth)})")
+            representation = add(f"IFCSHAPEREPRESENTATION({body},'Body','SweptSolid',({solid}))")
+            shape = add(f"IFCPRODUCTDEFINITIONSHAPE($,$,({representation}))")
+            guid_number += 1
+            name = f"{ifc_class[3:]} {storey_index}-{index}"
+            if ifc_class in _FILLING_CLASSES:
+                element = add(
+                    f"{ifc_class.upper()}('{_guid(seed, guid_number)}',$,'{name}',$,$,{placement},{shape},$,{_real(depth)},{_real(x_dim)},$,$,$)"
+                )
+            else:
+                element = add(f"{ifc_class.upper()}('{_guid(seed, guid_number)}',$,'{name}',$,$,{placement},{shape},$,$)")
+            contained.append(element)
+
+            if ifc_class in ("IfcWall", "IfcSlab") and rng.random() < quantity_share:
+                area = x_dim * scale * (depth if ifc_class == "IfcWall" else y_dim)
+                volume = x_dim * scale * y_dim * depth
+                area_name, set_name = ("NetSideArea", "Qto_WallBaseQuantities") if ifc_class == "IfcWall" else ("NetArea", "Qto_SlabBaseQuantities")
+                area_quantity = add(f"IFCQUANTITYAREA('{area_name}',$,$,{_real(area)},$)")
+                volume_quantity = add(f"IFCQUANTITYVOLUME('NetVolume',$,$,{_real(volume)},$)")
+                quantities = add(
+                    f"IFCELEMENTQUANTITY('{_guid(seed, guid_number + 10_000_000)}',$,'{set_name}',$,$,({area_quantity},{volume_quantity}))"
+                )
+                add(f"IFCRELDEFINESBYPROPERTIES('{_guid(seed, guid_number + 20_000_000)}',$,$,$,({element}),{quantities})")
+        guid_number += 1
+        add(
+            f"IFCRELCONTAINEDINSPATIALSTRUCTURE('{_guid(seed, guid_number + 30_000_000)}',$,$,$,({','.join(contained)}),{storey})"
+        )
+    add(f"IFCRELAGGREGATES('{_guid(seed, 6)}',$,$,$,{building},({','.join(storeys)}))")
+
+    header = (
+        "ISO-10303-21;\nHEADER;\n"
+        "FILE_DESCRIPTION(('ViewDefinition [DesignTransferView]'),'2;1');\n"
+        f"FILE_NAME('benchmark-{elements}.ifc','2026-01-01T00:00:00',(''),(''),'bench','bench','');\n"
+        "FILE_SCHEMA(('IFC4'));\nENDSEC;\nDATA;\n"
+    )
+    return (header + "\n".join(lines) + "\nENDSEC;\nEND-ISO-10303-21;\n").encode("ascii")
+
+
+def scene_items(count: int, seed: int = 0, variant: int = 0) -> List[Dict[str, Any]]:
+    """
+    SceneModelItem dicts. Items of the same seed share ids and properties;
+    `variant` moves every item, so each variant is a fresh scene for the
+    export caches.
+    """
+    rng = random.Random(seed)
+    items = []
+    for index in range(count):
+        ifc_type = rng.choice(SCENE_TYPES)
+        items.append({
+            "itemId": f"item-{index % 500}",
+            "instanceId": f"instance-{index}",
+            "position": [(index % 100) * 2.0 + variant * 0.01, rng.uniform(0, 30), (index // 100) * 2.0],
+            "rotation": [0.0, rng.choice((0.0, 1.5707963267948966, 3.141592653589793)), 0.0],
+            "scale": [1.0, 1.0, 1.0],
+            "properties": {
+                "ifc_type": ifc_type,
+                "width": rng.uniform(0.5, 5.0),
+                "height": rng.uniform(0.5, 3.0),
+                "depth": rng.uniform(0.05, 0.4),
+                "physics": {
+                    "thermal_conductivity": rng.choice((0.04, 0.15, 0.8, 1.4)),
+                    "density": rng.choice((30, 600, 1800, 2400)),
+                    "specific_heat": rng.choice((840, 880, 1000, 1400)),
+                    "thickness": rng.choice((0.1, 0.2, 0.3)),
+                },
+            },
+        })
+    return items
+
+
+def scene_request(count: int, seed: int = 0, variant: int = 0) -> Dict[str, Any]:
+    """A SceneModelRequest body with `count` items."""
+    return {"sceneModel": scene_items(count, seed, variant), "name": f"Benchmark {count}"}
+
+
+def _timestamp(base: datetime, seconds: int) -> str:
+    return (base - timedelta(seconds=seconds)).strftime("%Y-%m-%dT%H:%M:%S.%f+00:00")
+
+
+def seed_projects(fake: FakeSupabase, count: int, seed: int = 0, user_id: str = BENCH_USER_ID) -> int:
+    """
+    `count` projects visible to user_id (owned, through a team, or shared with
+    them) plus as many of another user that they cannot see. Returns the
+    number visible to user_id.
+    """
+    rng = random.Random(seed)
+    base = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    fake.tables.insert("teams", [{"id": BENCH_TEAM_ID, "name": "Benchmark team", "owner_id": OTHER_USER_ID}])
+    fake.tables.insert("team_members", [{"team_id": BENCH_TEAM_ID, "user_id": user_id, "role": "member"}])
+
+    projects, shares = [], []
+    for index in range(count * 2):
+        visible = index % 2 == 0
+        kind = rng.random() if visible else 1.0
+        project = {
+            "id": f"{seed:08x}-0000-4000-8000-{index:012x}",
+            "name": f"Project {index:06d}",
+            "description": None,
+            "file_path": f"public/project-{index}.ifc",
+            "file_name": f"project-{index}.ifc",
+            "file_size": rng.randint(10_000, 200_000_000),
+            "file_type": "application/x-step",
+            "owner_user_id": user_id if kind < 0.6 else (None if kind < 0.8 else OTHER_USER_ID),
+            "owner_team_id": BENCH_TEAM_ID if 0.6 <= kind < 0.8 else None,
+            "owner_company_id": None,
+            "tags": rng.sample(PROJECT_TAGS, rng.randint(0, 3)),
+            "created_at": _timestamp(base, index * 60),
+            # Some projects share an updated_at, so keyset pages must break ties on id
+            "updated_at": _timestamp(base, (index // 3) * 60),
+        }
+        projects.append(project)
+        if visible and kind >= 0.8:
+            shares.append({
+                "project_id": project["id"],
+                "shared_with_user_id": user_id,
+                "permission": rng.choice(("read", "write")),
+                "shared_by_user_id": OTHER_USER_ID,
+                "expires_at": None,
+            })
+    fake.tables.insert("projects", projects)
+    fake.tables.insert("project_shares", shares)
+    return count
+
+
+def seed_files(fake: FakeSupabase, count: int, bucket: str = "bim-files", folder: str = "public", size: int = 256) -> List[str]:
+    """`count` small objects in one folder; returns their names."""
+    names = [f"model-{index:07d}.ifc" for index in range(count)]
+    payload = b"0" * size
+    fake.buckets.put_many(bucket, ((f"{folder}/{name}", payload) for name in names))
+    return names
+
+
+def seed_marketplace(fake: FakeSupabase, count: int, seed: int = 0, owner_id: Optional[str] = BENCH_USER_ID):
+    """`count` marketplace items, one in ten private to owner_id."""
+    rng = random.Random(seed)
+    base = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    fake.tables.insert("marketplace_items", [
+        {
+            "id": f"{seed:08x}-0000-4000-9000-{index:012x}",
+            "name": f"{rng.choice(SCENE_TYPES)[3:]} {index:06d}",
+            "description": "Synthetic catalogue item",
+            "manufacturer": rng.choice(("Acme", "Bauwerk", "Nordlicht")),
+            "model_number": f"M-{index}",
+            "ifc_type": rng.choice(SCENE_TYPES),
+            "ifc_category": None,
+            "fragment_url": f"fragments/{index}.frag",
+            "thumbnail_url": None,
+            "physics": {"thermal_conductivity": 0.15, "density": 600},
+            "tags": rng.sample(PROJECT_TAGS, rng.randint(0, 2)),
+            "is_public": index % 10 != 0,
+            "user_id": owner_id if index % 10 == 0 else None,
+            "version": 1,
+            "updated_at": _timestamp(base, index),
+        }
+        for index in range(count)
+    ])
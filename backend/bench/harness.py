@@ -0,0 +1,198 @@
+"""
+Measurement and baselines for the benchmark scenarios.
+A scenario is timed request by request; results carry latency percentiles,
+throughput, peak RSS of the API process and the job workers, and the time the
+Supabase stand-in spent per request. Baselines are JSON files of earlier
+results; a run compared against one fails when a value regressed by more
+than the tolerance.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import platform
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+# Compared against the baseline; latency in ms, memory in MB
+COMPARED_METRICS = ("p50_ms", "p95_ms", "peak_rss_mb", "worker_peak_rss_mb")
+# Differences below these are noise, whatever the ratio
+MIN_DELTA_MS = float(os.environ.get("BENCH_MIN_DELTA_MS", "5"))
+MIN_DELTA_MB = float(os.environ.get("BENCH_MIN_DELTA_MB", "16"))
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(fraction * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def _status_kb(pid: int, field: str) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def reset_peak_rss(pids: List[int]):
+    """Reset the peak RSS (VmHWM) of processes; Linux only, ignored elsewhere."""
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/clear_refs", "w") as clear_refs:
+                clear_refs.write("5")
+        except OSError:
+            pass
+
+
+def peak_rss_mb(pid: int) -> Optional[float]:
+    """Peak RSS of a process since the last reset, in MB (None where /proc is unavailable)."""
+    peak = _status_kb(pid, "VmHWM")
+    if peak is None and pid == os.getpid():
+        import resource
+        # ru_maxrss is KB on Linux and bytes on macOS, and cannot be reset
+        maximum = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(maximum / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    return round(peak / 1024, 1) if peak is not None else None
+
+
+def worker_pids() -> List[int]:
+    """Process ids of the job engine's workers (none before the first job)."""
+    from jobs import job_manager
+
+    executor = job_manager._executor
+    processes = getattr(executor, "_processes", None) or {}
+    return list(processes)
+
+
+async def measure(bench, scenario, size: int, requests: int, concurrency: int) -> Dict[str, Any]:
+    """
+    Run scenario.run `requests` times (after its warmup) and summarise.
+    scenario.before prepares each iteration outside the timed section; what it
+    returns is passed to run.
+    """
+    scenario.prepare(bench, size)
+    first_ms = None
+    for iteration in range(scenario.warmup):
+        state = scenario.before(bench, iteration)
+        started = time.perf_counter()
+        await scenario.run(bench, iteration, state)
+        if first_ms is None:
+            first_ms = (time.perf_counter() - started) * 1000
+
+    pids = [os.getpid()] + worker_pids()
+    reset_peak_rss(pids)
+    fake_requests, fake_busy = bench.fake.counters()
+    latencies: List[float] = []
+    errors: List[str] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(iteration: int):
+        async with semaphore:
+            state = scenario.before(bench, iteration)
+            started = time.perf_counter()
+            try:
+                await scenario.run(bench, iteration, state)
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}")
+                return
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    wall_started = time.perf_counter()
+    await asyncio.gather(*(one(scenario.warmup + index) for index in range(requests)))
+    wall = time.perf_counter() - wall_started
+
+    now_requests, now_busy = bench.fake.counters()
+    latencies.sort()
+    workers = [peak for peak in (peak_rss_mb(pid) for pid in worker_pids()) if peak is not None]
+    measured = len(latencies)
+    return {
+        "scenario": scenario.name,
+        "size": size,
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "first_ms": round(first_ms if first_ms is not None else (latencies[0] if latencies else 0.0), 2),
+        "mean_ms": round(sum(latencies) / measured, 2) if measured else None,
+        "p50_ms": round(percentile(latencies, 0.50), 2),
+        "p95_ms": round(percentile(latencies, 0.95), 2),
+        "p99_ms": round(percentile(latencies, 0.99), 2),
+        "max_ms": round(latencies[-1], 2) if latencies else None,
+        "throughput_rps": round(measured / wall, 2) if wall else None,
+        "peak_rss_mb": peak_rss_mb(os.getpid()),
+        "worker_peak_rss_mb": max(workers) if workers else None,
+        "stub_calls_per_request": round((now_requests - fake_requests) / max(requests, 1), 2),
+        "stub_ms_per_request": round((now_busy - fake_busy) * 1000 / max(requests, 1), 2),
+    }
+
+
+def result_key(result: Dict[str, Any]) -> str:
+    return f"{result['scenario']}/{result['size']}"
+
+
+def save_baseline(path: str, results: List[Dict[str, Any]]):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    document = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "machine": f"{platform.system()} {platform.machine()} ({os.cpu_count()} CPUs)",
+        "results": {result_key(result): result for result in results},
+    }
+    with open(path, "w") as target:
+        json.dump(document, target, indent=2, sort_keys=True)
+        target.write("\n")
+
+
+def load_baseline(path: str) -> Optional[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return None
+    with open(path) as source:
+        return json.load(source)
+
+
+def compare(results: List[Dict[str, Any]], baseline: Optional[Dict[str, Any]], tolerance: float) -> List[str]:
+    """Failed requests, and regressions of results against a baseline, as messages (empty if none)."""
+    regressions = []
+    previous_results = (baseline or {}).get("results", {})
+    for result in results:
+        key = result_key(result)
+        if result["errors"]:
+            regressions.append(f"{key}: {result['errors']} failed requests (first: {result['first_error']})")
+        previous = previous_results.get(key)
+        if previous is None:
+            continue
+        for metric in COMPARED_METRICS:
+            before, after = previous.get(metric), result.get(metric)
+            if before is None or after is None:
+                continue
+            floor = MIN_DELTA_MB if metric.endswith("_mb") else MIN_DELTA_MS
+            if after > before * (1 + tolerance) and after - before > floor:
+                regressions.append(f"{key}: {metric} {before} -> {after} (+{(after / before - 1) * 100 if before else float('inf'):.0f}%)")
+    return regressions
+
+
+def format_table(results: List[Dict[str, Any]], baseline: Optional[Dict[str, Any]] = None) -> str:
+    columns = (
+        ("scenario", "scenario", 16), ("size", "size", 8), ("n", "requests", 5), ("err", "errors", 4),
+        ("first", "first_ms", 9), ("p50", "p50_ms", 9), ("p95", "p95_ms", 9), ("p99", "p99_ms", 9),
+        ("rps", "throughput_rps", 8), ("rss MB", "peak_rss_mb", 8), ("worker MB", "worker_peak_rss_mb", 10),
+        ("stub ms", "stub_ms_per_request", 8),
+    )
+    lines = ["".join(f"{title:>{width}} " for title, _, width in columns)]
+    previous = (baseline or {}).get("results", {})
+    for result in results:
+        lines.append("".join(f"{'-' if result.get(key) is None else result[key]!s:>{width}} " for _, key, width in columns))
+        before = previous.get(result_key(result))
+        if before:
+            lines.append("".join(
+                f"{'' if key not in COMPARED_METRICS or before.get(key) is None else '(' + str(before[key]) + ')':>{width}} "
+                for _, key, width in columns
+            ))
+    return "\n".join(lines)
@@ -0,0 +1,132 @@
+"""
+Open-loop load generation for the benchmark scenarios.
+Requests start at a fixed rate whether or not earlier ones finished, as they
+would from many independent clients, so an overloaded server shows up as
+growing latency or as rejections instead of a slower request rate. Each
+step runs one rate for a fixed duration; requests still unfinished once the
+drain timeout passes are cancelled and counted as such.
+The generator shares the event loop and the CPU with the app, so request data
+of scenarios that allow it is built before the clock starts (all of a step's
+bodies are held in memory).
+"""
+import os
+import time
+import asyncio
+from typing import Any, Dict, List
+from bench.harness import percentile, peak_rss_mb, reset_peak_rss, worker_pids
+from bench.scenarios import Rejected
+
+# Time allowed after the last arrival for requests in flight, as a multiple of the step duration
+DRAIN_FACTOR = 2.0
+
+
+async def run_step(bench, scenario, size: int, rate: float, duration: float) -> Dict[str, Any]:
+    """Start scenario.run `rate` times per second for `duration` seconds and summarise."""
+    latencies: List[float] = []
+    rejected: List[float] = []
+    retry_after: List[float] = []
+    errors: List[str] = []
+
+    async def one(iteration: int, state: Any):
+        started = time.perf_counter()
+        try:
+            await scenario.run(bench, iteration, state)
+        except Rejected as e:
+            rejected.append((time.perf_counter() - started) * 1000)
+            if e.retry_after:
+                retry_after.append(float(e.retry_after))
+            return
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+            return
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    count = int(rate * duration)
+    prebuilt = [scenario.before(bench, scenario.warmup + index) for index in range(count)] if scenario.prebuild else None
+    pids = [os.getpid()] + worker_pids()
+    reset_peak_rss(pids)
+    tasks: List[asyncio.Task] = []
+    started = time.perf_counter()
+    lag = 0.0
+    index = 0
+    while index < count:
+        due = started + index / rate
+        now = time.perf_counter()
+        if due > now:
+            await asyncio.sleep(due - now)
+        else:
+            lag = max(lag, now - due)
+        iteration = scenario.warmup + index
+        state = prebuilt[index] if prebuilt is not None else scenario.before(bench, iteration)
+        tasks.append(asyncio.create_task(one(iteration, state)))
+        index += 1
+    offered_seconds = time.perf_counter() - started
+
+    _, pending = await asyncio.wait(tasks, timeout=duration * DRAIN_FACTOR) if tasks else (set(), set())
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.wait(pending)
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    workers = [peak for peak in (peak_rss_mb(pid) for pid in worker_pids()) if peak is not None]
+    return {
+        "scenario": scenario.name,
+        "size": size,
+        "rate": rate,
+        "offered_rps": round(index / offered_seconds, 2) if offered_seconds else None,
+        "requests": index,
+        "ok": len(latencies),
+        "rejected": len(rejected),
+        "errors": len(errors),
+        "unfinished": len(pending),
+        "first_error": errors[0] if errors else None,
+        "goodput_rps": round(len(latencies) / wall, 2) if wall else None,
+        "p50_ms": round(percentile(latencies, 0.50), 2),
+        "p95_ms": round(percentile(latencies, 0.95), 2),
+        "p99_ms": round(percentile(latencies, 0.99), 2),
+        "max_ms": round(latencies[-1], 2) if latencies else None,
+        "reject_p50_ms": round(percentile(sorted(rejected), 0.50), 2),
+        "retry_after_s": round(sum(retry_after) / len(retry_after), 1) if retry_after else None,
+        "generator_lag_ms": round(lag * 1000, 1),
+        "peak_rss_mb": peak_rss_mb(os.getpid()),
+        "worker_peak_rss_mb": max(workers) if workers else None,
+    }
+
+
+async def _settle(timeout: float):
+    """Cancel queued jobs and wait for running ones, so one step's backlog does not spill into the next."""
+    from jobs import job_manager
+
+    for job in list(job_manager._jobs.values()):
+        job.future.cancel()
+    deadline = time.perf_counter() + timeout
+    while job_manager.status_counts().get("running", 0) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.1)
+
+
+async def run_load(bench, scenario, size: int, rates: List[float], duration: float) -> List[Dict[str, Any]]:
+    """One step per rate, in order, after the scenario's warmup."""
+    scenario.prepare(bench, size)
+    for iteration in range(scenario.warmup):
+        await scenario.run(bench, iteration, scenario.before(bench, iteration))
+    results = []
+    for rate in rates:
+        print(f"  {rate:g} requests/s for {duration:g} s ...", flush=True)
+        results.append(await run_step(bench, scenario, size, rate, duration))
+        await _settle(duration * DRAIN_FACTOR)
+    return results
+
+
+def format_load_table(results: List[Dict[str, Any]]) -> str:
+    columns = (
+        ("scenario", "scenario", 16), ("size", "size", 8), ("offered", "offered_rps", 8), ("ok", "ok", 6),
+        ("429", "rejected", 6), ("err", "errors", 4), ("unfin", "unfinished", 6), ("goodput", "goodput_rps", 8),
+        ("p50", "p50_ms", 9), ("p95", "p95_ms", 9), ("p99", "p99_ms", 9), ("429 ms", "reject_p50_ms", 8),
+        ("retry s", "retry_after_s", 8), ("rss MB", "peak_rss_mb", 8), ("worker MB", "worker_peak_rss_mb", 10),
+    )
+    lines = ["".join(f"{title:>{width}} " for title, _, width in columns)]
+    for result in results:
+        lines.append("".join(f"{'-' if result.get(key) is None else result[key]!s:>{width}} " for _, key, width in columns))
+    return "\n".join(lines)
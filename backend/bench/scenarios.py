@@ -0,0 +1,221 @@
+"""
+Benchmark scenarios. Each drives one endpoint of the app in-process (through
+httpx's ASGI transport) against the Supabase stand-in.
+Importing this module imports the app, so SUPABASE_URL and friends must point
+at the stand-in first (see bench/__main__.py).
+"""
+import asyncio
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+import httpx
+import jwt
+import orjson
+import main
+import data_access as db
+from jobs import job_manager
+from model_cache import invalidate_model
+from storage_index import bim_files_index
+from bench.fake_supabase import FakeSupabase
+from bench.generators import BENCH_USER_ID, scene_request, seed_files, seed_projects, synthetic_ifc
+
+ANALYZE_POLL_SECONDS = 0.02
+PROJECTS_PAGE = 50
+FILES_PAGE = 100
+
+
+def _auth_headers(user_id: str, email: str, jwt_secret: str) -> Dict[str, str]:
+    token = jwt.encode(
+        {"sub": user_id, "email": email, "aud": "authenticated", "role": "authenticated", "exp": int(time.time()) + 86400},
+        jwt_secret,
+        algorithm="HS256",
+    )
+    return {"Authorization": f"Bearer {token}"}
+
+
+class Bench:
+    """
+    What the scenarios share: the stand-in, a client for the app and signed-in
+    users. `headers` signs in the user the data is seeded for; headers_for
+    spreads requests over `users` users (the first being that one).
+    """
+
+    def __init__(self, fake: FakeSupabase, jwt_secret: str, users: int = 1):
+        self.fake = fake
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench", timeout=None)
+        self.headers = _auth_headers(BENCH_USER_ID, "bench@example.com", jwt_secret)
+        self.user_headers = [self.headers] + [
+            _auth_headers(str(uuid.uuid5(uuid.NAMESPACE_URL, f"bench-user-{index}")), f"bench{index}@example.com", jwt_secret)
+            for index in range(1, max(users, 1))
+        ]
+        # Generated IFC files by element count, shared by the analyze scenarios
+        self.ifc_files: Dict[int, bytes] = {}
+
+    def headers_for(self, iteration: int) -> Dict[str, str]:
+        return self.user_headers[iteration % len(self.user_headers)]
+
+    async def close(self):
+        await self.client.aclose()
+        await db.close_db()
+        job_manager.shutdown()
+
+
+class Rejected(RuntimeError):
+    """The app answered 429 (admission control or a per-user limit)."""
+
+    def __init__(self, message: str, retry_after: Optional[str]):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _check(response: httpx.Response, *expected: int) -> httpx.Response:
+    if response.status_code == 429 and 429 not in expected:
+        raise Rejected(f"{response.request.method} {response.request.url.path} -> 429: {response.text[:200]}", response.headers.get("retry-after"))
+    if response.status_code not in expected:
+        raise RuntimeError(f"{response.request.method} {response.request.url.path} -> {response.status_code}: {response.text[:200]}")
+    return response
+
+
+class Scenario:
+    name = ""
+    description = ""
+    # Measured requests (unless overridden on the command line) and unmeasured runs before them
+    requests = 20
+    warmup = 1
+    # before() only builds request data, without side effects, so the load
+    # generator may call it ahead of time instead of on the event loop it shares with the app
+    prebuild = False
+
+    def prepare(self, bench: Bench, size: int):
+        """Seed the stand-in for a size (not timed)."""
+
+    def before(self, bench: Bench, iteration: int) -> Any:
+        """Per-iteration setup (not timed); the result is passed to run."""
+        return None
+
+    async def run(self, bench: Bench, iteration: int, state: Any):
+        raise NotImplementedError
+
+
+class AnalyzeScenario(Scenario):
+    """POST /analyze and poll until the job finished; size = elements of the IFC file."""
+    requests = 5
+
+    def __init__(self, cached: bool):
+        self.cached = cached
+        self.name = "analyze-cached" if cached else "analyze"
+        self.description = (
+            "analysis of an unchanged model (report from the artifact store)" if cached
+            else "download, parse and analysis of a freshly uploaded model"
+        )
+        if cached:
+            # Every worker parses the model once before measuring
+            self.warmup = 2 * job_manager.max_workers
+            self.requests = 10
+        self.path = ""
+
+    def prepare(self, bench: Bench, size: int):
+        if size not in bench.ifc_files:
+            bench.ifc_files[size] = synthetic_ifc(size)
+        self.path = f"bench/model-{size}.ifc"
+        bench.fake.buckets.put("bim-files", self.path, bench.ifc_files[size])
+        invalidate_model("bim-files", self.path)
+        self.size = size
+
+    def before(self, bench: Bench, iteration: int):
+        if not self.cached:
+            # A re-upload: new ETag, and the API bumps the model's generation. The
+            # project name differs per upload so no stored report matches the contents.
+            name = f"'Benchmark {self.size}'".encode()
+            contents = bench.ifc_files[self.size].replace(name, name[:-1] + f" upload {iteration}'".encode(), 1)
+            bench.fake.buckets.put("bim-files", self.path, contents)
+            invalidate_model("bim-files", self.path)
+
+    async def run(self, bench: Bench, iteration: int, state: Any):
+        headers = bench.headers_for(iteration)
+        response = _check(await bench.client.post("/analyze", json={"file_path": self.path}, headers=headers), 202)
+        job_id = response.json()["job_id"]
+        while True:
+            job = _check(await bench.client.get(f"/analyze/{job_id}", headers=headers), 200).json()
+            if job["status"] == "succeeded":
+                return
+            if job["status"] in ("failed", "cancelled"):
+                raise RuntimeError(f"Job {job['status']}: {job.get('error')}")
+            await asyncio.sleep(ANALYZE_POLL_SECONDS)
+
+
+class ExportScenario(Scenario):
+    """POST /simulate/export-energyplus; size = scene items."""
+    prebuild = True
+
+    def __init__(self, cached: bool):
+        self.cached = cached
+        self.name = "export-cached" if cached else "export"
+        self.description = "export of an unchanged scene" if cached else "export of a scene whose items all moved"
+        self.body = b""
+
+    def prepare(self, bench: Bench, size: int):
+        self.size = size
+        self.body = orjson.dumps(scene_request(size)) if self.cached else b""
+
+    def before(self, bench: Bench, iteration: int) -> bytes:
+        return self.body if self.cached else orjson.dumps(scene_request(self.size, variant=iteration + 1))
+
+    async def run(self, bench: Bench, iteration: int, state: bytes):
+        _check(await bench.client.post(
+            "/simulate/export-energyplus", content=state, headers={**bench.headers_for(iteration), "Content-Type": "application/json"}
+        ), 200)
+
+
+class ProjectsScenario(Scenario):
+    """GET /projects page after page (wrapping around); size = projects visible to the user."""
+    name = "projects"
+    description = "keyset pages of the user's projects"
+    requests = 100
+
+    def prepare(self, bench: Bench, size: int):
+        bench.fake.reset()
+        seed_projects(bench.fake, size)
+        self.cursor: Optional[str] = None
+
+    async def run(self, bench: Bench, iteration: int, state: Any):
+        params = {"limit": PROJECTS_PAGE}
+        if self.cursor:
+            params["cursor"] = self.cursor
+        page = _check(await bench.client.get("/projects", params=params, headers=bench.headers), 200).json()
+        self.cursor = page["next_cursor"]
+
+
+class FilesScenario(Scenario):
+    """GET /files/list pages and prefix searches; size = objects in the folder. The warmup run loads the index."""
+    name = "files"
+    description = "pages and prefix searches of the storage listing"
+    requests = 200
+
+    def prepare(self, bench: Bench, size: int):
+        bench.fake.reset()
+        self.names: List[str] = seed_files(bench.fake, size)
+        # Start from an unloaded index so the warmup run measures the cold load
+        bim_files_index.loaded = False
+
+    def before(self, bench: Bench, iteration: int) -> Dict[str, Any]:
+        if iteration % 2:
+            name = self.names[(iteration * 7919) % len(self.names)]
+            return {"limit": FILES_PAGE, "prefix": name[:-6]}
+        return {"limit": FILES_PAGE, "offset": (iteration * FILES_PAGE) % max(len(self.names) - FILES_PAGE, 1)}
+
+    async def run(self, bench: Bench, iteration: int, state: Dict[str, Any]):
+        _check(await bench.client.get("/files/list", params=state), 200)
+
+
+SCENARIOS = {
+    scenario.name: scenario
+    for scenario in (
+        AnalyzeScenario(cached=False),
+        AnalyzeScenario(cached=True),
+        ExportScenario(cached=False),
+        ExportScenario(cached=True),
+        ProjectsScenario(),
+        FilesScenario(),
+    )
+}
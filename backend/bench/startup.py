@@ -0,0 +1,145 @@
+"""
+Cold start of the API process.
+Each run starts a fresh interpreter that imports main, enters the app's
+lifespan and sends GET /, then polls /readyz until the warm-up (clients, IFC
+job workers) is done. The "startup" result holds the time from process start
+to the first response (p50/p95, compared against the baseline like any other
+scenario), the import of main, the time to ready and the slowest direct
+imports of main from one extra `python -X importtime` run.
+"""
+import os
+import sys
+import json
+import time
+import subprocess
+from typing import Any, Dict, List, Tuple
+from bench.harness import percentile
+
+STARTUP = "startup"
+STARTUP_RUNS = 5
+# Waiting longer than this for /readyz fails the run
+READY_TIMEOUT_SECONDS = 120
+TOP_IMPORTS = 8
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the fresh interpreter, from backend/
+CHILD = f"""
+import time
+started = time.time()
+import json, asyncio
+clock = time.perf_counter()
+import main
+import_ms = (time.perf_counter() - clock) * 1000
+import httpx
+
+def rss_mb():
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmHWM:"):
+                return round(int(line.split()[1]) / 1024, 1)
+
+async def run():
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://startup") as client:
+            (await client.get("/")).raise_for_status()
+            first_response, rss = time.time(), rss_mb()
+            ready = None
+            while ready is None and time.time() - first_response < {READY_TIMEOUT_SECONDS}:
+                response = await client.get("/readyz")
+                if response.status_code == 200:
+                    ready = time.time()
+                else:
+                    await asyncio.sleep(0.02)
+    return {{"started": started, "import_ms": import_ms, "first_response": first_response, "ready": ready, "rss_mb": rss, "readyz": response.json()}}
+
+if __name__ == "__main__":
+    print(json.dumps(asyncio.run(run())))
+"""
+
+
+def _run_once() -> Dict[str, Any]:
+    spawned = time.time()
+    completed = subprocess.run([sys.executable, "-c", CHILD], cwd=BACKEND_DIR, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else f"exit code {completed.returncode}")
+    run = json.loads(completed.stdout.strip().splitlines()[-1])
+    if run["ready"] is None:
+        raise RuntimeError(f"not ready after {READY_TIMEOUT_SECONDS} s: {run['readyz']}")
+    return {
+        "interpreter_ms": (run["started"] - spawned) * 1000,
+        "import_ms": run["import_ms"],
+        "first_response_ms": (run["first_response"] - spawned) * 1000,
+        "ready_ms": (run["ready"] - spawned) * 1000,
+        "rss_mb": run["rss_mb"],
+    }
+
+
+def slowest_imports(limit: int = TOP_IMPORTS) -> List[Tuple[str, float]]:
+    """The direct imports of main with the largest cumulative time (ms), from -X importtime."""
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=BACKEND_DIR, capture_output=True, text=True)
+    pending: List[Tuple[str, float]] = []
+    direct: List[Tuple[str, float]] = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue  # the header
+        depth = (len(name) - len(name.lstrip())) // 2
+        # Children are listed before the module that imported them
+        if depth == 1:
+            pending.append((name.strip(), int(cumulative) / 1000))
+        elif depth == 0:
+            if name.strip() == "main":
+                direct = pending
+            pending = []
+    return [(module, round(ms, 1)) for module, ms in sorted(direct, key=lambda item: -item[1])[:limit]]
+
+
+def measure_startup(runs: int) -> Dict[str, Any]:
+    """Start the app `runs` times and summarise, in the shape of harness.measure results."""
+    samples: List[Dict[str, Any]] = []
+    errors: List[str] = []
+    for _ in range(runs):
+        try:
+            samples.append(_run_once())
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+
+    def sorted_values(key: str) -> List[float]:
+        return sorted(sample[key] for sample in samples)
+
+    first = sorted_values("first_response_ms")
+    return {
+        "scenario": STARTUP,
+        "size": 0,
+        "requests": runs,
+        "concurrency": 1,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "first_ms": None,
+        "mean_ms": round(sum(first) / len(first), 2) if first else None,
+        "p50_ms": round(percentile(first, 0.50), 2),
+        "p95_ms": round(percentile(first, 0.95), 2),
+        "p99_ms": round(percentile(first, 0.99), 2),
+        "max_ms": round(first[-1], 2) if first else None,
+        "throughput_rps": None,
+        "peak_rss_mb": max(sample["rss_mb"] for sample in samples) if samples else None,
+        "worker_peak_rss_mb": None,
+        "stub_calls_per_request": None,
+        "stub_ms_per_request": None,
+        "interpreter_ms": round(percentile(sorted_values("interpreter_ms"), 0.50), 2),
+        "import_ms": round(percentile(sorted_values("import_ms"), 0.50), 2),
+        "ready_ms": round(percentile(sorted_values("ready_ms"), 0.50), 2),
+        "slowest_imports": slowest_imports(),
+    }
+
+
+def format_startup(result: Dict[str, Any]) -> str:
+    lines = [
+        f"Startup (p50 of {result['requests']} runs): interpreter {result['interpreter_ms']} ms, "
+        f"import main {result['import_ms']} ms, first response {result['p50_ms']} ms, ready {result['ready_ms']} ms",
+        "Slowest imports of main (cumulative ms): " + ", ".join(f"{module} {ms}" for module, ms in result["slowest_imports"]),
+    ]
+    return "\n".join(lines)
@@ -0,0 +1,313 @@
+"""
+Async data access for the API's async handlers.
+Project, share and storage calls go through one Supabase AsyncClient backed by
+a pooled keep-alive httpx.AsyncClient, so a handler awaits the PostgREST or
+Storage round trip instead of blocking the event loop for it.
+
+Sync code (job workers, `def` endpoints running in the threadpool) keeps using
+supabase_client.get_supabase().
+The client is created by the app's lifespan at startup (or on first use), so
+importing this module does not load the supabase package.
+"""
+import os
+import asyncio
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Set, Tuple
+import httpx
+from dotenv import load_dotenv
+import metrics
+
+if TYPE_CHECKING:
+    from supabase import AsyncClient
+
+load_dotenv()
+
+SUPABASE_URL = os.environ.get("SUPABASE_URL")
+SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
+
+# Connections to Supabase shared by all requests of the process
+SUPABASE_POOL_SIZE = int(os.environ.get("SUPABASE_POOL_SIZE", "100"))
+# Idle connections kept open for reuse, and for how long
+SUPABASE_POOL_KEEPALIVE = int(os.environ.get("SUPABASE_POOL_KEEPALIVE", "20"))
+SUPABASE_KEEPALIVE_EXPIRY = float(os.environ.get("SUPABASE_KEEPALIVE_EXPIRY", "30"))
+SUPABASE_TIMEOUT = float(os.environ.get("SUPABASE_TIMEOUT", "30"))
+SUPABASE_CONNECT_TIMEOUT = float(os.environ.get("SUPABASE_CONNECT_TIMEOUT", "5"))
+# Waiting longer than this for a free pooled connection fails the request
+SUPABASE_POOL_TIMEOUT = float(os.environ.get("SUPABASE_POOL_TIMEOUT", "10"))
+
+# ids per `in.(...)` filter, so bulk lookups stay well under URL length limits
+SUPABASE_IN_CHUNK = int(os.environ.get("SUPABASE_IN_CHUNK", "200"))
+
+_http_client: Optional[httpx.AsyncClient] = None
+_client: Optional["AsyncClient"] = None
+
+
+def get_db() -> "AsyncClient":
+    """The process-wide async Supabase client (created on first use)."""
+    global _http_client, _client
+    if _client is None:
+        from supabase import AsyncClient
+        from supabase.lib.client_options import AsyncClientOptions
+
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=SUPABASE_POOL_SIZE,
+                max_keepalive_connections=SUPABASE_POOL_KEEPALIVE,
+                keepalive_expiry=SUPABASE_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(SUPABASE_TIMEOUT, connect=SUPABASE_CONNECT_TIMEOUT, pool=SUPABASE_POOL_TIMEOUT),
+            event_hooks=metrics.SUPABASE_ASYNC_EVENT_HOOKS,
+        )
+        _client = AsyncClient(SUPABASE_URL, SUPABASE_KEY, AsyncClientOptions(httpx_client=_http_client))
+    return _client
+
+
+async def close_db():
+    """Close the pooled connections (on shutdown)."""
+    global _http_client, _client
+    if _http_client is not None:
+        await _http_client.aclose()
+    _http_client = None
+    _client = None
+
+
+def pool_stats() -> Dict[str, Any]:
+    """Pool settings and the connections currently held by the pool."""
+    pool = getattr(_http_client._transport, "_pool", None) if _http_client is not None else None
+    connections = list(pool.connections) if pool is not None else []
+    return {
+        "max_connections": SUPABASE_POOL_SIZE,
+        "max_keepalive_connections": SUPABASE_POOL_KEEPALIVE,
+        "connections": len(connections),
+        "idle_connections": sum(1 for connection in connections if connection.is_idle()),
+    }
+
+
+async def _select_in(table: str, columns: str, column: str, values: Iterable[str], **eq: str) -> List[dict]:
+    """Rows whose `column` is in `values` (and that match `eq`), queried in concurrent chunks."""
+    values = list(dict.fromkeys(values))
+    if not values:
+        return []
+
+    async def select_chunk(chunk: List[str]) -> List[dict]:
+        query = get_db().table(table).select(columns).in_(column, chunk)
+        for name, value in eq.items():
+            query = query.eq(name, value)
+        return (await query.execute()).data
+
+    chunks = [values[i:i + SUPABASE_IN_CHUNK] for i in range(0, len(values), SUPABASE_IN_CHUNK)]
+    return [row for rows in await asyncio.gather(*(select_chunk(chunk) for chunk in chunks)) for row in rows]
+
+
+# --- Projects ---
+
+# Permissions in project_access, weakest first
+PERMISSIONS = ("read", "write", "admin", "owner")
+# Embedded access rows of a project read; !inner drops projects without a matching row
+_ACCESS_SELECT = "*, project_access!inner(permission)"
+
+
+def _unexpired() -> str:
+    """PostgREST or-filter matching access rows that have not expired."""
+    now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    return f"expires_at.is.null,expires_at.gt.{now}"
+
+
+def _with_access(query, user_id: str):
+    """Restrict a projects query to the user's unexpired project_access rows (one PK lookup per project)."""
+    return query.eq("project_access.user_id", user_id).or_(_unexpired(), reference_table="project_access")
+
+
+def _strongest(rows: List[dict]) -> Optional[str]:
+    ranked = [PERMISSIONS.index(row["permission"]) for row in rows if row.get("permission") in PERMISSIONS]
+    return PERMISSIONS[max(ranked)] if ranked else None
+
+
+def _with_permission(project: dict) -> dict:
+    """Replace the embedded access rows with the user's strongest permission."""
+    project["permission"] = _strongest(project.pop("project_access", None) or [])
+    return project
+
+
+async def list_projects(
+    user_id: str,
+    limit: int,
+    columns: str = "*",
+    after: Optional[Tuple[str, str]] = None,
+    tags: Optional[List[str]] = None,
+    owner_column: Optional[str] = None,
+    name_prefix: Optional[str] = None,
+) -> List[dict]:
+    """
+    One page of the projects the user can access, newest first, each with the
+    user's permission. Keyset pagination on (updated_at, id): `after` is the
+    (updated_at, id) of the last project of the previous page.
+    """
+    query = get_db().table("projects").select(f"{columns}, project_access!inner(permission)")
+    query = _with_access(query, user_id)
+    if after is not None:
+        updated_at, project_id = after
+        query = query.or_(f'updated_at.lt."{updated_at}",and(updated_at.eq."{updated_at}",id.lt."{project_id}")')
+    if tags:
+        query = query.contains("tags", tags)
+    if owner_column:
+        query = query.not_.is_(owner_column, "null")
+    if name_prefix:
+        # LIKE wildcards in the prefix match literally
+        escaped = name_prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        query = query.ilike("name", f"{escaped}%")
+    result = await query.order("updated_at", desc=True).order("id", desc=True).limit(limit).execute()
+    return [_with_permission(project) for project in result.data]
+
+
+async def get_project(project_id: str, user_id: str) -> Optional[dict]:
+    """A project with the user's permission, or None if it does not exist or the user has no access."""
+    query = get_db().table("projects").select(_ACCESS_SELECT).eq("id", project_id)
+    result = await _with_access(query, user_id).limit(1).execute()
+    return _with_permission(result.data[0]) if result.data else None
+
+
+async def get_project_permission(project_id: str, user_id: str) -> Optional[str]:
+    """The user's strongest unexpired permission on a project, or None."""
+    result = await (
+        get_db().table("project_access").select("permission")
+        .eq("user_id", user_id).eq("project_id", project_id)
+        .or_(_unexpired())
+        .execute()
+    )
+    return _strongest(result.data)
+
+
+async def get_project_owner(project_id: str) -> Optional[str]:
+    """owner_user_id of a project."""
+    result = await get_db().table("projects").select("owner_user_id").eq("id", project_id).single().execute()
+    return result.data["owner_user_id"] if result.data else None
+
+
+async def get_project_owners(project_ids: Iterable[str]) -> Dict[str, Optional[str]]:
+    """owner_user_id of each existing project."""
+    rows = await _select_in("projects", "id,owner_user_id", "id", project_ids)
+    return {row["id"]: row["owner_user_id"] for row in rows}
+
+
+async def insert_project(project_data: dict) -> Optional[dict]:
+    result = await get_db().table("projects").insert(project_data).execute()
+    return result.data[0] if result.data else None
+
+
+async def insert_projects(rows: List[dict]) -> List[dict]:
+    """Insert many projects in one statement; returns the created rows in order."""
+    if not rows:
+        return []
+    result = await get_db().table("projects").insert(rows).execute()
+    return result.data
+
+
+async def update_project(project_id: str, update_data: dict) -> Optional[dict]:
+    result = await get_db().table("projects").update(update_data).eq("id", project_id).execute()
+    return result.data[0] if result.data else None
+
+
+async def delete_project(project_id: str):
+    await get_db().table("projects").delete().eq("id", project_id).execute()
+
+
+# --- Memberships ---
+
+async def is_team_member(team_id: str, user_id: str) -> bool:
+    result = await get_db().table("team_members").select("*").eq("team_id", team_id).eq("user_id", user_id).single().execute()
+    return bool(result.data)
+
+
+async def is_company_member(company_id: str, user_id: str) -> bool:
+    result = await get_db().table("company_members").select("*").eq("company_id", company_id).eq("user_id", user_id).single().execute()
+    return bool(result.data)
+
+
+async def team_memberships(user_id: str, team_ids: Iterable[str]) -> Set[str]:
+    """The given teams the user is a member of."""
+    rows = await _select_in("team_members", "team_id", "team_id", team_ids, user_id=user_id)
+    return {row["team_id"] for row in rows}
+
+
+async def company_memberships(user_id: str, company_ids: Iterable[str]) -> Set[str]:
+    """The given companies the user is a member of."""
+    rows = await _select_in("company_members", "company_id", "company_id", company_ids, user_id=user_id)
+    return {row["company_id"] for row in rows}
+
+
+# --- Shares ---
+
+async def insert_share(share_data: dict) -> Optional[dict]:
+    result = await get_db().table("project_shares").insert(share_data).execute()
+    return result.data[0] if result.data else None
+
+
+async def insert_shares(rows: List[dict]) -> List[dict]:
+    """Insert many shares in one statement; returns the created rows in order."""
+    if not rows:
+        return []
+    result = await get_db().table("project_shares").insert(rows).execute()
+    return result.data
+
+
+async def upsert_shares(rows: List[dict]) -> List[dict]:
+    """Overwrite many existing shares (rows carry their id) in one statement; returns the rows in order."""
+    if not rows:
+        return []
+    result = await get_db().table("project_shares").upsert(rows, on_conflict="id").execute()
+    return result.data
+
+
+async def delete_share(project_id: str, share_id: str):
+    await get_db().table("project_shares").delete().eq("id", share_id).eq("project_id", project_id).execute()
+
+
+async def list_shares(project_id: str) -> List[dict]:
+    result = await get_db().table("project_shares").select("*").eq("project_id", project_id).execute()
+    return result.data
+
+
+async def list_shares_for_projects(project_ids: Iterable[str]) -> List[dict]:
+    return await _select_in("project_shares", "*", "project_id", project_ids)
+
+
+# --- Marketplace ---
+
+async def list_marketplace_items(offset: int, limit: int) -> List[dict]:
+    """One page of all marketplace items (public and private), in id order."""
+    result = await get_db().table("marketplace_items").select("*").order("id").range(offset, offset + limit - 1).execute()
+    return result.data
+
+
+async def marketplace_probe() -> Tuple[int, Optional[str]]:
+    """(row count, newest updated_at) of marketplace_items; changes whenever a row is added, updated or removed."""
+    result = await (
+        get_db().table("marketplace_items").select("updated_at", count="exact")
+        .order("updated_at", desc=True).limit(1).execute()
+    )
+    return result.count or 0, result.data[0]["updated_at"] if result.data else None
+
+
+# --- Storage ---
+
+async def create_signed_upload_url(bucket: str, file_path: str) -> Any:
+    from storage3.types import CreateSignedUploadUrlOptions
+
+    options = CreateSignedUploadUrlOptions(upsert="true")
+    return await get_db().storage.from_(bucket).create_signed_upload_url(file_path, options=options)
+
+
+async def create_signed_url(bucket: str, file_path: str, expires_in: int = 3600) -> Any:
+    return await get_db().storage.from_(bucket).create_signed_url(file_path, expires_in)
+
+
+async def create_signed_urls(bucket: str, paths: List[str], expires_in: int = 3600) -> List[dict]:
+    """Sign many paths with one Storage call; items carry 'path', 'signedURL' and 'error'."""
+    return await get_db().storage.from_(bucket).create_signed_urls(paths, expires_in)
+
+
+async def list_objects(bucket: str, folder: str, limit: int = 100, offset: int = 0) -> List[dict]:
+    """One page of a folder listing, in name order (Storage returns at most `limit` rows)."""
+    options = {"limit": limit, "offset": offset, "sortBy": {"column": "name", "order": "asc"}}
+    return await get_db().storage.from_(bucket).list(folder, options)
@@ -0,0 +1,404 @@
+"""
+Ingest-time element index.
+After a project's IFC lands in storage, an ingest job extracts one row per
+element (GlobalId, IFC type, storey, name, material, bounding box) into a
+compact columnar .npz artifact stored next to the IFC. Queries then read that
+artifact through memory-mapped NumPy arrays and never reopen the IFC.
+"""
+import io
+import os
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+import zipfile
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+import numpy as np
+from ifc_loader import ObjectInfo, download_to_file, stat_object
+from ifc_analysis import geometry_iterator, storey_map
+from model_cache import current_generation, get_model
+from jobs import Job, job_manager
+
+if TYPE_CHECKING:
+    import ifcopenshell
+
+INDEX_FORMAT_VERSION = 1
+# Derived artifacts live under their own prefix so /files/list does not show them
+ARTIFACT_PREFIX = "derived"
+ELEMENT_INDEX_DIR = os.environ.get("ELEMENT_INDEX_DIR") or os.path.join(tempfile.gettempdir(), "voxel-index")
+ELEMENT_INDEX_CACHE_ENTRIES = int(os.environ.get("ELEMENT_INDEX_CACHE_ENTRIES", "32"))
+ELEMENT_INDEX_REVALIDATE_SECONDS = int(os.environ.get("ELEMENT_INDEX_REVALIDATE_SECONDS", "60"))
+# Staging directories older than this are left over from crashed extractions
+STAGING_PREFIX = "staging-"
+STALE_STAGING_SECONDS = 3600
+
+
+def index_path(file_path: str) -> str:
+    """Storage path of the element index for an IFC file."""
+    return f"{ARTIFACT_PREFIX}/{file_path}.elements.npz"
+
+
+# --- Building (runs in job workers) ---
+
+def _material_name(material: "ifcopenshell.entity_instance") -> Optional[str]:
+    """Single display name for any IfcMaterialSelect."""
+    if material.is_a("IfcMaterial"):
+        return material.Name
+    if material.is_a("IfcMaterialLayerSetUsage"):
+        return _material_name(material.ForLayerSet)
+    if material.is_a("IfcMaterialLayerSet"):
+        if material.LayerSetName:
+            return material.LayerSetName
+        layers = [layer for layer in material.MaterialLayers if layer.Material]
+        return layers[0].Material.Name if layers else None
+    if material.is_a("IfcMaterialLayer"):
+        return material.Material.Name if material.Material else None
+    if material.is_a("IfcMaterialProfileSetUsage"):
+        return _material_name(material.ForProfileSet)
+    if material.is_a("IfcMaterialProfileSet"):
+        profiles = [profile for profile in material.MaterialProfiles if profile.Material]
+        return material.Name or (profiles[0].Material.Name if profiles else None)
+    if material.is_a("IfcMaterialConstituentSet"):
+        constituents = [c for c in (material.MaterialConstituents or ()) if c.Material]
+        return material.Name or (constituents[0].Material.Name if constituents else None)
+    if material.is_a("IfcMaterialList"):
+        return material.Materials[0].Name if material.Materials else None
+    return None
+
+
+def _material_map(ifc_file: "ifcopenshell.file") -> Dict[int, str]:
+    """Map element id -> material name, falling back to the material of the element's type."""
+    materials = {}
+    for rel in ifc_file.by_type("IfcRelAssociatesMaterial"):
+        name = _material_name(rel.RelatingMaterial)
+        if name:
+            for related in rel.RelatedObjects:
+                materials[related.id()] = name
+    for rel in ifc_file.by_type("IfcRelDefinesByType"):
+        type_material = materials.get(rel.RelatingType.id())
+        if type_material:
+            for related in rel.RelatedObjects:
+                materials.setdefault(related.id(), type_material)
+    return materials
+
+
+def _encode(values: List[Optional[str]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Dictionary-encode strings into int32 codes (-1 for None) and a vocabulary."""
+    vocabulary: Dict[str, int] = {}
+    codes = np.fromiter(
+        (-1 if value is None else vocabulary.setdefault(value, len(vocabulary)) for value in values),
+        dtype=np.int32, count=len(values),
+    )
+    return codes, np.array(list(vocabulary), dtype=str)
+
+
+def indexed_elements(ifc_file: "ifcopenshell.file") -> list:
+    """Physical elements that get a row in the index (openings are skipped)."""
+    return [element for element in ifc_file.by_type("IfcElement") if not element.is_a("IfcFeatureElement")]
+
+
+def build_element_index(ifc_file: "ifcopenshell.file") -> Dict[str, np.ndarray]:
+    """Extract the index columns for every element of a model."""
+    elements = indexed_elements(ifc_file)
+    count = len(elements)
+    index_of = {element.id(): i for i, element in enumerate(elements)}
+
+    storey_of = storey_map(ifc_file)
+    material_of = _material_map(ifc_file)
+
+    storeys = [storey_of.get(element.id()) for element in elements]
+    type_code, types = _encode([element.is_a() for element in elements])
+    storey_code, storey_ids = _encode([storey.GlobalId if storey else None for storey in storeys])
+    storey_name_of = {storey.GlobalId: storey.Name or "" for storey in storeys if storey is not None}
+    storey_names = np.array([storey_name_of[gid] for gid in storey_ids], dtype=str)
+    name_code, names = _encode([element.Name for element in elements])
+    material_code, materials = _encode([material_of.get(element.id()) for element in elements])
+
+    bbox = np.full((count, 6), np.nan, dtype=np.float32)
+    if elements:
+        iterator = geometry_iterator(ifc_file, elements)
+        if iterator.initialize():
+            while True:
+                shape = iterator.get()
+                verts = np.asarray(shape.geometry.verts, dtype=np.float32).reshape(-1, 3)
+                if len(verts):
+                    row = index_of[shape.id]
+                    bbox[row, :3] = verts.min(axis=0)
+                    bbox[row, 3:] = verts.max(axis=0)
+                if not iterator.next():
+                    break
+
+    return {
+        "format_version": np.array(INDEX_FORMAT_VERSION),
+        "global_id": np.array([element.GlobalId for element in elements], dtype="S22"),
+        "type_code": type_code.astype(np.int16),
+        "types": types,
+        "storey_code": storey_code,
+        "storey_ids": storey_ids,
+        "storey_names": storey_names,
+        "name_code": name_code,
+        "names": names,
+        "material_code": material_code,
+        "materials": materials,
+        "bbox": bbox,
+    }
+
+
+def ingest_stored_ifc(bucket_name: str, file_path: str, generation: int = 0) -> dict:
+    """Job entry point: build the element index of a stored IFC and upload it next to the file."""
+    from supabase_client import get_supabase
+
+    supabase = get_supabase()
+
+    try:
+        started = time.perf_counter()
+        ifc_file = get_model(bucket_name, file_path, generation)
+        columns = build_element_index(ifc_file)
+
+        # Uncompressed so members can be extracted and memory-mapped as-is
+        buffer = io.BytesIO()
+        np.savez(buffer, **columns)
+        payload = buffer.getvalue()
+
+        artifact = index_path(file_path)
+        supabase.storage.from_(bucket_name).upload(
+            artifact, payload,
+            {"content-type": "application/octet-stream", "upsert": "true"},
+        )
+        return {
+            "artifact": artifact,
+            "element_count": int(len(columns["global_id"])),
+            "bytes": len(payload),
+            "seconds": round(time.perf_counter() - started, 4),
+        }
+
+    except Exception as e:
+        import traceback
+        print(f"Ingest Error: {e}")
+        print(traceback.format_exc())
+        raise RuntimeError(f"Error ingesting file: {str(e)}") from None
+
+
+def submit_ingest(user_id: str, bucket_name: str, file_path: str):
+    """Queue an ingest job for a file (API process side)."""
+    invalidate_index(bucket_name, file_path)
+    return job_manager.submit(
+        user_id, "ingest", ingest_stored_ifc,
+        bucket_name, file_path, current_generation(bucket_name, file_path),
+    )
+
+
+def submit_background_ingest(bucket_name: str, file_path: str) -> Optional[Job]:
+    """Queue an ingest as background work; None if it was deferred (see JobManager.submit_background)."""
+    invalidate_index(bucket_name, file_path)
+    return job_manager.submit_background(
+        "ingest", ingest_stored_ifc,
+        bucket_name, file_path, current_generation(bucket_name, file_path),
+    )
+
+
+# --- Querying (runs in the API process) ---
+
+class ElementIndex:
+    """Read-only view over an extracted index directory; row columns are memory-mapped."""
+
+    def __init__(self, directory: str, version: Optional[str]):
+        self.directory = directory
+        self.version = version
+        self.checked_at = time.time()
+
+        def load(name: str, mmap: bool = True) -> np.ndarray:
+            return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r" if mmap else None)
+
+        self.global_id = load("global_id")
+        self.type_code = load("type_code")
+        self.storey_code = load("storey_code")
+        self.name_code = load("name_code")
+        self.material_code = load("material_code")
+        self.bbox = load("bbox")
+        # Vocabularies are small; keep them in memory
+        self.types = load("types", mmap=False)
+        self.storey_ids = load("storey_ids", mmap=False)
+        self.storey_names = load("storey_names", mmap=False)
+        self.names = load("names", mmap=False)
+        self.materials = load("materials", mmap=False)
+
+    def __len__(self) -> int:
+        return len(self.global_id)
+
+    def _codes(self, vocabulary: np.ndarray, values: List[str]) -> np.ndarray:
+        return np.flatnonzero(np.isin(vocabulary, values))
+
+    def filter(
+        self,
+        ifc_types: Optional[List[str]] = None,
+        storeys: Optional[List[str]] = None,
+        materials: Optional[List[str]] = None,
+        name_prefix: Optional[str] = None,
+        global_ids: Optional[List[str]] = None,
+        bbox: Optional[List[float]] = None,
+    ) -> np.ndarray:
+        """Boolean row mask for the given filters (all filters are ANDed)."""
+        mask = np.ones(len(self), dtype=bool)
+        if ifc_types:
+            mask &= np.isin(self.type_code, self._codes(self.types, ifc_types))
+        if storeys:
+            # Accept storey names or GlobalIds
+            codes = np.union1d(self._codes(self.storey_names, storeys), self._codes(self.storey_ids, storeys))
+            mask &= np.isin(self.storey_code, codes)
+        if materials:
+            mask &= np.isin(self.material_code, self._codes(self.materials, materials))
+        if name_prefix:
+            codes = np.flatnonzero(np.char.startswith(self.names, name_prefix)) if len(self.names) else []
+            mask &= np.isin(self.name_code, codes)
+        if global_ids:
+            mask &= np.isin(self.global_id, np.array(global_ids, dtype="S22"))
+        if bbox:
+            lo, hi = np.asarray(bbox[:3], dtype=np.float32), np.asarray(bbox[3:], dtype=np.float32)
+            boxes = self.bbox
+            mask &= np.all(boxes[:, :3] <= hi, axis=1) & np.all(boxes[:, 3:] >= lo, axis=1)
+        return mask
+
+    def group_counts(self, mask: np.ndarray, group_by: str) -> Dict[str, int]:
+        codes, vocabulary = {
+            "type": (self.type_code, self.types),
+            "storey": (self.storey_code, self.storey_names),
+            "material": (self.material_code, self.materials),
+        }[group_by]
+        selected = np.asarray(codes[mask], dtype=np.int64)
+        counts = np.bincount(selected[selected >= 0], minlength=len(vocabulary))
+        groups = {str(vocabulary[i]): int(counts[i]) for i in np.flatnonzero(counts)}
+        unassigned = int((selected < 0).sum())
+        if unassigned:
+            groups[""] = unassigned
+        return groups
+
+    def rows(self, mask: np.ndarray, offset: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
+        return self.rows_at(np.flatnonzero(mask)[offset:offset + limit])
+
+    def rows_at(self, selected: np.ndarray) -> List[Dict[str, Any]]:
+        """Decode the given row numbers, in the given order."""
+        def lookup(vocabulary: np.ndarray, code: int) -> Optional[str]:
+            return str(vocabulary[code]) if code >= 0 else None
+
+        rows = []
+        for row in selected:
+            box = self.bbox[row]
+            rows.append({
+                "global_id": self.global_id[row].decode(),
+                "ifc_type": str(self.types[self.type_code[row]]),
+                "storey": lookup(self.storey_names, self.storey_code[row]),
+                "name": lookup(self.names, self.name_code[row]),
+                "material": lookup(self.materials, self.material_code[row]),
+                "bbox": None if np.isnan(box).any() else [float(v) for v in box],
+            })
+        return rows
+
+
+_indexes: "OrderedDict[Tuple[str, str], ElementIndex]" = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def _remove_directory(index: ElementIndex):
+    """Delete an index's extracted files; its memory-mapped columns stay readable until released."""
+    shutil.rmtree(index.directory, ignore_errors=True)
+
+
+def invalidate_index(bucket_name: str, file_path: str):
+    with _indexes_lock:
+        index = _indexes.pop((bucket_name, file_path), None)
+    if index is not None:
+        _remove_directory(index)
+
+
+def _index_directory(bucket_name: str, file_path: str, version: Optional[str]) -> str:
+    key = hashlib.sha1(f"{bucket_name}/{file_path}@{version}".encode()).hexdigest()
+    return os.path.join(ELEMENT_INDEX_DIR, key)
+
+
+def _remove_stale_staging():
+    cutoff = time.time() - STALE_STAGING_SECONDS
+    for entry in os.scandir(ELEMENT_INDEX_DIR):
+        try:
+            if entry.name.startswith(STAGING_PREFIX) and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        except FileNotFoundError:
+            pass
+
+
+def _extract(bucket_name: str, file_path: str, info: Optional[ObjectInfo] = None) -> Tuple[str, Optional[str]]:
+    """
+    Download the artifact and unpack its members into a local directory, atomically.
+    A version already extracted (e.g. by another worker process) is not downloaded again.
+    """
+    os.makedirs(ELEMENT_INDEX_DIR, exist_ok=True)
+    if info is None:
+        info = stat_object(bucket_name, index_path(file_path))
+    if info.version is not None:
+        directory = _index_directory(bucket_name, file_path, info.version)
+        if os.path.isdir(directory):
+            return directory, info.version
+
+    _remove_stale_staging()
+    staging = tempfile.mkdtemp(prefix=STAGING_PREFIX, dir=ELEMENT_INDEX_DIR)
+    try:
+        archive = os.path.join(staging, "index.npz")
+        info = download_to_file(bucket_name, index_path(file_path), archive)
+        directory = _index_directory(bucket_name, file_path, info.version)
+        if not os.path.isdir(directory):
+            with zipfile.ZipFile(archive) as zipped:
+                zipped.extractall(staging)
+            os.remove(archive)
+            try:
+                os.rename(staging, directory)
+            except OSError:
+                # Another request extracted the same version first
+                pass
+        return directory, info.version
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def open_index(bucket_name: str, file_path: str) -> ElementIndex:
+    """
+    Return the element index of a file, downloading and extracting it on first use.
+    Opened indexes are kept in a small LRU and revalidated against storage
+    every ELEMENT_INDEX_REVALIDATE_SECONDS. The extracted files of an index
+    are deleted when it drops out of the LRU or a newer version replaces it.
+    """
+    key = (bucket_name, file_path)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+
+    info = None
+    if index is not None:
+        if time.time() - index.checked_at < ELEMENT_INDEX_REVALIDATE_SECONDS:
+            return index
+        info = stat_object(bucket_name, index_path(file_path))
+        if info.version is not None and info.version == index.version:
+            index.checked_at = time.time()
+            return index
+
+    directory, version = _extract(bucket_name, file_path, info)
+    try:
+        opened = ElementIndex(directory, version)
+    except FileNotFoundError:
+        # Another process removed the directory in between (it evicted this version); extract it again
+        directory, version = _extract(bucket_name, file_path)
+        opened = ElementIndex(directory, version)
+    dropped = []
+    with _indexes_lock:
+        replaced = _indexes.get(key)
+        if replaced is not None and replaced.directory != opened.directory:
+            dropped.append(replaced)
+        _indexes[key] = opened
+        _indexes.move_to_end(key)
+        while len(_indexes) > ELEMENT_INDEX_CACHE_ENTRIES:
+            dropped.append(_indexes.popitem(last=False)[1])
+    for index in dropped:
+        _remove_directory(index)
+    return opened
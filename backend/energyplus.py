@@ -0,0 +1,556 @@
+"""
+EnergyPlus (epJSON) export of scene models.
+Scene items are packed into NumPy arrays once, and all surfaces are placed
+with one batched rotation/scale/translation instead of per-item Python math.
+
+Each item's contribution to the document (material, construction and surface)
+depends only on the item itself, so contributions are cached by a hash of the
+item's inputs. Re-exporting an edited scene only recomputes the items that
+changed; names that depend on the item order (Wall_N, host walls) are assigned
+when the document is assembled.
+
+Large documents can also be written as a stream of JSON chunks, section by
+section, without building the document dict or the list of contributions
+(iter_epjson over ExportCache.iter_contributions, one batch at a time).
+
+Encoded documents are kept in the artifact store by scene hash and
+EPJSON_PIPELINE_VERSION (epjson_document, epjson_chunks), so every API worker
+serves an export that any of them produced, also after a restart.
+"""
+import os
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+import orjson
+from ifc_loader import IFC_SCRATCH_DIR, stat_object
+from element_index import ARTIFACT_PREFIX
+from artifact_store import EPJSON, artifact_key, artifact_store
+
+EPJSON_VERSION = "9.6"
+# Bump when the document generated for a scene changes; stored exports of other versions are ignored
+EPJSON_PIPELINE_VERSION = "1"
+
+# Item size in metres when the marketplace properties do not give one
+DEFAULT_WIDTH = 1.0
+DEFAULT_HEIGHT = 2.0
+DEFAULT_DEPTH = 0.1
+
+KIND_OTHER = 0
+KIND_WALL = 1
+KIND_FENESTRATION = 2
+
+# Byte budget of the item contributions kept across exports
+EPJSON_CACHE_BYTES = int(os.environ.get("EPJSON_CACHE_BYTES", str(128 * 1024 * 1024)))
+# Estimated footprint of a contribution, and extra for the vertices of a surface
+CONTRIBUTION_BYTES = 400
+SURFACE_BYTES = 1100
+# Assembled documents kept by scene hash
+EPJSON_CACHE_SCENES = int(os.environ.get("EPJSON_CACHE_SCENES", "8"))
+# Objects encoded per chunk, and items computed per batch, when streaming a document
+EPJSON_STREAM_BATCH = int(os.environ.get("EPJSON_STREAM_BATCH", "1000"))
+EPJSON_CONTENT_TYPE = "application/json"
+
+
+def item_extent(props: Dict[str, Any]) -> Tuple[float, float, float]:
+    """(width, height, depth) of an item's properties. Raises ValueError unless all are numbers."""
+    values = (props.get("width", DEFAULT_WIDTH), props.get("height", DEFAULT_HEIGHT), props.get("depth", DEFAULT_DEPTH))
+    if not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+        raise ValueError("width, height and depth must be numbers")
+    return values
+
+
+def check_item_properties(ifc_types: Sequence[Any], physics: Sequence[Any]):
+    """Raises ValueError unless every ifc_type is a string and every physics entry an object."""
+    if not all(isinstance(value, str) for value in ifc_types) or not all(isinstance(value, dict) for value in physics):
+        raise ValueError("ifc_type must be a string and physics an object")
+
+
+class PackedScene:
+    """
+    Column-wise scene: one row per placed item.
+    positions, rotations (Euler XYZ in radians, three.js convention), scales
+    and extents (width, height, depth) are float64 (n, 3) arrays.
+    """
+
+    def __init__(
+        self,
+        item_ids: List[str],
+        ifc_types: List[str],
+        physics: List[Dict[str, Any]],
+        positions: np.ndarray,
+        rotations: np.ndarray,
+        scales: np.ndarray,
+        extents: np.ndarray,
+    ):
+        self.item_ids = item_ids
+        self.ifc_types = ifc_types
+        self.physics = physics
+        self.positions = positions
+        self.rotations = rotations
+        self.scales = scales
+        self.extents = extents
+
+    def __len__(self) -> int:
+        return len(self.item_ids)
+
+    @classmethod
+    def from_items(cls, items: Sequence[Any]) -> "PackedScene":
+        """
+        Pack SceneModelItem objects (anything with the same attributes).
+        Raises ValueError for vectors without 3 components or properties
+        item_extent or check_item_properties reject.
+        """
+        properties = [item.properties for item in items]
+
+        def vectors(name: str) -> np.ndarray:
+            values = [getattr(item, name) for item in items]
+            if not all(len(value) == 3 for value in values):
+                raise ValueError(f"{name} must have 3 components")
+            return np.array(values, dtype=np.float64).reshape(-1, 3)
+
+        ifc_types = [props.get("ifc_type", "") for props in properties]
+        physics = [props.get("physics", {}) for props in properties]
+        check_item_properties(ifc_types, physics)
+        return cls(
+            item_ids=[item.itemId for item in items],
+            ifc_types=ifc_types,
+            physics=physics,
+            positions=vectors("position"),
+            rotations=vectors("rotation"),
+            scales=vectors("scale"),
+            extents=np.array([item_extent(props) for props in properties], dtype=np.float64).reshape(-1, 3),
+        )
+
+    def kinds(self) -> np.ndarray:
+        """KIND_WALL / KIND_FENESTRATION / KIND_OTHER per item, from the IFC type name."""
+        if not len(self):
+            return np.empty(0, dtype=np.int8)
+        type_names, inverse = np.unique(np.array(self.ifc_types, dtype=str), return_inverse=True)
+        per_type = np.array([
+            KIND_WALL if "Wall" in name else KIND_FENESTRATION if "Window" in name or "Door" in name else KIND_OTHER
+            for name in type_names
+        ], dtype=np.int8)
+        return per_type[inverse]
+
+
+def rotation_matrices(euler: np.ndarray) -> np.ndarray:
+    """(n, 3, 3) rotation matrices for Euler angles in XYZ order (R = Rx @ Ry @ Rz, as three.js)."""
+    cx, cy, cz = np.cos(euler).T
+    sx, sy, sz = np.sin(euler).T
+    matrices = np.empty((len(euler), 3, 3))
+    matrices[:, 0, 0] = cy * cz
+    matrices[:, 0, 1] = -cy * sz
+    matrices[:, 0, 2] = sy
+    matrices[:, 1, 0] = cx * sz + sx * sy * cz
+    matrices[:, 1, 1] = cx * cz - sx * sy * sz
+    matrices[:, 1, 2] = -sx * cy
+    matrices[:, 2, 0] = sx * sz - cx * sy * cz
+    matrices[:, 2, 1] = sx * cz + cx * sy * sz
+    matrices[:, 2, 2] = cx * cy
+    return matrices
+
+
+def surface_vertices(scene: PackedScene, rows: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    (n, 4, 3) world corners of each item's surface rectangle: width x height
+    in the item's local XY plane, scaled, rotated about the item origin and
+    translated to its position. rows selects a subset of items.
+    """
+    if rows is None:
+        rows = slice(None)
+    rotation = rotation_matrices(scene.rotations[rows])
+    size = scene.extents[rows] * scene.scales[rows]
+    # The rectangle spans the rotated local X and Y axes, so its corners are
+    # origin, origin + u, origin + u + v and origin + v
+    u = rotation[:, :, 0] * size[:, 0:1]
+    v = rotation[:, :, 1] * size[:, 1:2]
+    origin = scene.positions[rows]
+    return np.stack([origin, origin + u, origin + u + v, origin + v], axis=1)
+
+
+def vertex_blocks(corners: np.ndarray) -> List[List[Dict[str, float]]]:
+    """epJSON vertex lists for (n, 4, 3) corners, built from one flat conversion."""
+    coordinates = iter(corners.reshape(-1).tolist())
+    vertices = [
+        {"vertex_x_coordinate": x, "vertex_y_coordinate": y, "vertex_z_coordinate": z}
+        for x, y, z in zip(coordinates, coordinates, coordinates)
+    ]
+    return [vertices[start:start + 4] for start in range(0, len(vertices), 4)]
+
+
+def material(physics: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "roughness": "MediumRough",
+        "thickness": physics.get("thickness", 0.2),
+        "conductivity": physics.get("thermal_conductivity", 1.4),
+        "density": physics.get("density", 2400),
+        "specific_heat": physics.get("specific_heat", 880),
+    }
+
+
+def default_zone() -> Dict[str, Any]:
+    return {
+        "direction_of_relative_north": 0.0,
+        "x_origin": 0.0,
+        "y_origin": 0.0,
+        "z_origin": 0.0,
+        "type": 1,
+        "multiplier": 1,
+        "ceiling_height": 3.0,
+        "volume": 100.0,
+    }
+
+
+def document_header() -> Dict[str, Any]:
+    return {
+        "Version": {
+            "Version 1": {
+                "version_identifier": EPJSON_VERSION
+            }
+        },
+        "Building": {
+            "Building 1": {
+                "north_axis": 0.0,
+                "terrain": "Suburbs",
+                "loads_convergence_tolerance_value": 0.04,
+                "temperature_convergence_tolerance_value": 0.4,
+                "solar_distribution": "FullExterior",
+                "maximum_number_of_warmup_days": 25,
+                "minimum_number_of_warmup_days": 6
+            }
+        },
+    }
+
+
+def item_hashes(scene: PackedScene) -> List[str]:
+    """
+    Hash of everything an item's contribution depends on: itemId, IFC type,
+    size, position, rotation, scale and physics.
+    """
+    numbers = np.ascontiguousarray(
+        np.hstack([scene.positions, scene.rotations, scene.scales, scene.extents]), dtype="<f8"
+    )
+    raw = numbers.tobytes()
+    width = numbers.shape[1] * 8 if numbers.ndim == 2 else 0
+    hashes = []
+    # Items decoded from the binary scene format share their physics dicts
+    texts: Dict[int, str] = {}
+    for row, (item_id, ifc_type, physics) in enumerate(zip(scene.item_ids, scene.ifc_types, scene.physics)):
+        digest = hashlib.sha1(raw[row * width:(row + 1) * width])
+        # repr is much cheaper than sorted JSON; a different key order only costs a cache miss
+        text = texts.get(id(physics))
+        if text is None:
+            text = texts[id(physics)] = repr(physics)
+        digest.update(f"{item_id}\0{ifc_type}\0{text}".encode())
+        hashes.append(digest.hexdigest())
+    return hashes
+
+
+def scene_hash(hashes: Sequence[str]) -> str:
+    """
+    Hash of a whole scene: its item hashes in order, plus the epJSON and
+    pipeline versions (it is the export's ETag, so a pipeline change must change it).
+    """
+    digest = hashlib.sha256(f"{EPJSON_VERSION}\0{EPJSON_PIPELINE_VERSION}\0".encode())
+    for value in hashes:
+        digest.update(value.encode())
+    return digest.hexdigest()
+
+
+class Contribution:
+    """One item's part of the document, independent of its position in the scene."""
+
+    __slots__ = ("kind", "material_name", "material", "construction_name", "vertices", "size")
+
+    def __init__(self, kind: int, item_id: str, physics: Dict[str, Any], vertices: Optional[list]):
+        self.kind = kind
+        self.material_name = f"Material_{item_id}"
+        self.material = material(physics)
+        self.construction_name = f"Construction_{item_id}"
+        self.vertices = vertices
+        # Estimated bytes, charged against EPJSON_CACHE_BYTES
+        self.size = CONTRIBUTION_BYTES + 2 * len(item_id) + (SURFACE_BYTES if vertices is not None else 0)
+
+
+def item_contributions(scene: PackedScene, rows: Optional[np.ndarray] = None, kinds: Optional[np.ndarray] = None) -> List[Contribution]:
+    """
+    Contributions of the selected items (all by default), with one batched
+    surface transform. kinds is scene.kinds(), for callers that already have it.
+    """
+    if kinds is None:
+        kinds = scene.kinds()
+    if rows is None:
+        rows = np.arange(len(scene))
+    rows = np.asarray(rows, dtype=np.int64)
+    selected_kinds = kinds[rows]
+    surfaces = rows[selected_kinds != KIND_OTHER]
+    blocks = iter(vertex_blocks(surface_vertices(scene, surfaces)))
+    return [
+        Contribution(kind, scene.item_ids[row], scene.physics[row], next(blocks) if kind != KIND_OTHER else None)
+        for row, kind in zip(rows.tolist(), selected_kinds.tolist())
+    ]
+
+
+def _materials(contributions: Iterable[Contribution]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """One Material per distinct itemId, from the physics of its first item."""
+    seen = set()
+    for item in contributions:
+        if item.material_name not in seen:
+            seen.add(item.material_name)
+            yield item.material_name, item.material
+
+
+def _wall_surfaces(contributions: Iterable[Contribution]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    number = 0
+    for item in contributions:
+        if item.kind == KIND_WALL:
+            number += 1
+            yield f"Wall_{number}", {
+                "construction_name": item.construction_name,
+                "zone_name": "Zone 1",
+                "surface_type": "Wall",
+                "outside_boundary_condition": "Outdoors",
+                "vertices": item.vertices,
+            }
+
+
+def _fenestration_surfaces(contributions: Iterable[Contribution]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    # Host = the most recent wall before the opening (Wall_0 if none, as before)
+    walls = 0
+    number = 0
+    for item in contributions:
+        if item.kind == KIND_WALL:
+            walls += 1
+        elif item.kind == KIND_FENESTRATION:
+            number += 1
+            yield f"Fenestration_{number}", {
+                "construction_name": item.construction_name,
+                "building_surface_name": f"Wall_{walls}",
+                "vertices": item.vertices,
+            }
+
+
+def assemble_document(contributions: Sequence[Contribution]) -> dict:
+    """
+    Build the epJSON document from item contributions in scene order.
+    Walls become BuildingSurface:Detailed (Wall_1, Wall_2, ...), windows and
+    doors FenestrationSurface:Detailed hosted by the most recent wall before
+    them, and every distinct itemId gets a Material.
+    """
+    epjson = document_header()
+    epjson["Material"] = dict(_materials(contributions))
+    epjson["BuildingSurface:Detailed"] = dict(_wall_surfaces(contributions))
+    epjson["FenestrationSurface:Detailed"] = dict(_fenestration_surfaces(contributions))
+    epjson["Zone"] = {"Zone 1": default_zone()}
+    return epjson
+
+
+def _encode_section(name: str, entries: Iterable[Tuple[str, Any]]) -> Iterator[bytes]:
+    """'"name":{...}' in chunks of EPJSON_STREAM_BATCH objects."""
+    yield orjson.dumps(name) + b":{"
+    batch: List[bytes] = []
+    separator = b""
+    for key, value in entries:
+        batch.append(orjson.dumps(key) + b":" + orjson.dumps(value))
+        if len(batch) >= EPJSON_STREAM_BATCH:
+            yield separator + b",".join(batch)
+            batch.clear()
+            separator = b","
+    if batch:
+        yield separator + b",".join(batch)
+    yield b"}"
+
+
+def iter_epjson(contributions: Callable[[], Iterable[Contribution]]) -> Iterator[bytes]:
+    """
+    The document of assemble_document as JSON chunks (same keys and order),
+    encoded section by section so only one batch of objects is held at a time.
+    contributions() is called once per section and yields the contributions in
+    scene order, e.g. from ExportCache.iter_contributions.
+    """
+    # The header without its closing brace
+    yield orjson.dumps(document_header())[:-1] + b","
+    yield from _encode_section("Material", _materials(contributions()))
+    yield b","
+    yield from _encode_section("BuildingSurface:Detailed", _wall_surfaces(contributions()))
+    yield b","
+    yield from _encode_section("FenestrationSurface:Detailed", _fenestration_surfaces(contributions()))
+    yield b","
+    yield from _encode_section("Zone", [("Zone 1", default_zone())])
+    yield b"}"
+
+
+def export_path(scene_hash: str) -> str:
+    """Storage path of a stored export; the scene hash makes it content-addressed."""
+    return f"{ARTIFACT_PREFIX}/exports/{scene_hash}.epjson"
+
+
+def _stored_key(scene_hash: str) -> str:
+    return artifact_key(EPJSON, EPJSON_PIPELINE_VERSION, scene_hash)
+
+
+def epjson_document(scene: PackedScene, hashes: List[str], scene_hash: str) -> bytes:
+    """The encoded epJSON document of a scene, from the artifact store or built and stored."""
+    key = _stored_key(scene_hash)
+    data = artifact_store.get(EPJSON, key)
+    if data is None:
+        _, document = export_cache.export(scene, hashes)
+        data = orjson.dumps(document)
+        artifact_store.put(EPJSON, key, data)
+    return data
+
+
+def epjson_chunks(scene: PackedScene, hashes: List[str], scene_hash: str) -> Iterator[bytes]:
+    """
+    The encoded document as chunks: read from the artifact store, or encoded
+    with iter_epjson and stored once the last chunk has been consumed.
+    """
+    key = _stored_key(scene_hash)
+    chunks = artifact_store.chunks(EPJSON, key)
+    if chunks is None:
+        kinds = scene.kinds()
+        first_pass = iter((True,))
+
+        def contributions() -> Iterator[Contribution]:
+            # Hits and misses are counted in the first pass only
+            return export_cache.iter_contributions(scene, hashes, kinds, record=next(first_pass, False))
+
+        chunks = artifact_store.tee(EPJSON, key, iter_epjson(contributions))
+    return chunks
+
+
+def store_epjson(bucket_name: str, scene_hash: str, scene: PackedScene, hashes: List[str]) -> str:
+    """
+    Write the epJSON of a scene to storage through a scratch file and return its path.
+    An export of the same scene that is already stored is not written again.
+    """
+    from supabase_client import get_supabase
+
+    supabase = get_supabase()
+
+    path = export_path(scene_hash)
+    try:
+        stat_object(bucket_name, path)
+        return path
+    except RuntimeError:
+        pass
+
+    os.makedirs(IFC_SCRATCH_DIR, exist_ok=True)
+    scratch_path = os.path.join(IFC_SCRATCH_DIR, f"{os.getpid()}-{uuid.uuid4().hex}.epjson")
+    try:
+        with open(scratch_path, "wb") as target:
+            for chunk in epjson_chunks(scene, hashes, scene_hash):
+                target.write(chunk)
+        with open(scratch_path, "rb") as source:
+            supabase.storage.from_(bucket_name).upload(
+                path, source, {"content-type": EPJSON_CONTENT_TYPE, "upsert": "true"}
+            )
+        return path
+    finally:
+        if os.path.exists(scratch_path):
+            os.remove(scratch_path)
+
+
+class ExportCache:
+    """
+    LRU caches of item contributions (by item hash, bounded by their
+    estimated bytes) and of assembled documents (by scene hash). Cached
+    documents are shared between responses and must not be modified.
+    """
+
+    def __init__(self, max_bytes: int, max_scenes: int):
+        self.max_bytes = max_bytes
+        self.max_scenes = max_scenes
+        self._items: "OrderedDict[str, Contribution]" = OrderedDict()
+        self._bytes = 0
+        self._scenes: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.scene_hits = 0
+        self.scene_misses = 0
+        self.item_hits = 0
+        self.item_misses = 0
+
+    def export(self, scene: PackedScene, hashes: Optional[List[str]] = None) -> Tuple[str, dict]:
+        """(scene hash, epJSON document) of a scene, recomputing only items not seen before."""
+        if hashes is None:
+            hashes = item_hashes(scene)
+        key = scene_hash(hashes)
+        with self._lock:
+            document = self._scenes.get(key)
+            if document is not None:
+                self._scenes.move_to_end(key)
+                self.scene_hits += 1
+                return key, document
+            self.scene_misses += 1
+
+        document = assemble_document(self.contributions(scene, hashes))
+        with self._lock:
+            self._scenes[key] = document
+            while len(self._scenes) > self.max_scenes:
+                self._scenes.popitem(last=False)
+        return key, document
+
+    def contributions(self, scene: PackedScene, hashes: List[str]) -> List[Contribution]:
+        """Item contributions in scene order, computing and caching those not seen before."""
+        return list(self.iter_contributions(scene, hashes))
+
+    def iter_contributions(
+        self, scene: PackedScene, hashes: List[str], kinds: Optional[np.ndarray] = None, record: bool = True,
+    ) -> Iterator[Contribution]:
+        """
+        Item contributions in scene order, looked up and computed
+        EPJSON_STREAM_BATCH items at a time, so a pass holds one batch of new
+        items besides what the cache keeps. record=False leaves the hit and miss
+        counters alone (for further passes over the same scene).
+        """
+        if kinds is None:
+            kinds = scene.kinds()
+        for start in range(0, len(hashes), EPJSON_STREAM_BATCH):
+            batch = hashes[start:start + EPJSON_STREAM_BATCH]
+            with self._lock:
+                cached = [self._items.get(value) for value in batch]
+
+            missing = [offset for offset, item in enumerate(cached) if item is None]
+            if missing:
+                rows = np.array(missing, dtype=np.int64) + start
+                for offset, item in zip(missing, item_contributions(scene, rows, kinds)):
+                    cached[offset] = item
+
+            with self._lock:
+                if record:
+                    self.item_hits += len(batch) - len(missing)
+                    self.item_misses += len(missing)
+                for value, item in zip(batch, cached):
+                    self._put(value, item)
+            yield from cached
+
+    def _put(self, value: str, item: Contribution):
+        """Add or refresh an item; callers hold the lock."""
+        if value in self._items:
+            self._items.move_to_end(value)
+            return
+        self._items[value] = item
+        self._bytes += item.size
+        while self._bytes > self.max_bytes and self._items:
+            _, evicted = self._items.popitem(last=False)
+            self._bytes -= evicted.size
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "items": len(self._items),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "scenes": len(self._scenes),
+                "max_scenes": self.max_scenes,
+                "item_hits": self.item_hits,
+                "item_misses": self.item_misses,
+                "scene_hits": self.scene_hits,
+                "scene_misses": self.scene_misses,
+            }
+
+
+export_cache = ExportCache(EPJSON_CACHE_BYTES, EPJSON_CACHE_SCENES)
@@ -0,0 +1,334 @@
+"""
+Pre-tessellated geometry artifacts ("fragments") for the viewer.
+Each IFC is converted once into a compact binary file of instanced triangle
+meshes, so opening a model in the browser no longer needs web-ifc to parse it.
+
+Artifacts are content-addressed by the SHA-256 of the IFC and the format
+version, so identical uploads (re-uploads, copies in other projects) share one
+conversion. A small
+pointer object next to the IFC records which hash belongs to which version of
+the file.
+
+File layout (little-endian):
+    0   b"VXFR"
+    4   uint32 format version
+    8   uint32 header length N (JSON, space-padded to a multiple of 4)
+    12  header JSON
+    12+N  binary section; header["buffers"][name] = [offset, byte length, dtype, shape]
+          with offsets relative to the start of the binary section
+
+Buffers:
+    positions        float32 (V, 3)  local vertex positions of all geometries, metres
+    normals          int8    (V, 3)  vertex normals scaled by 127
+    indices          uint32  (I,)    triangle indices, relative to the geometry's first vertex
+    geometries       uint32  (G, 4)  first vertex, vertex count, first mesh, mesh count
+    meshes           uint32  (M, 2)  first index, index count (one per material of a geometry)
+    mesh_colors      uint8   (M, 4)  RGBA
+    instance_geometry uint32 (N,)    geometry drawn by each element
+    instance_matrix  float32 (N, 16) column-major placement matrix (three.js Matrix4 order)
+    instance_express_id uint32 (N,)
+    instance_type    uint16  (N,)    index into header["types"]
+"""
+import os
+import io
+import json
+import uuid
+import time
+import struct
+import hashlib
+import threading
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+import numpy as np
+from ifc_loader import IFC_SCRATCH_DIR, download_to_file, read_object, stat_object
+from ifc_analysis import IFC_GEOMETRY_LIBRARY, IFC_GEOMETRY_THREADS
+from element_index import ARTIFACT_PREFIX, indexed_elements
+from jobs import Job, job_manager
+from tiles import TILES_CONTENT_TYPE, TILES_FORMAT_VERSION, build_tiles, manifest_size, tiles_path
+
+if TYPE_CHECKING:
+    import ifcopenshell
+
+FRAGMENTS_MAGIC = b"VXFR"
+FRAGMENTS_FORMAT_VERSION = 1
+FRAGMENTS_CONTENT_TYPE = "application/vnd.voxel.fragments"
+DEFAULT_COLOR = (200, 200, 200, 255)
+
+
+def fragments_path(sha256: str) -> str:
+    """Storage path of the content-addressed artifact (per format version, so a bump never reuses old files)."""
+    return f"{ARTIFACT_PREFIX}/fragments/v{FRAGMENTS_FORMAT_VERSION}/{sha256}.vxfr"
+
+
+def pointer_path(file_path: str) -> str:
+    """Storage path of the pointer recording which artifact belongs to a file."""
+    return f"{ARTIFACT_PREFIX}/{file_path}.fragments.json"
+
+
+def _rgba(material) -> Tuple[int, int, int, int]:
+    diffuse = material.diffuse
+    transparency = material.transparency
+    alpha = 1.0 if transparency != transparency else 1.0 - transparency  # NaN = opaque
+    return tuple(int(round(min(max(value, 0.0), 1.0) * 255)) for value in (diffuse.r(), diffuse.g(), diffuse.b(), alpha))
+
+
+def build_fragments(ifc_file: "ifcopenshell.file", source_sha256: str = "") -> bytes:
+    """Tessellate all elements of a model and serialise them in the fragments format."""
+    import ifcopenshell.geom
+
+    elements = indexed_elements(ifc_file)
+
+    geometry_of: Dict[str, int] = {}
+    positions: List[np.ndarray] = []
+    normals: List[np.ndarray] = []
+    indices: List[np.ndarray] = []
+    geometries: List[Tuple[int, int, int, int]] = []
+    meshes: List[Tuple[int, int]] = []
+    mesh_colors: List[Tuple[int, int, int, int]] = []
+    vertex_total = 0
+    index_total = 0
+
+    instance_geometry: List[int] = []
+    instance_matrix: List[tuple] = []
+    instance_express_id: List[int] = []
+    instance_types: List[str] = []
+    global_ids: List[str] = []
+
+    if elements:
+        # Local coordinates plus a placement matrix, so a representation shared
+        # by many elements (type-mapped doors, windows, ...) is stored once
+        settings = ifcopenshell.geom.settings()
+        iterator = ifcopenshell.geom.iterator(
+            settings, ifc_file, IFC_GEOMETRY_THREADS,
+            include=elements, geometry_library=IFC_GEOMETRY_LIBRARY,
+        )
+        if iterator.initialize():
+            while True:
+                shape = iterator.get()
+                geometry = shape.geometry
+                number = geometry_of.get(geometry.id)
+                if number is None:
+                    verts = np.asarray(geometry.verts, dtype=np.float32).reshape(-1, 3)
+                    faces = np.asarray(geometry.faces, dtype=np.uint32).reshape(-1, 3)
+                    if len(faces):
+                        vertex_normals = np.asarray(geometry.normals, dtype=np.float32).reshape(-1, 3)
+                        if len(vertex_normals) != len(verts):
+                            vertex_normals = np.zeros_like(verts)
+                        material_ids = np.asarray(geometry.material_ids, dtype=np.int64)
+                        if len(material_ids) != len(faces):
+                            material_ids = np.full(len(faces), -1, dtype=np.int64)
+                        order = np.argsort(material_ids, kind="stable")
+                        material_ids, starts, counts = np.unique(material_ids[order], return_index=True, return_counts=True)
+
+                        number = len(geometries)
+                        geometries.append((vertex_total, len(verts), len(meshes), len(material_ids)))
+                        for material_id, start, count in zip(material_ids, starts, counts):
+                            meshes.append((index_total + 3 * int(start), 3 * int(count)))
+                            known = 0 <= material_id < len(geometry.materials)
+                            mesh_colors.append(_rgba(geometry.materials[material_id]) if known else DEFAULT_COLOR)
+                        positions.append(verts)
+                        normals.append(np.clip(np.round(vertex_normals * 127), -127, 127).astype(np.int8))
+                        indices.append(faces[order].ravel())
+                        vertex_total += len(verts)
+                        index_total += 3 * len(faces)
+                    else:
+                        number = -1
+                    geometry_of[geometry.id] = number
+
+                if number >= 0:
+                    element = ifc_file.by_id(shape.id)
+                    instance_geometry.append(number)
+                    instance_matrix.append(shape.transformation.matrix)
+                    instance_express_id.append(shape.id)
+                    instance_types.append(element.is_a())
+                    global_ids.append(element.GlobalId)
+                if not iterator.next():
+                    break
+
+    types, type_code = np.unique(np.array(instance_types, dtype=str), return_inverse=True)
+    buffers = {
+        "positions": np.concatenate(positions) if positions else np.empty((0, 3), dtype=np.float32),
+        "normals": np.concatenate(normals) if normals else np.empty((0, 3), dtype=np.int8),
+        "indices": np.concatenate(indices) if indices else np.empty(0, dtype=np.uint32),
+        "geometries": np.array(geometries, dtype=np.uint32).reshape(-1, 4),
+        "meshes": np.array(meshes, dtype=np.uint32).reshape(-1, 2),
+        "mesh_colors": np.array(mesh_colors, dtype=np.uint8).reshape(-1, 4),
+        "instance_geometry": np.array(instance_geometry, dtype=np.uint32),
+        "instance_matrix": np.array(instance_matrix, dtype=np.float32).reshape(-1, 16),
+        "instance_express_id": np.array(instance_express_id, dtype=np.uint32),
+        "instance_type": type_code.astype(np.uint16),
+    }
+
+    binary = io.BytesIO()
+    layout = {}
+    for name, array in buffers.items():
+        binary.write(b"\0" * (-binary.tell() % 4))
+        data = np.ascontiguousarray(array).astype(array.dtype.newbyteorder("<"), copy=False).tobytes()
+        layout[name] = [binary.tell(), len(data), array.dtype.str.lstrip("<|"), list(array.shape)]
+        binary.write(data)
+
+    header = json.dumps({
+        "format_version": FRAGMENTS_FORMAT_VERSION,
+        "source_sha256": source_sha256,
+        "schema": ifc_file.schema,
+        "types": types.tolist(),
+        "global_ids": global_ids,
+        "buffers": layout,
+    }, separators=(",", ":")).encode()
+    header += b" " * (-len(header) % 4)
+    return FRAGMENTS_MAGIC + struct.pack("<II", FRAGMENTS_FORMAT_VERSION, len(header)) + header + binary.getvalue()
+
+
+def read_fragments(payload: bytes) -> Tuple[dict, Dict[str, np.ndarray]]:
+    """Parse a fragments file into its header and zero-copy buffer views."""
+    if payload[:4] != FRAGMENTS_MAGIC:
+        raise ValueError("Not a fragments file")
+    version, header_length = struct.unpack_from("<II", payload, 4)
+    if version != FRAGMENTS_FORMAT_VERSION:
+        raise ValueError(f"Unsupported fragments format version {version}")
+    header = json.loads(payload[12:12 + header_length])
+    start = 12 + header_length
+    buffers = {
+        name: np.frombuffer(payload, dtype=np.dtype(dtype).newbyteorder("<"), count=length // np.dtype(dtype).itemsize,
+                            offset=start + offset).reshape(shape)
+        for name, (offset, length, dtype, shape) in header["buffers"].items()
+    }
+    return header, buffers
+
+
+def _object_exists(bucket_name: str, file_path: str) -> bool:
+    try:
+        stat_object(bucket_name, file_path)
+        return True
+    except RuntimeError:
+        return False
+
+
+def convert_stored_ifc(bucket_name: str, file_path: str) -> dict:
+    """
+    Job entry point: hash a stored IFC, convert it to fragments and tiles
+    unless artifacts with that hash already exist, and point the file at them.
+    """
+    import ifcopenshell
+    from supabase_client import get_supabase
+
+    supabase = get_supabase()
+
+    os.makedirs(IFC_SCRATCH_DIR, exist_ok=True)
+    scratch_path = os.path.join(IFC_SCRATCH_DIR, f"{os.getpid()}-{uuid.uuid4().hex}.ifc")
+    try:
+        started = time.perf_counter()
+        digest = hashlib.sha256()
+        info = download_to_file(bucket_name, file_path, scratch_path, digest)
+        sha256 = digest.hexdigest()
+        artifact = fragments_path(sha256)
+        tiles_artifact = tiles_path(sha256)
+        storage = supabase.storage.from_(bucket_name)
+
+        reused = _object_exists(bucket_name, artifact) and _object_exists(bucket_name, tiles_artifact)
+        size = None
+        if reused:
+            prefix, _ = read_object(bucket_name, tiles_artifact, 12)
+            tiles_manifest_bytes = manifest_size(prefix)
+        else:
+            payload = build_fragments(ifcopenshell.open(scratch_path), sha256)
+            _, buffers = read_fragments(payload)
+            tiles_payload = build_tiles(buffers, sha256)
+            tiles_manifest_bytes = manifest_size(tiles_payload)
+            size = len(payload) + len(tiles_payload)
+            storage.upload(artifact, payload, {"content-type": FRAGMENTS_CONTENT_TYPE, "upsert": "true"})
+            storage.upload(tiles_artifact, tiles_payload, {"content-type": TILES_CONTENT_TYPE, "upsert": "true"})
+
+        pointer = {
+            "sha256": sha256,
+            "source_version": info.version,
+            "format_version": FRAGMENTS_FORMAT_VERSION,
+            "tiles_format_version": TILES_FORMAT_VERSION,
+            "tiles_manifest_bytes": tiles_manifest_bytes,
+        }
+        storage.upload(
+            pointer_path(file_path), json.dumps(pointer).encode(),
+            {"content-type": "application/json", "upsert": "true"},
+        )
+        return {
+            "artifact": artifact,
+            "tiles": tiles_artifact,
+            "sha256": sha256,
+            "reused": reused,
+            "bytes": size,
+            "seconds": round(time.perf_counter() - started, 4),
+        }
+
+    except Exception as e:
+        import traceback
+        print(f"Fragments Conversion Error: {e}")
+        print(traceback.format_exc())
+        raise RuntimeError(f"Error converting file: {str(e)}") from None
+    finally:
+        if os.path.exists(scratch_path):
+            os.remove(scratch_path)
+
+
+# --- API process side ---
+
+# (bucket, path) -> (IFC version, pointer) of pointers already read
+_pointers: Dict[Tuple[str, str], Tuple[str, dict]] = {}
+# Conversions in flight, so repeated opens do not queue duplicates
+_conversions: Dict[Tuple[str, str], Job] = {}
+_lock = threading.Lock()
+
+
+def current_fragments(bucket_name: str, file_path: str) -> Optional[dict]:
+    """
+    Pointer (sha256, tiles_manifest_bytes, ...) of the artifacts for the current
+    version of a file, or None if it needs (re)converting.
+    """
+    key = (bucket_name, file_path)
+    version = stat_object(bucket_name, file_path).version
+    with _lock:
+        known = _pointers.get(key)
+    if known is not None and version is not None and known[0] == version:
+        return known[1]
+
+    try:
+        data, _ = read_object(bucket_name, pointer_path(file_path))
+        pointer = json.loads(data)
+    except (RuntimeError, ValueError):
+        return None
+    current = (
+        pointer.get("format_version") == FRAGMENTS_FORMAT_VERSION
+        and pointer.get("tiles_format_version") == TILES_FORMAT_VERSION
+        and version is not None
+        and pointer.get("source_version") == version
+    )
+    if not current:
+        return None
+    with _lock:
+        _pointers[key] = (version, pointer)
+    return pointer
+
+
+def submit_conversion(user_id: str, bucket_name: str, file_path: str) -> Job:
+    """Queue a conversion job for a file unless one is already running."""
+    key = (bucket_name, file_path)
+    with _lock:
+        job = _conversions.get(key)
+        if job is not None and job.active:
+            return job
+    job = job_manager.submit(user_id, "fragments", convert_stored_ifc, bucket_name, file_path)
+    with _lock:
+        _conversions[key] = job
+    return job
+
+
+def submit_background_conversion(bucket_name: str, file_path: str) -> Optional[Job]:
+    """Queue a conversion as background work; None if it was deferred (see JobManager.submit_background)."""
+    key = (bucket_name, file_path)
+    with _lock:
+        job = _conversions.get(key)
+        if job is not None and job.active:
+            return job
+    job = job_manager.submit_background("fragments", convert_stored_ifc, bucket_name, file_path)
+    if job is not None:
+        with _lock:
+            _conversions[key] = job
+    return job
@@ -0,0 +1,357 @@
+"""
+IFC analysis routines.
+These functions run inside the job engine's worker processes (see jobs.py),
+so they must stay importable at module level and return plain JSON data.
+ifcopenshell is imported where it is used; workers preload it when they start
+(ANALYSIS_WORKER_PRELOAD), the API process never needs it.
+
+Reports are kept in the artifact store by the SHA-256 of the IFC and
+ANALYSIS_PIPELINE_VERSION. The API process looks a report up before
+submitting a job (stored_report), and a worker checks again, and once more
+after a download, which finds reports of identical files under other paths.
+"""
+import os
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional
+import httpx
+import numpy as np
+import orjson
+import metrics
+from artifact_store import ANALYSIS, artifact_key, artifact_store
+from ifc_loader import source_sha256, stat_object
+from jobs import ANALYSIS_WORKERS
+from model_cache import get_entry
+
+if TYPE_CHECKING:
+    import ifcopenshell
+    import ifcopenshell.geom
+
+# Threads used by the ifcopenshell geometry iterator inside one worker; by
+# default the cores are split between the ANALYSIS_WORKERS processes
+IFC_GEOMETRY_THREADS = int(os.environ.get("IFC_GEOMETRY_THREADS", str(max(1, (os.cpu_count() or 1) // ANALYSIS_WORKERS))))
+# The CGAL-first hybrid kernel tessellates simple extrusions roughly 10x faster
+# than plain OpenCASCADE and falls back to it for the cases CGAL cannot handle
+IFC_GEOMETRY_LIBRARY = os.environ.get("IFC_GEOMETRY_LIBRARY", "hybrid-cgal-simple-opencascade")
+
+# Bump when build_report's output changes; stored reports of other versions are ignored
+ANALYSIS_PIPELINE_VERSION = "1"
+
+# Base quantity names in order of preference (Qto_*BaseQuantities)
+AREA_QUANTITIES = ("NetSideArea", "GrossSideArea", "NetArea", "GrossArea", "Area", "NetFootprintArea", "GrossFootprintArea")
+VOLUME_QUANTITIES = ("NetVolume", "GrossVolume", "Volume")
+
+# Where an element's quantities came from
+SOURCE_NONE = 0
+SOURCE_BASE_QUANTITIES = 1
+SOURCE_GEOMETRY = 2
+
+
+def building_elements(ifc_file: "ifcopenshell.file") -> list:
+    """All IfcBuildingElement instances (IfcBuiltElement in IFC4X3)."""
+    try:
+        return ifc_file.by_type("IfcBuildingElement")
+    except RuntimeError:
+        return ifc_file.by_type("IfcBuiltElement")
+
+
+def storey_map(ifc_file: "ifcopenshell.file") -> Dict[int, "ifcopenshell.entity_instance"]:
+    """Map element id -> containing IfcBuildingStorey, from the containment relationships."""
+    storeys = {}
+    for rel in ifc_file.by_type("IfcRelContainedInSpatialStructure"):
+        structure = rel.RelatingStructure
+        if structure.is_a("IfcBuildingStorey"):
+            for element in rel.RelatedElements:
+                storeys[element.id()] = structure
+    # Parts of aggregates (e.g. curtain wall panels) inherit the storey of the whole
+    for rel in ifc_file.by_type("IfcRelAggregates"):
+        storey = storeys.get(rel.RelatingObject.id())
+        if storey is not None:
+            for part in rel.RelatedObjects:
+                storeys.setdefault(part.id(), storey)
+    return storeys
+
+
+def _base_quantities(ifc_file: "ifcopenshell.file") -> Dict[int, Dict[str, float]]:
+    """Map element id -> {quantity name: value} from all attached IfcElementQuantity sets."""
+    quantities: Dict[int, Dict[str, float]] = {}
+    for rel in ifc_file.by_type("IfcRelDefinesByProperties"):
+        definition = rel.RelatingPropertyDefinition
+        if not definition.is_a("IfcElementQuantity"):
+            continue
+        values = {}
+        for quantity in definition.Quantities:
+            # The value attribute is optional in some exporters' output
+            if quantity.is_a("IfcPhysicalSimpleQuantity") and quantity[3] is not None:
+                values[quantity.Name] = float(quantity[3])
+        if values:
+            for element in rel.RelatedObjects:
+                quantities.setdefault(element.id(), {}).update(values)
+    return quantities
+
+
+def _first(values: Dict[str, float], names: tuple) -> Optional[float]:
+    for name in names:
+        if name in values:
+            return values[name]
+    return None
+
+
+def geometry_iterator(ifc_file: "ifcopenshell.file", elements: list) -> "ifcopenshell.geom.iterator":
+    """Multi-threaded iterator yielding world-space triangle meshes for the given elements."""
+    import ifcopenshell.geom
+
+    settings = ifcopenshell.geom.settings()
+    settings.set("use-world-coords", True)
+    settings.set("no-normals", True)
+    return ifcopenshell.geom.iterator(
+        settings, ifc_file, IFC_GEOMETRY_THREADS,
+        include=elements, geometry_library=IFC_GEOMETRY_LIBRARY,
+    )
+
+
+def _mesh_quantities(ifc_file: "ifcopenshell.file", elements: list, index_of: Dict[int, int], count: int):
+    """
+    Tessellate elements with the multi-threaded geometry iterator and return
+    per-element (area, volume) arrays in SI units. All triangles are gathered
+    first and measured in one vectorised pass.
+
+    Area is the larger of the projected side area (walls, windows, doors) and
+    the projected top area (slabs, roofs). Volume uses the divergence theorem
+    on the closed mesh.
+    """
+    area = np.zeros(count)
+    volume = np.zeros(count)
+    if not elements:
+        return area, volume
+
+    iterator = geometry_iterator(ifc_file, elements)
+
+    triangles: List[np.ndarray] = []
+    owners: List[np.ndarray] = []
+    if iterator.initialize():
+        while True:
+            shape = iterator.get()
+            verts = np.asarray(shape.geometry.verts, dtype=np.float64).reshape(-1, 3)
+            faces = np.asarray(shape.geometry.faces, dtype=np.int64).reshape(-1, 3)
+            if len(faces):
+                triangles.append(verts[faces])
+                owners.append(np.full(len(faces), index_of[shape.id], dtype=np.int64))
+            if not iterator.next():
+                break
+
+    if not triangles:
+        return area, volume
+
+    tris = np.concatenate(triangles)
+    owner = np.concatenate(owners)
+    cross = np.cross(tris[:, 1] - tris[:, 0], tris[:, 2] - tris[:, 0])
+    double_area = np.linalg.norm(cross, axis=1)
+    tri_area = 0.5 * double_area
+    with np.errstate(invalid="ignore", divide="ignore"):
+        normal = np.nan_to_num(cross / double_area[:, None])
+    vertical = np.abs(normal[:, 2]) < 0.5
+
+    # Side area: project vertical faces onto each element's dominant horizontal
+    # normal direction (principal axis of the area-weighted normal tensor).
+    side_weight = np.where(vertical, tri_area, 0.0)
+    nx, ny = normal[:, 0], normal[:, 1]
+    sxx = np.bincount(owner, weights=side_weight * nx * nx, minlength=count)
+    syy = np.bincount(owner, weights=side_weight * ny * ny, minlength=count)
+    sxy = np.bincount(owner, weights=side_weight * nx * ny, minlength=count)
+    theta = 0.5 * np.arctan2(2.0 * sxy, sxx - syy)[owner]
+    facing = np.abs(nx * np.cos(theta) + ny * np.sin(theta))
+    side_area = 0.5 * np.bincount(owner, weights=side_weight * facing, minlength=count)
+    top_area = 0.5 * np.bincount(owner, weights=np.where(vertical, 0.0, tri_area * np.abs(normal[:, 2])), minlength=count)
+    area = np.maximum(side_area, top_area)
+
+    signed = np.einsum("ij,ij->i", tris[:, 0], np.cross(tris[:, 1], tris[:, 2])) / 6.0
+    volume = np.abs(np.bincount(owner, weights=signed, minlength=count))
+    return area, volume
+
+
+def build_report(ifc_file: "ifcopenshell.file") -> dict:
+    """
+    Collect per-type counts, storey breakdowns and element quantities in one pass.
+    Base quantities (Qto sets) are used where the file provides them; all other
+    elements are measured from their tessellated geometry.
+    """
+    timings = {}
+    started = time.perf_counter()
+
+    elements = building_elements(ifc_file)
+    count = len(elements)
+    index_of = {element.id(): i for i, element in enumerate(elements)}
+
+    type_names = sorted({element.is_a() for element in elements})
+    type_code = {name: i for i, name in enumerate(type_names)}
+
+    storey_of = storey_map(ifc_file)
+    storeys = sorted(
+        {storey.id(): storey for storey in storey_of.values()}.values(),
+        key=lambda storey: storey.Elevation if storey.Elevation is not None else 0.0,
+    )
+    storey_code = {storey.id(): i for i, storey in enumerate(storeys)}
+    unassigned = len(storeys)
+
+    types = np.empty(count, dtype=np.int64)
+    storey_index = np.empty(count, dtype=np.int64)
+    area = np.zeros(count)
+    volume = np.zeros(count)
+    source = np.full(count, SOURCE_NONE, dtype=np.int8)
+
+    import ifcopenshell.util.unit
+
+    length_scale = ifcopenshell.util.unit.calculate_unit_scale(ifc_file)
+    area_scale = ifcopenshell.util.unit.calculate_unit_scale(ifc_file, "AREAUNIT")
+    volume_scale = ifcopenshell.util.unit.calculate_unit_scale(ifc_file, "VOLUMEUNIT")
+    quantities = _base_quantities(ifc_file)
+
+    missing = []
+    for i, element in enumerate(elements):
+        types[i] = type_code[element.is_a()]
+        storey = storey_of.get(element.id())
+        storey_index[i] = storey_code[storey.id()] if storey is not None else unassigned
+
+        values = quantities.get(element.id())
+        element_area = _first(values, AREA_QUANTITIES) if values else None
+        element_volume = _first(values, VOLUME_QUANTITIES) if values else None
+        if element_area is not None or element_volume is not None:
+            area[i] = (element_area or 0.0) * area_scale
+            volume[i] = (element_volume or 0.0) * volume_scale
+            source[i] = SOURCE_BASE_QUANTITIES
+        else:
+            missing.append(element)
+    timings["walk"] = time.perf_counter() - started
+
+    geometry_started = time.perf_counter()
+    mesh_area, mesh_volume = _mesh_quantities(ifc_file, missing, index_of, count)
+    measured = np.zeros(count, dtype=bool)
+    if missing:
+        measured[[index_of[element.id()] for element in missing]] = True
+    measured &= (mesh_area > 0) | (mesh_volume > 0)
+    area[measured] = mesh_area[measured]
+    volume[measured] = mesh_volume[measured]
+    source[measured] = SOURCE_GEOMETRY
+    timings["geometry"] = time.perf_counter() - geometry_started
+
+    # Aggregate per type and per (storey, type) with bincount
+    n_types = len(type_names)
+    n_storeys = unassigned + 1
+    type_counts = np.bincount(types, minlength=n_types)
+    type_area = np.bincount(types, weights=area, minlength=n_types)
+    type_volume = np.bincount(types, weights=volume, minlength=n_types)
+    cell_counts = np.bincount(storey_index * n_types + types, minlength=n_storeys * n_types).reshape(n_storeys, n_types)
+    storey_area = np.bincount(storey_index, weights=area, minlength=n_storeys)
+    storey_volume = np.bincount(storey_index, weights=volume, minlength=n_storeys)
+
+    by_type = {
+        name: {
+            "count": int(type_counts[t]),
+            "area": float(type_area[t]),
+            "volume": float(type_volume[t]),
+        }
+        for t, name in enumerate(type_names)
+    }
+
+    storey_rows = []
+    for s in range(n_storeys):
+        row_counts = cell_counts[s]
+        storey = storeys[s] if s < unassigned else None
+        if storey is None and not row_counts.any():
+            continue
+        elevation = storey.Elevation if storey is not None else None
+        storey_rows.append({
+            "id": storey.GlobalId if storey is not None else None,
+            "name": storey.Name if storey is not None else None,
+            "elevation": elevation * length_scale if elevation is not None else None,
+            "element_count": int(row_counts.sum()),
+            "area": float(storey_area[s]),
+            "volume": float(storey_volume[s]),
+            "types": {type_names[t]: int(row_counts[t]) for t in np.flatnonzero(row_counts)},
+        })
+
+    def total(prefix: str, values: np.ndarray) -> float:
+        codes = [type_code[name] for name in type_names if name.startswith(prefix)]
+        return float(values[np.isin(types, codes)].sum()) if codes else 0.0
+
+    timings["total"] = time.perf_counter() - started
+    for phase, seconds in timings.items():
+        metrics.ifc_analysis_phase_duration.observe(seconds, phase=phase)
+
+    return {
+        "wall_count": len(ifc_file.by_type("IfcWall")),
+        "schema": ifc_file.schema,
+        "element_count": count,
+        "types": by_type,
+        "storeys": storey_rows,
+        "quantities": {
+            "wall_area": total("IfcWall", area),
+            "wall_volume": total("IfcWall", volume),
+            "window_area": total("IfcWindow", area),
+            "door_area": total("IfcDoor", area),
+            "slab_area": total("IfcSlab", area),
+            "slab_volume": total("IfcSlab", volume),
+            "total_volume": float(volume.sum()),
+        },
+        "quantity_sources": {
+            "base_quantities": int((source == SOURCE_BASE_QUANTITIES).sum()),
+            "geometry": int((source == SOURCE_GEOMETRY).sum()),
+            "none": int((source == SOURCE_NONE).sum()),
+        },
+        "timings": {name: round(seconds, 4) for name, seconds in timings.items()},
+    }
+
+
+def _report_key(sha256: str) -> str:
+    return artifact_key(ANALYSIS, ANALYSIS_PIPELINE_VERSION, sha256)
+
+
+def stored_report(bucket_name: str, file_path: str) -> Optional[dict]:
+    """
+    The stored report of the current version of a file, or None. Needs one HEAD
+    request and local reads only; errors are left to the analysis job.
+    """
+    if not artifact_store.enabled:
+        return None
+    try:
+        sha256 = source_sha256(bucket_name, file_path, stat_object(bucket_name, file_path))
+    except (RuntimeError, httpx.HTTPError):
+        return None
+    data = artifact_store.get(ANALYSIS, _report_key(sha256)) if sha256 else None
+    return orjson.loads(data) if data is not None else None
+
+
+def analyze_stored_ifc(bucket_name: str, file_path: str, generation: int = 0) -> dict:
+    """
+    Load an IFC file from storage (or the model cache) and build its analysis
+    report, unless the artifact store has a report for the file's contents.
+    """
+    try:
+        info = sha256 = None
+        if artifact_store.enabled:
+            info = stat_object(bucket_name, file_path)
+            sha256 = source_sha256(bucket_name, file_path, info)
+            data = artifact_store.get(ANALYSIS, _report_key(sha256)) if sha256 else None
+            if data is not None:
+                return orjson.loads(data)
+
+        # Checked against the version just read, so an older cached model is reloaded
+        entry = get_entry(bucket_name, file_path, generation, info)
+        if entry.sha256 is not None and entry.sha256 != sha256:
+            # Identical contents may have been analysed under another path
+            data = artifact_store.get(ANALYSIS, _report_key(entry.sha256))
+            if data is not None:
+                return orjson.loads(data)
+        report = build_report(entry.model)
+        if entry.sha256 is not None:
+            # The hash of the bytes the model was parsed from, whatever version storage has now
+            artifact_store.put(ANALYSIS, _report_key(entry.sha256), orjson.dumps(report))
+        return report
+
+    except Exception as e:
+        # Exceptions from third-party libraries don't always survive pickling
+        # back to the API process, so log here and re-raise a plain error.
+        import traceback
+        print(f"Analysis Error: {e}")
+        print(traceback.format_exc())
+        raise RuntimeError(f"Error analyzing file: {str(e)}") from None
@@ -0,0 +1,274 @@
+"""
+Streaming IFC loading from Supabase Storage.
+Downloads objects in chunks instead of holding the whole file as `bytes`, and
+picks an in-memory or on-disk parse strategy based on the object size.
+
+With the artifact store enabled (artifact_store.py), every download is hashed
+and a ref records which SHA-256 belongs to which object version, so analysis
+reports can be looked up by content. Objects too big for the in-memory path
+are also kept in the store, keyed by their SHA-256, and any process on the
+host parses that version from there without downloading it again. Small ones
+are not stored: downloading and parsing them from memory is cheaper than a
+disk write, and their reports are what is worth reusing.
+"""
+import os
+import uuid
+import hashlib
+import tempfile
+import urllib.parse
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Optional, Tuple
+import httpx
+from dotenv import load_dotenv
+import metrics
+from artifact_store import IFC, REFS, artifact_key, artifact_store
+
+if TYPE_CHECKING:
+    import ifcopenshell
+
+load_dotenv()
+
+SUPABASE_URL = os.environ.get("SUPABASE_URL")
+SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
+
+# Files up to this size are parsed from memory: streamed to a file in
+# IFC_MEMORY_DIR (RAM-backed where /dev/shm exists); larger files go to the
+# artifact store or the scratch area on disk.
+IFC_IN_MEMORY_MAX_BYTES = int(os.environ.get("IFC_IN_MEMORY_MAX_BYTES", str(32 * 1024 * 1024)))
+IFC_SCRATCH_DIR = os.environ.get("IFC_SCRATCH_DIR") or os.path.join(tempfile.gettempdir(), "voxel-scratch")
+IFC_MEMORY_DIR = os.environ.get("IFC_MEMORY_DIR") or (
+    os.path.join("/dev/shm", "voxel-ifc") if os.path.isdir("/dev/shm") else IFC_SCRATCH_DIR
+)
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+_http_client: Optional[httpx.Client] = None
+
+
+@dataclass
+class ObjectInfo:
+    """Version metadata of a storage object, taken from the response headers."""
+    size: Optional[int]
+    etag: Optional[str]
+    last_modified: Optional[str]
+    # Content hash, when the object was read through the artifact store
+    sha256: Optional[str] = None
+
+    @property
+    def version(self) -> Optional[str]:
+        """Identifies the object contents: the ETag, or Last-Modified if there is none."""
+        return self.etag or self.last_modified
+
+    @classmethod
+    def from_headers(cls, headers: httpx.Headers) -> "ObjectInfo":
+        content_length = headers.get("content-length")
+        return cls(
+            size=int(content_length) if content_length is not None else None,
+            etag=headers.get("etag"),
+            last_modified=headers.get("last-modified"),
+        )
+
+
+def _get_http_client() -> httpx.Client:
+    """One keep-alive client per process (each job worker gets its own)."""
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.Client(
+            headers={
+                "apikey": SUPABASE_KEY or "",
+                "Authorization": f"Bearer {SUPABASE_KEY}",
+                # Content-Length must match the bytes we receive
+                "Accept-Encoding": "identity",
+            },
+            timeout=httpx.Timeout(60.0, connect=10.0),
+            event_hooks=metrics.SUPABASE_EVENT_HOOKS,
+        )
+    return _http_client
+
+
+def object_url(bucket_name: str, file_path: str) -> str:
+    """Authenticated REST URL of a storage object."""
+    return f"{SUPABASE_URL}/storage/v1/object/{bucket_name}/{urllib.parse.quote(file_path)}"
+
+
+def _raise_for_status(response: httpx.Response, file_path: str):
+    if response.status_code >= 400:
+        response.read()
+        raise RuntimeError(
+            f"Storage download of '{file_path}' failed ({response.status_code}): {response.text}"
+        )
+
+
+def _record_download(size: int):
+    metrics.ifc_download_bytes.inc(size)
+    metrics.ifc_download_size.observe(size)
+
+
+def _read_via_file(response: httpx.Response, directory: str, strategy: str, digest=None) -> Tuple["ifcopenshell.file", int]:
+    """
+    Stream the body to a file in directory and open it with ifcopenshell.
+    The bytes reach the parser unchanged (text in a STEP file need not be
+    valid in any encoding) and never exist as a Python copy.
+    """
+    import ifcopenshell
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{os.getpid()}-{uuid.uuid4().hex}.ifc")
+    try:
+        # No fsync: the parser reads through the same page cache
+        written = 0
+        with metrics.timed(metrics.ifc_download_duration, "ifc-download", strategy=strategy):
+            with open(path, "wb") as target:
+                for chunk in response.iter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    written += target.write(chunk)
+                    if digest is not None:
+                        digest.update(chunk)
+        _record_download(written)
+        with metrics.timed(metrics.ifc_parse_duration, "ifc-parse", strategy=strategy):
+            return ifcopenshell.open(path), written
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def stat_object(bucket_name: str, file_path: str) -> ObjectInfo:
+    """Fetch size and version of a storage object without downloading it."""
+    response = _get_http_client().head(object_url(bucket_name, file_path))
+    _raise_for_status(response, file_path)
+    return ObjectInfo.from_headers(response.headers)
+
+
+def _ref_key(bucket_name: str, file_path: str, version: str) -> str:
+    return artifact_key(REFS, bucket_name, file_path, version)
+
+
+def source_sha256(bucket_name: str, file_path: str, info: ObjectInfo) -> Optional[str]:
+    """Content SHA-256 recorded in the artifact store for this version of an object, if any."""
+    if info.version is None:
+        return None
+    data = artifact_store.get(REFS, _ref_key(bucket_name, file_path, info.version))
+    # Refs are not fsynced; one cut short by a crash reads as unknown
+    return data.decode() if data is not None and len(data) == 64 else None
+
+
+def _store_ref(bucket_name: str, file_path: str, info: ObjectInfo):
+    if info.version is not None and info.sha256 is not None:
+        artifact_store.put(REFS, _ref_key(bucket_name, file_path, info.version), info.sha256.encode())
+
+
+def stored_ifc_path(bucket_name: str, file_path: str, info: ObjectInfo) -> Optional[str]:
+    """
+    Path of this version of an object in the artifact store, or None. Sets
+    info.sha256 if the version's hash is known.
+    """
+    info.sha256 = source_sha256(bucket_name, file_path, info)
+    if info.sha256 is None:
+        return None
+    path = artifact_store.lookup(IFC, info.sha256)
+    if path is None:
+        return None
+    try:
+        # IFC copies are not fsynced; after a crash a short one is downloaded again
+        if info.size is not None and os.path.getsize(path) != info.size:
+            return None
+    except FileNotFoundError:
+        return None
+    return path
+
+
+def _storable(info: ObjectInfo) -> bool:
+    """Objects over a quarter of the store would evict most other artifacts."""
+    return artifact_store.enabled and info.size is not None and info.size <= artifact_store.max_bytes // 4
+
+
+def _download_into_store(response: httpx.Response, info: ObjectInfo) -> str:
+    digest = hashlib.sha256()
+    writer = artifact_store.writer(IFC)
+    try:
+        with metrics.timed(metrics.ifc_download_duration, "ifc-download", strategy="store"):
+            for chunk in response.iter_bytes(DOWNLOAD_CHUNK_SIZE):
+                writer.write(chunk)
+                digest.update(chunk)
+    except BaseException:
+        writer.abort()
+        raise
+    _record_download(writer.size)
+    if info.size is not None and writer.size != info.size:
+        writer.abort()
+        raise RuntimeError(f"Incomplete download: expected {info.size} bytes, got {writer.size}")
+    info.sha256 = digest.hexdigest()
+    return writer.commit(info.sha256)
+
+
+def _open_from_store(path: str) -> "ifcopenshell.file":
+    import ifcopenshell
+
+    with metrics.timed(metrics.ifc_parse_duration, "ifc-parse", strategy="store"):
+        return ifcopenshell.open(path)
+
+
+def open_stored_ifc(bucket_name: str, file_path: str, info: Optional[ObjectInfo] = None) -> Tuple["ifcopenshell.file", ObjectInfo]:
+    """
+    Stream an IFC object from storage and open it with ifcopenshell.
+    Small objects (<= IFC_IN_MEMORY_MAX_BYTES) are parsed from memory. Larger
+    ones are opened from the artifact store, downloaded into it first unless
+    this version is there already; with the store disabled, for objects too
+    big to keep and for responses without a Content-Length they go through
+    IFC_SCRATCH_DIR. `info` is the object's version info if the caller already
+    has it (from stat_object); it saves the GET when the store has that version.
+    Returns the opened file and the version info of the object that was read
+    (with sha256 if the store is enabled).
+    """
+    if info is not None and _storable(info) and info.size > IFC_IN_MEMORY_MAX_BYTES:
+        path = stored_ifc_path(bucket_name, file_path, info)
+        if path is not None:
+            return _open_from_store(path), info
+
+    client = _get_http_client()
+    with client.stream("GET", object_url(bucket_name, file_path)) as response:
+        _raise_for_status(response, file_path)
+        info = ObjectInfo.from_headers(response.headers)
+        if info.size is not None and info.size <= IFC_IN_MEMORY_MAX_BYTES:
+            digest = hashlib.sha256() if artifact_store.enabled else None
+            ifc_file, size = _read_via_file(response, IFC_MEMORY_DIR, "memory", digest)
+            if size != info.size:
+                raise RuntimeError(f"Incomplete download: expected {info.size} bytes, got {size}")
+            if digest is not None:
+                info.sha256 = digest.hexdigest()
+                _store_ref(bucket_name, file_path, info)
+            return ifc_file, info
+        if not _storable(info):
+            ifc_file, info.size = _read_via_file(response, IFC_SCRATCH_DIR, "scratch")
+            return ifc_file, info
+        # The response headers name the version; if it is stored, leave the body unread
+        path = stored_ifc_path(bucket_name, file_path, info)
+        if path is None:
+            path = _download_into_store(response, info)
+            _store_ref(bucket_name, file_path, info)
+    return _open_from_store(path), info
+
+
+def download_to_file(bucket_name: str, file_path: str, destination: str, digest=None) -> ObjectInfo:
+    """
+    Stream any storage object to a local file and return its version info.
+    If a hashlib object is given as digest, it is fed the contents on the way.
+    """
+    client = _get_http_client()
+    with client.stream("GET", object_url(bucket_name, file_path)) as response:
+        _raise_for_status(response, file_path)
+        info = ObjectInfo.from_headers(response.headers)
+        written = 0
+        with open(destination, "wb") as target:
+            for chunk in response.iter_bytes(DOWNLOAD_CHUNK_SIZE):
+                written += target.write(chunk)
+                if digest is not None:
+                    digest.update(chunk)
+        metrics.storage_download_bytes.inc(written)
+        return info
+
+
+def read_object(bucket_name: str, file_path: str, length: Optional[int] = None) -> Tuple[bytes, ObjectInfo]:
+    """Read a small storage object (manifests, pointers) into memory, or only its first length bytes."""
+    headers = {"Range": f"bytes=0-{length - 1}"} if length else None
+    response = _get_http_client().get(object_url(bucket_name, file_path), headers=headers)
+    _raise_for_status(response, file_path)
+    return response.content, ObjectInfo.from_headers(response.headers)
@@ -0,0 +1,318 @@
+"""
+Background job engine for the FastAPI backend.
+Runs heavy work (IFC downloads, parsing, analysis) on a bounded process pool
+so that the API event loop stays responsive while jobs are in flight.
+"""
+import os
+import importlib
+import threading
+import time
+import uuid
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from fastapi import HTTPException, status
+
+# Pool configuration (environment variables)
+# ANALYSIS_WORKERS: number of worker processes shared by all users
+# ANALYSIS_MAX_JOBS_PER_USER: queued + running jobs allowed per user
+# ANALYSIS_MAX_BACKGROUND_JOBS: queued + running background jobs (precomputation after project creation)
+# ANALYSIS_JOB_TTL_SECONDS: how long finished jobs stay queryable
+# ANALYSIS_WORKER_PRELOAD: modules each worker imports as it starts, instead of in its first job
+ANALYSIS_WORKERS = int(os.environ.get("ANALYSIS_WORKERS", "2"))
+ANALYSIS_MAX_JOBS_PER_USER = int(os.environ.get("ANALYSIS_MAX_JOBS_PER_USER", "2"))
+ANALYSIS_MAX_BACKGROUND_JOBS = int(os.environ.get("ANALYSIS_MAX_BACKGROUND_JOBS", str(ANALYSIS_WORKERS)))
+ANALYSIS_JOB_TTL_SECONDS = int(os.environ.get("ANALYSIS_JOB_TTL_SECONDS", "3600"))
+ANALYSIS_WORKER_PRELOAD = tuple(
+    name.strip() for name in os.environ.get("ANALYSIS_WORKER_PRELOAD", "ifcopenshell,ifcopenshell.geom,ifc_analysis").split(",")
+    if name.strip()
+)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+# Background work waiting for the background quota (not yet a job)
+DEFERRED = "deferred"
+
+TERMINAL_STATES = {SUCCEEDED, FAILED, CANCELLED}
+
+# Owner of background jobs; they count against ANALYSIS_MAX_BACKGROUND_JOBS, not a user's limit
+SYSTEM_USER_ID = "system"
+
+# Stats providers registered inside worker processes (e.g. cache counters).
+# Every finished job reports a fresh snapshot back to the API process.
+_worker_stats_providers: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+
+def register_worker_stats(name: str, provider: Callable[[], Dict[str, Any]]):
+    """Register a callable whose snapshot is sent back with each job result."""
+    _worker_stats_providers[name] = provider
+
+
+def _init_worker(modules: Tuple[str, ...], started):
+    """Worker initializer: import the preload modules, then count the worker as started."""
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            # The job that needs it will fail with the real error
+            print(f"Worker preload of {name} failed: {e}")
+    with started.get_lock():
+        started.value += 1
+
+
+def _run_job(fn: Callable, args: tuple) -> Tuple[Any, int, Dict[str, Any]]:
+    """Entry point executed in the worker process."""
+    result = fn(*args)
+    snapshot = {name: provider() for name, provider in _worker_stats_providers.items()}
+    return result, os.getpid(), snapshot
+
+
+class Job:
+    """A single submitted unit of work and its outcome."""
+
+    def __init__(self, job_id: str, user_id: str, kind: str, future: Future, args: tuple = ()):
+        self.id = job_id
+        self.user_id = user_id
+        self.kind = kind
+        self.future = future
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.cancel_requested = False
+        # Arguments of the call, to recognise repeated background work
+        self.args = args
+
+    @property
+    def status(self) -> str:
+        if self.cancel_requested or self.future.cancelled():
+            return CANCELLED
+        if self.future.done():
+            return FAILED if self.future.exception() is not None else SUCCEEDED
+        if self.future.running():
+            return RUNNING
+        return QUEUED
+
+    @property
+    def active(self) -> bool:
+        """True while the job still occupies (or waits for) a worker."""
+        return not self.future.done()
+
+    def to_dict(self) -> Dict[str, Any]:
+        state = self.status
+        data: Dict[str, Any] = {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": state,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+        if state == SUCCEEDED:
+            data["result"] = self.future.result()[0]
+        elif state == FAILED:
+            data["error"] = str(self.future.exception())
+        return data
+
+
+class JobManager:
+    """
+    Submits callables to a lazily created process pool and tracks their state.
+    Enforces a per-user limit on active jobs and expires finished jobs after a TTL.
+    Background work (submit_background) runs as SYSTEM_USER_ID with its own
+    limit; what does not fit is deferred and submitted as earlier background
+    jobs finish.
+    """
+
+    def __init__(self, max_workers: int, max_jobs_per_user: int, ttl_seconds: int, preload: Tuple[str, ...] = (), max_background_jobs: int = 1):
+        self.max_workers = max_workers
+        self.max_jobs_per_user = max_jobs_per_user
+        self.max_background_jobs = max_background_jobs
+        self.ttl_seconds = ttl_seconds
+        self.preload = preload
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # Workers of the current pool that finished their initializer
+        self._started = None
+        self._jobs: Dict[str, Job] = {}
+        # (kind, args) -> fn of deferred background work, oldest first
+        self._deferred: "OrderedDict[Tuple[str, tuple], Callable]" = OrderedDict()
+        self._worker_stats: Dict[int, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # "spawn" avoids forking the threaded uvicorn process
+            context = multiprocessing.get_context("spawn")
+            self._started = context.Value("i", 0)
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(self.preload, self._started),
+            )
+        return self._executor
+
+    def warm_up(self):
+        """Start all workers now rather than with the first jobs; see started_workers."""
+        with self._lock:
+            executor = self._get_executor()
+            # Each submission without an idle worker spawns one
+            for _ in range(self.max_workers):
+                executor.submit(os.getpid)
+
+    def started_workers(self) -> int:
+        """Workers of the current pool that have imported the preload modules."""
+        started = self._started
+        return started.value if started is not None else 0
+
+    def _prune(self):
+        cutoff = time.time() - self.ttl_seconds
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at is not None and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _on_done(self, job: Job, future: Future):
+        job.finished_at = time.time()
+        if not future.cancelled() and future.exception() is None:
+            _, pid, snapshot = future.result()
+            with self._lock:
+                self._worker_stats[pid] = snapshot
+        if job.user_id == SYSTEM_USER_ID:
+            self._submit_deferred()
+
+    def _active(self, user_id: str) -> int:
+        return sum(1 for job in self._jobs.values() if job.user_id == user_id and job.active)
+
+    def _start(self, user_id: str, kind: str, fn: Callable, args: tuple) -> Job:
+        """Submit to the pool and track the job; callers hold the lock and add _on_done after releasing it."""
+        try:
+            future = self._get_executor().submit(_run_job, fn, args)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed); start a fresh pool
+            self._executor = None
+            self._worker_stats.clear()
+            future = self._get_executor().submit(_run_job, fn, args)
+        job = Job(uuid.uuid4().hex, user_id, kind, future, args)
+        self._jobs[job.id] = job
+        return job
+
+    def submit(self, user_id: str, kind: str, fn: Callable, *args: Any) -> Job:
+        """Queue fn(*args) on the pool. Raises HTTPException 429 if the user is at their limit."""
+        with self._lock:
+            self._prune()
+            if self._active(user_id) >= self.max_jobs_per_user:
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail=f"Too many running jobs (limit: {self.max_jobs_per_user}). Wait for one to finish or cancel it."
+                )
+            job = self._start(user_id, kind, fn, args)
+
+        job.future.add_done_callback(lambda f: self._on_done(job, f))
+        return job
+
+    def submit_background(self, kind: str, fn: Callable, *args: Any) -> Optional[Job]:
+        """
+        Queue fn(*args) as background work of SYSTEM_USER_ID. Returns the job, or
+        None if the background limit is reached and the work was deferred. Work
+        with the same kind and args as an active or deferred one is not added twice.
+        """
+        key = (kind, args)
+        with self._lock:
+            self._prune()
+            for job in self._jobs.values():
+                if job.user_id == SYSTEM_USER_ID and job.active and job.kind == kind and job.args == args:
+                    return job
+            if key in self._deferred or self._active(SYSTEM_USER_ID) >= self.max_background_jobs:
+                self._deferred[key] = fn
+                return None
+            job = self._start(SYSTEM_USER_ID, kind, fn, args)
+
+        job.future.add_done_callback(lambda f: self._on_done(job, f))
+        return job
+
+    def _submit_deferred(self):
+        """Start deferred background work while the background limit allows."""
+        started = []
+        with self._lock:
+            while self._deferred and self._active(SYSTEM_USER_ID) < self.max_background_jobs:
+                (kind, args), fn = self._deferred.popitem(last=False)
+                started.append(self._start(SYSTEM_USER_ID, kind, fn, args))
+        for job in started:
+            job.future.add_done_callback(lambda f, job=job: self._on_done(job, f))
+
+    def completed(self, user_id: str, kind: str, result: Any) -> Job:
+        """Track a result that needed no worker (e.g. a stored report) as a finished job."""
+        future: Future = Future()
+        future.set_result((result, os.getpid(), {}))
+        job = Job(uuid.uuid4().hex, user_id, kind, future)
+        job.finished_at = job.created_at
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str, user_id: str) -> Job:
+        """Return the job if it exists and belongs to the user, else raise 404."""
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(job_id)
+        if job is None or job.user_id != user_id:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return job
+
+    def cancel(self, job_id: str, user_id: str) -> Job:
+        """
+        Cancel a job. Queued jobs are removed from the pool; a job that is already
+        running finishes in its worker but its result is discarded.
+        """
+        job = self.get(job_id, user_id)
+        if job.status not in TERMINAL_STATES:
+            if not job.future.cancel():
+                job.cancel_requested = True
+        return job
+
+    def worker_stats(self, name: str) -> Dict[str, Any]:
+        """Sum the latest numeric snapshot of a registered provider across workers."""
+        totals: Dict[str, Any] = {"workers": 0}
+        with self._lock:
+            snapshots = [stats[name] for stats in self._worker_stats.values() if name in stats]
+        for snapshot in snapshots:
+            totals["workers"] += 1
+            for key, value in snapshot.items():
+                if isinstance(value, (int, float)):
+                    totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def status_counts(self) -> Dict[str, int]:
+        """Number of tracked jobs per status, and of deferred background work."""
+        counts: Dict[str, int] = {}
+        with self._lock:
+            self._prune()
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            if self._deferred:
+                counts[DEFERRED] = len(self._deferred)
+        return counts
+
+    def worker_snapshots(self, name: str) -> List[Any]:
+        """The latest snapshot of a registered provider from each worker."""
+        with self._lock:
+            return [stats[name] for stats in self._worker_stats.values() if name in stats]
+
+    def shutdown(self):
+        with self._lock:
+            self._deferred.clear()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self._started = None
+
+
+job_manager = JobManager(
+    ANALYSIS_WORKERS, ANALYSIS_MAX_JOBS_PER_USER, ANALYSIS_JOB_TTL_SECONDS, ANALYSIS_WORKER_PRELOAD, ANALYSIS_MAX_BACKGROUND_JOBS,
+)
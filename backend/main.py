@@ -1,21 +1,55 @@
-import ifcopenshell
-import tempfile
 import os
+import json
+import asyncio
+import orjson
+from contextlib import asynccontextmanager
+from typing import List, Optional
 from dotenv import load_dotenv
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from supabase_client import supabase
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, ValidationError
+import data_access as db
+import metrics
 from routers.projects import router as projects_router
+from routers.elements import router as elements_router
+from routers.spatial import router as spatial_router
+from auth import auth_stats, get_current_user, get_optional_user
+from jobs import job_manager
+from warmup import warm_up
+from admission import ANALYZE_ROUTE, EXPORT_ROUTE, admission, export_cost_mb, ifc_cost_mb
+from ifc_analysis import analyze_stored_ifc, stored_report
+from artifact_store import KINDS as ARTIFACT_KINDS, artifact_store
+from model_cache import current_generation, invalidate_model
+from fragments import FRAGMENTS_FORMAT_VERSION, current_fragments, fragments_path, submit_conversion
+from tiles import TILES_FORMAT_VERSION, tiles_path
+from scene_payload import SCENE_CONTENT_TYPE, decode_scene
+from marketplace import catalogue, query_etag
+from storage_index import SORT_KEYS, bim_files_index
+from signed_urls import signed_url, signed_url_cache, signed_url_sync, signed_urls
+from energyplus import EPJSON_CONTENT_TYPE, PackedScene, epjson_chunks, epjson_document, export_cache, item_hashes, scene_hash, store_epjson
 
 load_dotenv()
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Clients, JWT backends and IFC workers are prepared after start (see warmup.py and /readyz)
+    warm_up_task = asyncio.create_task(warm_up.run())
+    yield
+    warm_up_task.cancel()
+    job_manager.shutdown()
+    await db.close_db()
+
+app = FastAPI(lifespan=lifespan)
 
 # Include routers
 app.include_router(projects_router)
+app.include_router(elements_router)
+app.include_router(spatial_router)
 
 origins = [
     "http://localhost:5173",
@@ -28,99 +62,83 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
+# Outermost, so the timings include the other middleware
+app.add_middleware(metrics.TimingMiddleware)
+
 class FileUploadRequest(BaseModel):
     name: str
     content_type: str
 
+class DownloadUrlsRequest(BaseModel):
+    names: List[str]
+
+# GET /marketplace/items page size (default and maximum)
+MARKETPLACE_PAGE_SIZE = int(os.environ.get("MARKETPLACE_PAGE_SIZE", "100"))
+MARKETPLACE_PAGE_MAX = int(os.environ.get("MARKETPLACE_PAGE_MAX", "1000"))
+
+# GET /files/list page size (default and maximum)
+FILES_PAGE_SIZE = int(os.environ.get("FILES_PAGE_SIZE", "100"))
+FILES_PAGE_MAX = int(os.environ.get("FILES_PAGE_MAX", "1000"))
+
+# Files signed by one POST /files/download-urls request
+SIGNED_URL_BATCH_MAX = int(os.environ.get("SIGNED_URL_BATCH_MAX", "1000"))
+
 @app.get("/")
 def read_root():
     return {"Hello": "Voxel"}
 
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving requests."""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: 503 until the Supabase clients exist and the IFC engine is warmed in the job workers."""
+    stats = warm_up.stats()
+    return JSONResponse(stats, status_code=200 if stats["ready"] else 503)
+
 @app.get("/marketplace/items")
-async def get_marketplace_items():
+async def get_marketplace_items(
+    http_request: Request,
+    ifc_type: Optional[str] = Query(None),
+    tag: Optional[List[str]] = Query(None, description="Only items carrying all of these tags"),
+    q: Optional[str] = Query(None, description="Case-insensitive search in name, description, manufacturer and model number"),
+    limit: int = Query(MARKETPLACE_PAGE_SIZE, ge=1, le=MARKETPLACE_PAGE_MAX),
+    offset: int = Query(0, ge=0),
+    user: Optional[dict] = Depends(get_optional_user),
+):
     """
-    Fetches marketplace items from the database.
-    Returns public items and items owned by the authenticated user.
+    Fetches marketplace items from the in-memory catalogue snapshot.
+    Returns public items and items owned by the authenticated user, one page at
+    a time, with facet counts by ifc_type and tag.
+    The response carries an ETag; send it back in If-None-Match to get a 304
+    while the catalogue (and the query) is unchanged.
     """
     try:
-        # For now, return placeholder data
-        # In production, this would query the marketplace_items table from Supabase
-        # with proper RLS filtering
+        snapshot = await catalogue.current()
+        user_id = user["id"] if user else None
+        etag = query_etag(snapshot, user_id, ifc_type, tuple(tag or ()), q, limit, offset)
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Authorization"}
+        if etag in [value.strip() for value in http_request.headers.get("if-none-match", "").split(",")]:
+            return Response(status_code=304, headers=headers)
         
-        # TODO: Implement actual database query
-        # response = supabase.table("marketplace_items").select("*").or_("is_public.eq.true,user_id.eq.{user_id}").execute()
-        
-        # Placeholder response matching the Marketplace component structure
-        return [
-            {
-                "id": "1",
-                "name": "Standard Window 120x200",
-                "description": "Double-glazed window with thermal break",
-                "manufacturer": "Example Corp",
-                "ifc_type": "IfcWindow",
-                "fragment_url": "/fragments/window_120x200.frag",
-                "physics": {
-                    "thermal_conductivity": 0.8,
-                    "specific_heat": 1000,
-                    "density": 2500,
-                    "thickness": 0.04,
-                    "u_value": 1.2
-                },
-                "properties": {
-                    "width": 1.2,
-                    "height": 2.0,
-                    "depth": 0.04
-                }
-            },
-            {
-                "id": "2",
-                "name": "Concrete Wall 200mm",
-                "description": "Standard reinforced concrete wall",
-                "manufacturer": "Example Corp",
-                "ifc_type": "IfcWallStandardCase",
-                "fragment_url": "/fragments/wall_concrete_200.frag",
-                "physics": {
-                    "thermal_conductivity": 1.4,
-                    "specific_heat": 880,
-                    "density": 2400,
-                    "thickness": 0.2,
-                    "u_value": 1.8
-                },
-                "properties": {
-                    "width": 1.0,
-                    "height": 3.0,
-                    "depth": 0.2
-                }
-            },
-            {
-                "id": "3",
-                "name": "Steel Door 90x210",
-                "description": "Fire-rated steel door",
-                "manufacturer": "Example Corp",
-                "ifc_type": "IfcDoor",
-                "fragment_url": "/fragments/door_steel_90x210.frag",
-                "physics": {
-                    "thermal_conductivity": 50.0,
-                    "specific_heat": 500,
-                    "density": 7850,
-                    "thickness": 0.05,
-                    "u_value": 2.5
-                },
-                "properties": {
-                    "width": 0.9,
-                    "height": 2.1,
-                    "depth": 0.05
-                }
-            }
-        ]
+        page = snapshot.query(user_id, ifc_type, tag, q, limit, offset)
+        return Response(content=orjson.dumps(page), media_type="application/json", headers=headers)
     except Exception as e:
         import traceback
         print(f"Error fetching marketplace items: {e}")
         print(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Error fetching marketplace items: {str(e)}")
 
+@app.get("/marketplace/cache/stats")
+async def get_marketplace_cache_stats():
+    """Catalogue snapshot version, size and reload counters."""
+    return catalogue.stats()
+
 @app.post("/files/upload-url")
 async def create_upload_url(request: FileUploadRequest):
     bucket = "bim-files"
@@ -130,10 +148,8 @@ async def create_upload_url(request: FileUploadRequest):
     
     try:
         # Use create_signed_upload_url for uploads (not create_signed_url which is for downloads)
-        from storage3.types import CreateSignedUploadUrlOptions
-        
-        options = CreateSignedUploadUrlOptions(upsert="true")
-        result = supabase.storage.from_(bucket).create_signed_upload_url(file_path, options=options)
+        result = await db.create_signed_upload_url(bucket, file_path)
+        # Caches are invalidated by /files/upload-complete, once the bytes are there
         
         # The response is a SignedUploadURL dict with 'signed_url' and 'signedUrl' keys
         # It's a dict, not a TypedDict object, so we can access it directly
@@ -169,6 +185,19 @@ async def create_upload_url(request: FileUploadRequest):
             detail=f"Error creating upload URL ({error_type}): {error_detail}"
         )
 
+@app.post("/files/upload-complete")
+async def complete_upload(request: FileUploadRequest):
+    """
+    Called by the client after the upload to a URL from /files/upload-url
+    succeeded. The upload may have replaced the object, so parses cached by
+    jobs that ran while it was in progress are revalidated, and the file is
+    listed by /files/list.
+    """
+    bucket = "bim-files"
+    invalidate_model(bucket, f"public/{request.name}")
+    bim_files_index.invalidate(request.name)
+    return {"status": "ok"}
+
 @app.post("/files/download-url")
 async def create_download_url(request: FileUploadRequest):
     """Create a signed URL for downloading a file from storage."""
@@ -176,20 +205,8 @@ async def create_download_url(request: FileUploadRequest):
     file_path = f"public/{request.name}"
     
     try:
-        # Create signed URL for download (expires in 1 hour)
-        result = supabase.storage.from_(bucket).create_signed_url(file_path, 3600)
-        
-        # The response contains 'signedURL' key
-        if isinstance(result, dict):
-            signed_url = result.get('signedURL') or result.get('signedUrl')
-        else:
-            signed_url = getattr(result, 'signedURL', None) or getattr(result, 'signedUrl', None)
-        
-        if not signed_url:
-            print(f"Unexpected response format: {result}")
-            raise HTTPException(status_code=500, detail=f"No signed URL in response. Response: {result}")
-        
-        return {"signed_url": signed_url}
+        # Signed URLs are valid for an hour; one issued earlier is reused until shortly before it expires
+        return {"signed_url": _require_signed_url(await signed_url(bucket, file_path), file_path)}
     except HTTPException:
         raise
     except Exception as e:
@@ -202,69 +219,130 @@ async def create_download_url(request: FileUploadRequest):
             detail=f"Error creating download URL: {str(e)}"
         )
 
+@app.post("/files/download-urls")
+async def create_download_urls(request: DownloadUrlsRequest):
+    """
+    Signed download URLs of many files, in request order.
+    Cached URLs are reused and the rest are signed with one Storage call.
+    A file that could not be signed has signed_url null and an error.
+    """
+    bucket = "bim-files"
+    if len(request.names) > SIGNED_URL_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {SIGNED_URL_BATCH_MAX} files per request")
+    
+    try:
+        paths = [f"public/{name}" for name in request.names]
+        signed = await signed_urls(bucket, paths)
+        return {
+            "signed_urls": [
+                {"name": name, **signed[path]}
+                for name, path in zip(request.names, paths)
+            ]
+        }
+    except Exception as e:
+        import traceback
+        print(f"Error creating download URLs: {e}")
+        print(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=f"Error creating download URLs: {str(e)}")
+
+@app.get("/files/download-urls/cache/stats")
+async def get_signed_url_cache_stats():
+    """Signed download URL cache hit rate and Storage calls."""
+    return signed_url_cache.stats()
+
+def _require_signed_url(url: Optional[str], file_path: str) -> str:
+    if not url:
+        print(f"No signed URL for {file_path}")
+        raise HTTPException(status_code=500, detail=f"No signed URL in response for {file_path}")
+    return url
+
+def _signed_url(bucket: str, file_path: str) -> str:
+    """Sync variant for `def` endpoints."""
+    return _require_signed_url(signed_url_sync(bucket, file_path), file_path)
+
+@app.post("/files/fragments-url")
+def create_fragments_url(request: FileUploadRequest, response: Response, user: dict = Depends(get_current_user)):
+    """
+    Signed URLs of the pre-tessellated geometry of a file, so the viewer can skip IFC parsing:
+    the whole model as fragments, and the same geometry as LOD tiles for range-request streaming
+    (read the first tiles.manifest_bytes bytes for the manifest).
+    If the current version of the file has not been converted yet, a conversion
+    job is queued and 202 is returned; the viewer falls back to the IFC meanwhile.
+    """
+    bucket = "bim-files"
+    file_path = f"public/{request.name}"
+
+    try:
+        pointer = current_fragments(bucket, file_path)
+        if pointer is None:
+            job = submit_conversion(user["id"], bucket, file_path)
+            response.status_code = 202
+            return {"status": "converting", "job_id": job.id}
+
+        sha256 = pointer["sha256"]
+        return {
+            "status": "ready",
+            "signed_url": _signed_url(bucket, fragments_path(sha256)),
+            "sha256": sha256,
+            "format_version": FRAGMENTS_FORMAT_VERSION,
+            "tiles": {
+                "signed_url": _signed_url(bucket, tiles_path(sha256)),
+                "manifest_bytes": pointer["tiles_manifest_bytes"],
+                "format_version": TILES_FORMAT_VERSION,
+            },
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        import traceback
+        print(f"Error creating fragments URL: {e}")
+        print(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=f"Error creating fragments URL: {str(e)}")
+
 @app.get("/files/list")
-async def list_files():
+async def list_files(
+    limit: int = Query(FILES_PAGE_SIZE, ge=1, le=FILES_PAGE_MAX),
+    offset: int = Query(0, ge=0),
+    prefix: Optional[str] = Query(None, description="Case-insensitive file name prefix"),
+    sort: str = Query("name", description="'name', 'size' or 'updated_at'"),
+    order: str = Query("asc", description="'asc' or 'desc'"),
+):
+    """
+    Files in the public folder of the bucket, one page at a time.
+    Served from an in-memory index of the folder that is refreshed in the
+    background, so the latency does not depend on Storage or the bucket size.
+    """
+    if sort not in SORT_KEYS:
+        raise HTTPException(status_code=400, detail="Invalid sort. Must be 'name', 'size', or 'updated_at'")
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="Invalid order. Must be 'asc' or 'desc'")
+    
     try:
-        # For now, we'll list files from the bucket as our "projects"
-        # NOTE: This endpoint lists files from Supabase Storage, not from a database table
-        # There is no database schema for projects - files in the bucket are treated as projects
-        bucket = "bim-files"
-        
-        # Try to list files from the public folder
-        # The list() method might need an empty string for root, or "public" for the folder
-        try:
-            result = supabase.storage.from_(bucket).list("public")
-        except Exception as list_error:
-            # If "public" folder doesn't exist, try root
-            print(f"Error listing 'public' folder: {list_error}, trying root...")
-            try:
-                result = supabase.storage.from_(bucket).list("")
-            except Exception as root_error:
-                print(f"Error listing root: {root_error}")
-                # Return empty list if bucket doesn't exist or is empty
-                return []
-        
-        # Handle different response formats from Supabase
-        # The list() method might return a list directly or a dict with 'data' key
-        if result is None:
-            files = []
-        elif isinstance(result, list):
-            files = result
-        elif isinstance(result, dict):
-            files = result.get('data', [])
-        else:
-            files = []
-        
-        # Construct public URLs for the files
-        # Use SUPABASE_URL from environment variable since Client doesn't expose url attribute
-        # The path structure is: /storage/v1/object/public/{bucket}/{file_path}
-        # We're listing files from the "public" folder in the bucket
+        bucket = bim_files_index.bucket
+        page = await bim_files_index.query(limit, offset, prefix, sort, order == "desc")
         
-        projects = []
-        for file in files:
-            # Handle both dict and object formats
-            if isinstance(file, dict):
-                file_name = file.get('name')
-            else:
-                file_name = getattr(file, 'name', None)
-            
-            if file_name and file_name != '.emptyFolderPlaceholder' and not file_name.startswith('.'):
-                # Construct the correct URL path
-                # File path in bucket is "public/{file_name}"
-                file_path = f"public/{file_name}"
-                # Public URL format: {SUPABASE_URL}/storage/v1/object/public/{bucket}/{file_path}
-                projects.append({
-                    "name": file_name,
-                    "url": f"{SUPABASE_URL}/storage/v1/object/public/{bucket}/{file_path}"
-                })
-        
-        return projects
+        # Public URL format: {SUPABASE_URL}/storage/v1/object/public/{bucket}/{file_path}
+        files = [
+            dict(entry, url=f"{SUPABASE_URL}/storage/v1/object/public/{bucket}/{bim_files_index.folder}/{entry['name']}")
+            for entry in page["entries"]
+        ]
+        next_offset = offset + len(files)
+        return {
+            "files": files,
+            "total": page["total"],
+            "next_offset": next_offset if next_offset < page["total"] else None,
+            "refreshed_at": bim_files_index.refreshed_at or None,
+        }
     except Exception as e:
         import traceback
-        error_msg = f"Error in /projects: {e}"
-        print(error_msg)
+        print(f"Error listing files: {e}")
         print(traceback.format_exc())
-        raise HTTPException(status_code=500, detail=f"Error fetching projects: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error listing files: {str(e)}")
+
+@app.get("/files/list/stats")
+async def get_files_index_stats():
+    """Storage listing index size, age and refresh counters."""
+    return bim_files_index.stats()
 
 class AnalyzeRequest(BaseModel):
     file_path: str
@@ -281,232 +359,259 @@ class SceneModelRequest(BaseModel):
     sceneModel: list[SceneModelItem]
     name: str = "Untitled Model"
 
-@app.post("/analyze")
-async def analyze_ifc_file(request: AnalyzeRequest):
+@app.post("/analyze", status_code=202)
+async def analyze_ifc_file(request: AnalyzeRequest, user: dict = Depends(get_current_user)):
+    """
+    Submit an IFC analysis job.
+    The download and parse run on the job engine's process pool; poll
+    GET /analyze/{job_id} for the result.
+    The job holds a share of the admission budget (estimated from the file
+    size) until it finishes; 429 with Retry-After when the budget stays full.
+    A report already in the artifact store for the file's current contents is
+    returned as a finished job, without admission or a worker.
+    """
     bucket_name = "bim-files"
-    file_path = request.file_path
-    tmp_path = None  # Initialize tmp_path to None
+    report = await run_in_threadpool(stored_report, bucket_name, request.file_path)
+    if report is not None:
+        job = job_manager.completed(user["id"], "analyze", report)
+        return {"job_id": job.id, "status": job.status}
+    permit = await admission.acquire(ANALYZE_ROUTE, user["id"], _analysis_cost_mb(request.file_path))
+    try:
+        generation = current_generation(bucket_name, request.file_path)
+        job = job_manager.submit(user["id"], "analyze", analyze_stored_ifc, bucket_name, request.file_path, generation)
+    except BaseException:
+        permit.release()
+        raise
+    job.future.add_done_callback(lambda _: permit.release())
+    return {"job_id": job.id, "status": job.status}
+
+def _analysis_cost_mb(file_path: str) -> float:
+    """Admission cost of analysing a file, from its size in the storage index if it is listed there."""
+    folder = bim_files_index.folder + "/"
+    entry = bim_files_index.get(file_path[len(folder):]) if file_path.startswith(folder) else None
+    return ifc_cost_mb(entry["size"] if entry else None)
+
+@app.get("/admission/stats")
+async def get_admission_stats():
+    """Admission budget of the heavy routes: requests in flight, reserved memory and queue."""
+    return admission.stats()
+
+@app.get("/analyze/cache/stats")
+async def get_analysis_cache_stats():
+    """Parsed-model cache counters, summed over all analysis worker processes."""
+    return job_manager.worker_stats("ifc_models")
+
+@app.get("/auth/cache/stats")
+async def get_auth_cache_stats():
+    """Verified-token cache hit rate and JWKS refresh counters."""
+    return auth_stats()
 
+@app.get("/analyze/{job_id}")
+async def get_analysis_job(job_id: str, user: dict = Depends(get_current_user)):
+    """Get the status of an analysis job, including its result once finished."""
+    return job_manager.get(job_id, user["id"]).to_dict()
+
+@app.delete("/analyze/{job_id}")
+async def cancel_analysis_job(job_id: str, user: dict = Depends(get_current_user)):
+    """Cancel a queued or running analysis job."""
+    return job_manager.cancel(job_id, user["id"]).to_dict()
+
+EXPORT_MODES = ("document", "stream", "storage")
+EXPORT_MESSAGE = "EnergyPlus export generated successfully (stub implementation)"
+
+def _export_body(chunks, key: str):
+    """The "document" response body around the encoded epJSON chunks."""
+    yield b'{"status":"success","epjson":'
+    yield from chunks
+    yield b"," + json.dumps({"scene_hash": key, "message": EXPORT_MESSAGE})[1:].encode()
+
+async def _release_after(chunks, permit):
+    """A streamed body that releases the admission permit once it is sent or abandoned."""
     try:
-        # Create a temporary file that will be deleted automatically on close
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".ifc") as tmp:
-            tmp_path = tmp.name
-            # Download file data from Supabase
-            data = supabase.storage.from_(bucket_name).download(file_path)
-            tmp.write(data)
-            # Ensure all data is written to disk before proceeding
-            tmp.flush()
-            os.fsync(tmp.fileno())
-
-        # Now that the file is written and closed, open it with ifcopenshell
-        # Note: ifcopenshell.open() returns a file object that doesn't need explicit closing
-        # The file is automatically managed by ifcopenshell
-        ifc_file = ifcopenshell.open(tmp_path)
-        
-        # Perform a simple analysis: count all walls
-        walls = ifc_file.by_type("IfcWall")
-        wall_count = len(walls)
-        
-        # No need to close ifc_file - it's automatically managed by ifcopenshell
-        
-        return {"wall_count": wall_count}
-        
-    except Exception as e:
-        # Log the full exception for debugging purposes
-        import traceback
-        error_msg = f"Analysis Error: {e}"
-        print(error_msg)
-        print(traceback.format_exc())
-        # Return detailed error message to help debug
-        raise HTTPException(
-            status_code=500, 
-            detail=f"Error analyzing file: {str(e)}"
-        )
-    
+        async for chunk in chunks:
+            yield chunk
     finally:
-        # Ensure the temporary file is cleaned up in any case
-        if tmp_path and os.path.exists(tmp_path):
-            os.remove(tmp_path)
+        permit.release()
 
-@app.post("/simulate/export-energyplus")
-async def export_to_energyplus(request: SceneModelRequest):
+async def _read_scene(http_request: Request) -> PackedScene:
+    """
+    The scene of an export request: a SceneModelRequest as JSON, or the binary
+    form (see scene_payload.py) when sent with its content type.
+    Decoded on the threadpool, like the export itself, so the event loop keeps
+    admitting and rejecting other requests meanwhile.
     """
-    Converts a SceneModel (JSON) to EnergyPlus format (epJSON).
+    body = await http_request.body()
+    content_type = http_request.headers.get("content-type", "").split(";")[0].strip().lower()
+    return await run_in_threadpool(_decode_scene_body, body, content_type)
+
+def _decode_scene_body(body: bytes, content_type: str) -> PackedScene:
+    if content_type == SCENE_CONTENT_TYPE:
+        try:
+            _, scene = decode_scene(body)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid scene payload: {str(e)}")
+        return scene
+    try:
+        request = SceneModelRequest.model_validate_json(body)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors(include_url=False))
+    try:
+        return PackedScene.from_items(request.sceneModel)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid scene: {str(e)}")
+
+@app.post(
+    "/simulate/export-energyplus",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {"schema": {"type": "object", "description": "SceneModelRequest"}},
+                SCENE_CONTENT_TYPE: {"schema": {"type": "string", "format": "binary"}},
+            },
+        }
+    },
+)
+async def export_to_energyplus(
+    http_request: Request, response: Response, mode: str = "document", user: Optional[dict] = Depends(get_optional_user)
+):
+    """
+    Converts a SceneModel to EnergyPlus format (epJSON).
+    The scene is sent as SceneModelRequest JSON, or in the compact binary form
+    (Content-Type application/vnd.voxel.scene, see scene_payload.py) that
+    decodes without per-item validation.
     
     Process:
-    1. Reconstruct IFC model from SceneModel JSON
-    2. Convert IFC to EnergyPlus format
-    3. Return epJSON or IDF file
+    1. Pack the scene items into arrays and hash each item
+    2. Serve the encoded epJSON from the artifact store if any worker exported
+       this scene before
+    3. Otherwise reuse the cached contributions of unchanged items, place the
+       surfaces of new or edited items in one batched transform, assemble the
+       epJSON and keep it in the artifact store
+    
+    The scene hash is returned as ETag; send it back in If-None-Match to get
+    304 Not Modified while the scene is unchanged.
+    
+    mode "stream" returns the same body as a chunked stream, encoded section by
+    section without building the document; mode "storage" writes the epJSON to
+    storage and returns a signed download URL instead of the document. Storage
+    responses carry no ETag and are never 304: the client needs a fresh URL.
+
+    The request is admitted (see admission.py) before its body is read, with
+    a cost estimated from Content-Length; 429 with Retry-After when the
+    budget stays full.
     """
+    if mode not in EXPORT_MODES:
+        raise HTTPException(status_code=400, detail=f"Invalid mode. Must be one of {', '.join(EXPORT_MODES)}")
+    content_length = http_request.headers.get("content-length")
+    user_key = user["id"] if user else (http_request.client.host if http_request.client else "anonymous")
+    permit = await admission.acquire(
+        EXPORT_ROUTE, user_key, export_cost_mb(int(content_length) if content_length and content_length.isdigit() else None)
+    )
     try:
-        # Step 1: Reconstruct IFC model from SceneModel
-        # For now, this is a stub that creates a basic IFC structure
-        ifc_model = reconstruct_ifc_from_scene(request.sceneModel)
-        
-        # Step 2: Convert IFC to EnergyPlus
-        # This is a placeholder - full implementation would use ifcopenshell + eppy/geomeppy
-        epjson_data = convert_ifc_to_energyplus(ifc_model, request.sceneModel)
-        
-        return {
-            "status": "success",
-            "epjson": epjson_data,
-            "message": "EnergyPlus export generated successfully (stub implementation)"
-        }
+        result = await _export(http_request, response, mode)
+    except BaseException:
+        permit.release()
+        raise
+    if isinstance(result, StreamingResponse):
+        result.body_iterator = _release_after(result.body_iterator, permit)
+    else:
+        permit.release()
+    return result
+
+async def _export(http_request: Request, response: Response, mode: str):
+    scene = await _read_scene(http_request)
+    try:
+        hashes = await run_in_threadpool(item_hashes, scene)
+        key = scene_hash(hashes)
+        etag = f'"{key}"'
+        metrics.export_items.observe(len(scene), mode=mode)
+        # document and stream send the same body; a storage response is not that body
+        if mode != "storage" and etag in [value.strip() for value in http_request.headers.get("if-none-match", "").split(",")]:
+            metrics.exports.inc(mode=mode, outcome="not_modified")
+            return Response(status_code=304, headers={"ETag": etag})
+
+        print(f"Converting {len(scene)} scene items to EnergyPlus format ({mode})")
+        metrics.exports.inc(mode=mode, outcome="exported")
+        if mode == "stream":
+            chunks = await run_in_threadpool(epjson_chunks, scene, hashes, key)
+            return StreamingResponse(
+                _export_body(chunks, key), media_type=EPJSON_CONTENT_TYPE, headers={"ETag": etag}
+            )
+
+        if mode == "storage":
+            path = await run_in_threadpool(store_epjson, "bim-files", key, scene, hashes)
+            return {
+                "status": "success",
+                "signed_url": _require_signed_url(await signed_url("bim-files", path), path),
+                "scene_hash": key,
+                "message": EXPORT_MESSAGE
+            }
+
+        # Already encoded (and possibly read from the artifact store as is)
+        document = await run_in_threadpool(epjson_document, scene, hashes, key)
+        return Response(b"".join(_export_body([document], key)), media_type=EPJSON_CONTENT_TYPE, headers={"ETag": etag})
         
     except Exception as e:
         import traceback
+        metrics.exports.inc(mode=mode, outcome="error")
         print(f"EnergyPlus Export Error: {e}")
         print(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Error exporting to EnergyPlus: {str(e)}")
 
-def reconstruct_ifc_from_scene(scene_model: list[SceneModelItem]):
-    """
-    Reconstructs an IFC model from SceneModel JSON.
-    This is a stub implementation - in production, this would:
-    1. Create a new IFC file using ifcopenshell
-    2. For each item in scene_model:
-       - Create the appropriate IFC entity (IfcWall, IfcWindow, etc.)
-       - Apply geometry from position/rotation/scale
-       - Apply properties from the marketplace item metadata
-    """
-    # Stub: Return a minimal IFC structure
-    # In production, use ifcopenshell.file() to create a new file
-    # and ifcopenshell.api.run() to add entities
-    
-    print(f"Reconstructing IFC from {len(scene_model)} items")
-    
-    # Placeholder structure
-    ifc_data = {
-        "version": "IFC4",
-        "items": []
-    }
-    
-    for item in scene_model:
-        ifc_type = item.properties.get("ifc_type", "IfcBuildingElement")
-        ifc_data["items"].append({
-            "type": ifc_type,
-            "position": item.position,
-            "rotation": item.rotation,
-            "scale": item.scale,
-            "properties": item.properties
-        })
-    
-    return ifc_data
+@app.get("/simulate/export-energyplus/cache/stats")
+async def get_export_cache_stats():
+    """epJSON export cache counters."""
+    return export_cache.stats()
 
-def convert_ifc_to_energyplus(ifc_model: dict, scene_model: list[SceneModelItem]) -> dict:
-    """
-    Converts IFC model to EnergyPlus epJSON format.
-    This is a stub implementation - in production, this would:
-    1. Map IFC entities to EnergyPlus objects:
-       - IfcWall -> BuildingSurface:Detailed
-       - IfcWindow -> FenestrationSurface:Detailed
-       - IfcSpace -> Zone
-    2. Apply physics properties from marketplace items to Material definitions
-    3. Generate proper epJSON structure
-    """
-    # Stub: Return a minimal epJSON structure
-    # In production, use libraries like eppy or geomeppy
-    
-    print(f"Converting IFC to EnergyPlus format")
-    
-    # Basic epJSON structure
-    epjson = {
-        "Version": {
-            "Version 1": {
-                "version_identifier": "9.6"
-            }
-        },
-        "Building": {
-            "Building 1": {
-                "north_axis": 0.0,
-                "terrain": "Suburbs",
-                "loads_convergence_tolerance_value": 0.04,
-                "temperature_convergence_tolerance_value": 0.4,
-                "solar_distribution": "FullExterior",
-                "maximum_number_of_warmup_days": 25,
-                "minimum_number_of_warmup_days": 6
-            }
-        },
-        "Material": {},
-        "BuildingSurface:Detailed": {},
-        "FenestrationSurface:Detailed": {},
-        "Zone": {}
-    }
-    
-    # Map scene items to EnergyPlus objects
-    surface_counter = 1
-    fenestration_counter = 1
-    
-    for item in scene_model:
-        ifc_type = item.properties.get("ifc_type", "")
-        physics = item.properties.get("physics", {})
-        
-        # Create material from physics properties
-        material_name = f"Material_{item.itemId}"
-        if material_name not in epjson["Material"]:
-            epjson["Material"][material_name] = {
-                "roughness": "MediumRough",
-                "thickness": physics.get("thickness", 0.2),
-                "conductivity": physics.get("thermal_conductivity", 1.4),
-                "density": physics.get("density", 2400),
-                "specific_heat": physics.get("specific_heat", 880)
-            }
-        
-        # Map IFC types to EnergyPlus objects
-        if "Wall" in ifc_type:
-            surface_name = f"Wall_{surface_counter}"
-            epjson["BuildingSurface:Detailed"][surface_name] = {
-                "construction_name": f"Construction_{item.itemId}",
-                "zone_name": "Zone 1",
-                "surface_type": "Wall",
-                "outside_boundary_condition": "Outdoors",
-                "vertices": calculate_surface_vertices(item)
-            }
-            surface_counter += 1
-            
-        elif "Window" in ifc_type or "Door" in ifc_type:
-            fenestration_name = f"Fenestration_{fenestration_counter}"
-            epjson["FenestrationSurface:Detailed"][fenestration_name] = {
-                "construction_name": f"Construction_{item.itemId}",
-                "building_surface_name": f"Wall_{surface_counter - 1}",
-                "vertices": calculate_surface_vertices(item)
-            }
-            fenestration_counter += 1
-    
-    # Add default zone if no zones were created
-    if not epjson["Zone"]:
-        epjson["Zone"]["Zone 1"] = {
-            "direction_of_relative_north": 0.0,
-            "x_origin": 0.0,
-            "y_origin": 0.0,
-            "z_origin": 0.0,
-            "type": 1,
-            "multiplier": 1,
-            "ceiling_height": 3.0,
-            "volume": 100.0
-        }
-    
-    return epjson
+@app.get("/artifacts/stats")
+async def get_artifact_stats():
+    """Artifact store size and the hit counters of this process and (summed) of the job workers."""
+    return {"api": artifact_store.stats(), "workers": job_manager.worker_stats("artifacts")}
 
-def calculate_surface_vertices(item: SceneModelItem) -> list:
-    """
-    Calculate EnergyPlus surface vertices from item position, rotation, and scale.
-    Returns a list of vertex coordinates in EnergyPlus format.
-    """
-    # Stub: Return a simple rectangular surface
-    # In production, this would use the actual geometry from the fragment
-    
-    x, y, z = item.position
-    width = item.properties.get("width", 1.0) * item.scale[0]
-    height = item.properties.get("height", 2.0) * item.scale[1]
-    depth = item.properties.get("depth", 0.1) * item.scale[2]
-    
-    # Simple rectangular surface (4 vertices)
-    vertices = [
-        {"vertex_x_coordinate": x, "vertex_y_coordinate": y, "vertex_z_coordinate": z},
-        {"vertex_x_coordinate": x + width, "vertex_y_coordinate": y, "vertex_z_coordinate": z},
-        {"vertex_x_coordinate": x + width, "vertex_y_coordinate": y + height, "vertex_z_coordinate": z},
-        {"vertex_x_coordinate": x, "vertex_y_coordinate": y + height, "vertex_z_coordinate": z}
-    ]
-    
-    return vertices
+def _collect_metrics():
+    """Mirror cache counters, pool, job and admission state into the metrics registry."""
+    token_cache = auth_stats()["token_cache"]
+    metrics.record_cache("auth_tokens", token_cache["hits"], token_cache["misses"], token_cache["entries"])
+    urls = signed_url_cache.stats()
+    metrics.record_cache("signed_urls", urls["hits"], urls["misses"], urls["entries"])
+    epjson = export_cache.stats()
+    metrics.record_cache("epjson_items", epjson["item_hits"], epjson["item_misses"], epjson["items"])
+    metrics.record_cache("epjson_scenes", epjson["scene_hits"], epjson["scene_misses"], epjson["scenes"])
+    artifacts = artifact_store.counters()
+    worker_artifacts = job_manager.worker_stats("artifacts")
+    for kind in ARTIFACT_KINDS:
+        metrics.record_cache(
+            f"artifacts_{kind}",
+            artifacts[f"{kind}_hits"] + worker_artifacts.get(f"{kind}_hits", 0),
+            artifacts[f"{kind}_misses"] + worker_artifacts.get(f"{kind}_misses", 0),
+        )
+    stored_bytes = artifact_store.stats()["bytes"]
+    if stored_bytes is not None:
+        metrics.artifact_store_bytes.set(stored_bytes)
+    models = job_manager.worker_stats("ifc_models")
+    metrics.record_cache("ifc_models", models.get("hits", 0), models.get("misses", 0), models.get("entries", 0))
+    metrics.cache_entries.set(bim_files_index.stats()["entries"], cache="storage_index")
+    metrics.cache_entries.set(catalogue.stats()["items"], cache="marketplace")
+
+    pool = db.pool_stats()
+    metrics.supabase_pool_connections.set(pool["connections"] - pool["idle_connections"], state="active")
+    metrics.supabase_pool_connections.set(pool["idle_connections"], state="idle")
+    counts = job_manager.status_counts()
+    for state in ("queued", "running", "succeeded", "failed", "cancelled", "deferred"):
+        metrics.jobs.set(counts.get(state, 0), status=state)
+    metrics.job_workers.set(job_manager.max_workers)
+    budget = admission.stats()
+    metrics.admission_in_flight.set(budget["in_flight"])
+    metrics.admission_queued.set(budget["queued"])
+    metrics.admission_reserved_bytes.set(int(budget["reserved_mb"] * 1024 * 1024))
+
+metrics.register_collector(_collect_metrics)
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus metrics of the API process plus the latest counts of every job worker."""
+    return PlainTextResponse(
+        metrics.render(job_manager.worker_snapshots("metrics")),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
@@ -0,0 +1,176 @@
+"""
+In-process snapshot of the marketplace catalogue.
+The marketplace_items table is loaded into an immutable snapshot with
+postings by ifc_type and tag, so filtering, facet counts and pagination run
+in memory. The snapshot is versioned by a digest of its rows; the version
+(together with the caller and the query) is the ETag of a response, so the
+marketplace panel revalidates with If-None-Match and gets a 304 while the
+catalogue is unchanged.
+
+A read older than MARKETPLACE_REFRESH_SECONDS probes the table (row count and
+newest updated_at) in the background and reloads it only if that changed.
+"""
+import os
+import asyncio
+import hashlib
+import heapq
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+import data_access as db
+
+MARKETPLACE_REFRESH_SECONDS = float(os.environ.get("MARKETPLACE_REFRESH_SECONDS", "30"))
+# Rows per PostgREST request while loading the catalogue
+MARKETPLACE_LOAD_PAGE = 1000
+# Facet values returned per facet
+MARKETPLACE_FACET_LIMIT = 50
+
+
+class CatalogueSnapshot:
+    """Immutable catalogue: items sorted by name, with postings (item positions) by ifc_type, tag and owner."""
+
+    def __init__(self, rows: List[dict], probe: Tuple[int, Optional[str]]):
+        self.items = sorted(rows, key=lambda item: ((item.get("name") or "").casefold(), item["id"]))
+        self.probe = probe
+        self.by_type: Dict[str, List[int]] = {}
+        self.by_tag: Dict[str, List[int]] = {}
+        self.by_owner: Dict[str, List[int]] = {}
+        self.public: List[int] = []
+        # Lower-cased text the search parameter matches against
+        self.text: List[str] = []
+        digest = hashlib.sha256()
+        for position, item in enumerate(self.items):
+            self.by_type.setdefault(item.get("ifc_type"), []).append(position)
+            for tag in item.get("tags") or []:
+                self.by_tag.setdefault(tag, []).append(position)
+            if item.get("is_public"):
+                self.public.append(position)
+            elif item.get("user_id"):
+                self.by_owner.setdefault(item["user_id"], []).append(position)
+            self.text.append(" ".join(
+                (item.get(field) or "") for field in ("name", "description", "manufacturer", "model_number")
+            ).casefold())
+            digest.update(f"{item['id']}\0{item.get('updated_at')}\0{item.get('version')}\n".encode())
+        self.version = digest.hexdigest()[:16]
+        self.built_at = time.time()
+
+    def visible(self, user_id: Optional[str]) -> List[int]:
+        """Positions of the public items and the caller's own items, in name order."""
+        own = self.by_owner.get(user_id, []) if user_id else []
+        return list(heapq.merge(self.public, own)) if own else self.public
+
+    def query(
+        self,
+        user_id: Optional[str],
+        ifc_type: Optional[str] = None,
+        tags: Optional[List[str]] = None,
+        search: Optional[str] = None,
+        limit: int = 100,
+        offset: int = 0,
+    ) -> Dict[str, Any]:
+        """
+        A page of the visible items matching all filters, the total, and facet
+        counts. Each facet is counted over the matches of the other filters, so
+        the type list stays complete while a type is selected.
+        """
+        base = self.visible(user_id)
+        if search:
+            needle = search.casefold()
+            base = [position for position in base if needle in self.text[position]]
+
+        by_tags = base
+        for tag in tags or []:
+            posting = set(self.by_tag.get(tag, ()))
+            by_tags = [position for position in by_tags if position in posting]
+
+        matches = by_tags
+        if ifc_type:
+            posting = set(self.by_type.get(ifc_type, ()))
+            matches = [position for position in by_tags if position in posting]
+
+        type_counts = Counter(self.items[position].get("ifc_type") for position in by_tags)
+        tag_counts = Counter(tag for position in matches for tag in (self.items[position].get("tags") or []))
+        page = [self.items[position] for position in matches[offset:offset + limit]]
+        next_offset = offset + len(page)
+        return {
+            "items": page,
+            "total": len(matches),
+            "next_offset": next_offset if next_offset < len(matches) else None,
+            "facets": {
+                "ifc_type": dict(type_counts.most_common(MARKETPLACE_FACET_LIMIT)),
+                "tags": dict(tag_counts.most_common(MARKETPLACE_FACET_LIMIT)),
+            },
+            "catalogue_version": self.version,
+        }
+
+
+class Catalogue:
+    """The current snapshot, replaced in the background when the table changes."""
+
+    def __init__(self):
+        self.snapshot: Optional[CatalogueSnapshot] = None
+        self._task: Optional[asyncio.Task] = None
+        self._checked_at = 0.0
+        self.loads = 0
+        self.probes = 0
+        self.failures = 0
+
+    async def _load(self, probe: Tuple[int, Optional[str]]) -> CatalogueSnapshot:
+        rows: List[dict] = []
+        while True:
+            page = await db.list_marketplace_items(len(rows), MARKETPLACE_LOAD_PAGE)
+            rows.extend(page)
+            if len(page) < MARKETPLACE_LOAD_PAGE:
+                break
+        self.loads += 1
+        return CatalogueSnapshot(rows, probe)
+
+    async def _refresh(self):
+        try:
+            probe = await db.marketplace_probe()
+            self.probes += 1
+            if self.snapshot is None or probe != self.snapshot.probe:
+                self.snapshot = await self._load(probe)
+        except Exception as e:
+            self.failures += 1
+            print(f"Marketplace catalogue refresh failed: {e}")
+            if self.snapshot is None:
+                raise
+        finally:
+            self._checked_at = time.time()
+
+    def _start_refresh(self) -> asyncio.Task:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._refresh())
+        return self._task
+
+    async def current(self) -> CatalogueSnapshot:
+        """The current snapshot; only the first call waits for the database."""
+        if self.snapshot is None:
+            await self._start_refresh()
+        elif time.time() - self._checked_at >= MARKETPLACE_REFRESH_SECONDS:
+            self._start_refresh()
+        return self.snapshot
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self.snapshot
+        return {
+            "version": snapshot.version if snapshot else None,
+            "items": len(snapshot.items) if snapshot else 0,
+            "ifc_types": len(snapshot.by_type) if snapshot else 0,
+            "tags": len(snapshot.by_tag) if snapshot else 0,
+            "built_at": snapshot.built_at if snapshot else None,
+            "checked_at": self._checked_at or None,
+            "loads": self.loads,
+            "probes": self.probes,
+            "failures": self.failures,
+        }
+
+
+catalogue = Catalogue()
+
+
+def query_etag(snapshot: CatalogueSnapshot, user_id: Optional[str], *params: Any) -> str:
+    """ETag of a catalogue response: the snapshot version, the caller (own items are visible) and the query."""
+    key = repr((snapshot.version, user_id, params)).encode()
+    return f'"{hashlib.sha1(key).hexdigest()}"'
@@ -0,0 +1,378 @@
+"""
+Prometheus metrics for the API and the job workers.
+A small registry of counters, gauges and histograms rendered in the
+Prometheus text format by GET /metrics, so no client library is needed.
+
+Worker processes record into their own registry; its snapshot travels back
+with every job result (see jobs.register_worker_stats) and is added to the
+API process's values when rendering.
+
+Timers can also add an entry to the Server-Timing header of the current
+request (see TimingMiddleware); that breakdown is collected only for requests
+that ask for it, or for all requests with SERVER_TIMING=1.
+"""
+import os
+import re
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from jobs import register_worker_stats
+
+# Add a Server-Timing header to every response, not only to requests sent with X-Server-Timing: 1
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "0") == "1"
+
+# Seconds; covers cached lookups (ms) up to full model parses (minutes)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+# Item counts and byte sizes
+COUNT_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+SIZE_BUCKETS = tuple(2 ** power * 1024 * 1024 for power in range(0, 12, 2))
+
+_registry: Dict[str, "Metric"] = {}
+_collectors: List[Callable[[], None]] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Metric:
+    """A named metric with a fixed set of label names; values are keyed by label values."""
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+        _registry[name] = self
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def snapshot(self) -> Dict[Tuple[str, ...], Any]:
+        with self._lock:
+            return {key: (list(value) if isinstance(value, list) else value) for key, value in self._values.items()}
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels: Any):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value: float, **labels: Any):
+        """Mirror a counter kept elsewhere (e.g. cache hit counters)."""
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, **labels: Any):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: Any):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: Any):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    """Values are [count per bucket..., sum, count]; buckets are rendered cumulatively."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels: Any):
+        key = self._key(labels)
+        index = len(self.buckets)
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = position
+                break
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 3)
+            counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+
+def register_collector(collector: Callable[[], None]):
+    """Register a callable that updates gauges/counters right before each scrape."""
+    _collectors.append(collector)
+
+
+def snapshot() -> Dict[str, Dict[Tuple[str, ...], Any]]:
+    """Values of all metrics of this process (picklable; sent back from job workers)."""
+    return {name: metric.snapshot() for name, metric in _registry.items()}
+
+
+register_worker_stats("metrics", snapshot)
+
+
+def _merge(target: Dict[Tuple[str, ...], Any], values: Dict[Tuple[str, ...], Any]):
+    for key, value in values.items():
+        current = target.get(key)
+        if current is None:
+            target[key] = list(value) if isinstance(value, list) else value
+        elif isinstance(value, list):
+            target[key] = [a + b for a, b in zip(current, value)]
+        else:
+            target[key] = current + value
+
+
+def render(worker_snapshots: Iterable[Dict[str, Dict[Tuple[str, ...], Any]]] = ()) -> str:
+    """All metrics in the Prometheus text format (0.0.4), worker snapshots added in."""
+    for collector in _collectors:
+        try:
+            collector()
+        except Exception as e:
+            print(f"Metrics collector failed: {e}")
+    worker_snapshots = list(worker_snapshots)
+    lines: List[str] = []
+    for name, metric in sorted(_registry.items()):
+        values = metric.snapshot()
+        # Gauges describe this process (in-flight requests, pool sizes); workers only add counts
+        if metric.kind != "gauge":
+            for worker in worker_snapshots:
+                _merge(values, worker.get(name, {}))
+        lines.append(f"# HELP {name} {metric.documentation}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        for key, value in sorted(values.items()):
+            if isinstance(metric, Histogram):
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float("inf"),), value):
+                    cumulative += count
+                    labels = _format_labels(metric.labelnames + ("le",), key + (_format_value(bound),))
+                    lines.append(f"{name}_bucket{labels} {cumulative}")
+                labels = _format_labels(metric.labelnames, key)
+                lines.append(f"{name}_sum{labels} {_format_value(value[-2])}")
+                lines.append(f"{name}_count{labels} {value[-1]}")
+            else:
+                lines.append(f"{name}{_format_labels(metric.labelnames, key)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# Server-Timing entries of the current request: {name: [seconds, count]}, or None when not collected
+_server_timing: contextvars.ContextVar[Optional[Dict[str, List[float]]]] = contextvars.ContextVar("server_timing", default=None)
+_SERVER_TIMING_NAME = re.compile(r"[^A-Za-z0-9_.-]+")
+
+
+def add_server_timing(name: str, seconds: float):
+    """Add to the Server-Timing entry `name` of the current request (if it collects them)."""
+    entries = _server_timing.get()
+    if entries is not None:
+        entry = entries.setdefault(_SERVER_TIMING_NAME.sub("-", name), [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+
+
+def server_timing_header(entries: Dict[str, List[float]]) -> str:
+    return ", ".join(
+        f'{name};dur={seconds * 1000:.1f};desc="{count}x"' if count > 1 else f"{name};dur={seconds * 1000:.1f}"
+        for name, (seconds, count) in entries.items()
+    )
+
+
+@contextmanager
+def timed(histogram: Histogram, server_timing: Optional[str] = None, **labels: Any):
+    """Observe the duration of the block into histogram (and the request's Server-Timing)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        histogram.observe(elapsed, **labels)
+        if server_timing:
+            add_server_timing(server_timing, elapsed)
+
+
+# HTTP
+http_requests = Counter("http_requests_total", "HTTP requests by route template, method and status code.", ("method", "route", "status"))
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Time until the last response byte, by route template and method.", ("method", "route")
+)
+http_requests_in_flight = Gauge("http_requests_in_flight", "Requests currently being handled, by route template.", ("route",))
+
+# Supabase (REST, Storage and Auth calls of all clients)
+supabase_requests = Counter(
+    "supabase_requests_total", "Supabase calls by kind (table, rpc, storage, auth), target, operation and status class.",
+    ("kind", "target", "op", "status"),
+)
+supabase_request_duration = Histogram(
+    "supabase_request_duration_seconds", "Time until the Supabase response headers arrived.", ("kind", "target", "op")
+)
+
+# IFC loading and analysis (recorded in the job workers)
+ifc_download_bytes = Counter("ifc_download_bytes_total", "Bytes of IFC files downloaded from storage.")
+ifc_download_size = Histogram("ifc_download_size_bytes", "Size of downloaded IFC files.", buckets=SIZE_BUCKETS)
+ifc_download_duration = Histogram("ifc_download_seconds", "Time to download an IFC file body, by parse strategy.", ("strategy",))
+ifc_parse_duration = Histogram("ifc_parse_seconds", "Time ifcopenshell took to open a downloaded IFC file, by parse strategy.", ("strategy",))
+ifc_analysis_phase_duration = Histogram("ifc_analysis_phase_seconds", "Time per analysis phase (walk, geometry, total).", ("phase",))
+storage_download_bytes = Counter("storage_download_bytes_total", "Bytes of other storage objects streamed to local files.")
+
+# EnergyPlus export
+export_items = Histogram("energyplus_export_items", "Scene items per EnergyPlus export request.", ("mode",), buckets=COUNT_BUCKETS)
+exports = Counter("energyplus_exports_total", "EnergyPlus export requests by mode and outcome.", ("mode", "outcome"))
+
+# Admission control of the heavy routes
+admission_requests = Counter(
+    "admission_requests_total", "Heavy requests by route and admission outcome (admitted, rate_limited, queue_full, shed, timed_out).",
+    ("route", "outcome"),
+)
+admission_wait = Histogram("admission_wait_seconds", "Time admitted requests waited in the admission queue.", ("route",))
+admission_in_flight = Gauge("admission_in_flight", "Requests holding a share of the admission budget.")
+admission_queued = Gauge("admission_queued", "Requests waiting for room in the admission budget.")
+admission_reserved_bytes = Gauge("admission_reserved_bytes", "Estimated memory reserved by admitted requests.")
+
+# Pools (set at scrape time)
+supabase_pool_connections = Gauge("supabase_pool_connections", "Pooled connections of the async Supabase client, by state.", ("state",))
+jobs = Gauge("jobs", "Tracked jobs by status, and deferred background work.", ("status",))
+job_workers = Gauge("job_workers", "Size of the job engine's process pool.")
+
+# Caches (mirrored from the caches' own counters at scrape time)
+cache_hits = Counter("cache_hits_total", "Cache hits by cache.", ("cache",))
+cache_misses = Counter("cache_misses_total", "Cache misses by cache.", ("cache",))
+cache_hit_ratio = Gauge("cache_hit_ratio", "Hits / lookups since start, by cache.", ("cache",))
+cache_entries = Gauge("cache_entries", "Entries currently held, by cache.", ("cache",))
+artifact_store_bytes = Gauge("artifact_store_bytes", "Bytes held by the local artifact store (shared by all processes on the host).")
+
+
+def record_cache(cache: str, hits: int, misses: int, entries: Optional[int] = None):
+    """Mirror a cache's counters (called by collectors)."""
+    cache_hits.set(hits, cache=cache)
+    cache_misses.set(misses, cache=cache)
+    lookups = hits + misses
+    if lookups:
+        cache_hit_ratio.set(hits / lookups, cache=cache)
+    if entries is not None:
+        cache_entries.set(entries, cache=cache)
+
+
+def supabase_call_labels(method: str, path: str) -> Tuple[str, str, str]:
+    """(kind, target, op) of a Supabase URL path, e.g. ("table", "projects", "select")."""
+    parts = [part for part in path.split("/") if part]
+    if len(parts) >= 3 and parts[:2] == ["rest", "v1"]:
+        if parts[2] == "rpc" and len(parts) >= 4:
+            return "rpc", parts[3], "call"
+        return "table", parts[2], {"GET": "select", "HEAD": "count", "POST": "insert", "PATCH": "update", "DELETE": "delete"}.get(method, method.lower())
+    if len(parts) >= 4 and parts[:3] == ["storage", "v1", "object"]:
+        rest = parts[3:]
+        if rest[0] in ("sign", "list", "public", "authenticated", "info") and len(rest) >= 2:
+            op = {"public": "download", "authenticated": "download"}.get(rest[0], rest[0])
+            return "storage", rest[1], op
+        if rest[0] == "upload" and len(rest) >= 3:
+            return "storage", rest[2], "upload_" + rest[1]
+        op = {"GET": "download", "HEAD": "stat", "POST": "upload", "PUT": "upload", "DELETE": "delete"}.get(method, method.lower())
+        return "storage", rest[0], op
+    if len(parts) >= 3 and parts[:2] == ["storage", "v1"]:
+        return "storage", parts[2], method.lower()
+    if len(parts) >= 3 and parts[:2] == ["auth", "v1"]:
+        return "auth", parts[2], method.lower()
+    return "other", parts[0] if parts else "", method.lower()
+
+
+def _on_supabase_request(request):
+    request.extensions["metrics_started"] = time.perf_counter()
+
+
+def _on_supabase_response(response):
+    started = response.request.extensions.get("metrics_started")
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    kind, target, op = supabase_call_labels(response.request.method, response.request.url.path)
+    supabase_request_duration.observe(elapsed, kind=kind, target=target, op=op)
+    supabase_requests.inc(kind=kind, target=target, op=op, status=f"{response.status_code // 100}xx")
+    add_server_timing(f"{kind}-{target}" if kind != "storage" else f"storage-{op}", elapsed)
+
+
+async def _on_supabase_request_async(request):
+    _on_supabase_request(request)
+
+
+async def _on_supabase_response_async(response):
+    _on_supabase_response(response)
+
+
+# event_hooks for the httpx clients that talk to Supabase
+SUPABASE_EVENT_HOOKS = {"request": [_on_supabase_request], "response": [_on_supabase_response]}
+SUPABASE_ASYNC_EVENT_HOOKS = {"request": [_on_supabase_request_async], "response": [_on_supabase_response_async]}
+
+
+class TimingMiddleware:
+    """
+    Per-route request metrics, as plain ASGI middleware so streamed responses
+    are timed until their last chunk. Adds the Server-Timing header when the
+    request sent X-Server-Timing: 1 (or SERVER_TIMING=1).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def _route(self, scope) -> str:
+        # The route template keeps label cardinality bounded (no ids in paths)
+        from starlette.routing import Match
+        for route in getattr(scope.get("app"), "routes", ()):
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return getattr(route, "path", scope["path"])
+        return "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route = self._route(scope)
+        method = scope["method"]
+        collect = SERVER_TIMING or (b"x-server-timing", b"1") in scope.get("headers", ())
+        token = _server_timing.set({} if collect else None)
+        started = time.perf_counter()
+        status = 500
+        http_requests_in_flight.inc(route=route)
+
+        async def send_timed(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                entries = _server_timing.get()
+                if entries is not None:
+                    add_server_timing("app", time.perf_counter() - started)
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", server_timing_header(entries).encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            http_requests_in_flight.dec(route=route)
+            http_request_duration.observe(time.perf_counter() - started, method=method, route=route)
+            http_requests.inc(method=method, route=route, status=str(status))
+            _server_timing.reset(token)
@@ -0,0 +1,153 @@
+"""
+In-process LRU cache of parsed IFC models.
+Entries are keyed by bucket + path and remember the storage object version
+(ETag / Last-Modified) they were parsed from, so repeat analyses of an
+unchanged file skip both the download and the parse.
+
+The cache itself lives in the job worker processes. The API process only keeps
+an invalidation generation per path: a confirmed upload (/files/upload-complete)
+bumps it, jobs carry it along, and a worker whose entry was made under an older
+generation revalidates it with a HEAD request.
+
+Generations are per API process. With several uvicorn workers, only the one
+that received the confirmation bumps its generation; jobs submitted by the
+others keep trusting a cached entry until IFC_CACHE_REVALIDATE_SECONDS have
+passed. Analyses with the artifact store enabled always compare the current
+object version and do not depend on generations.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
+from ifc_loader import ObjectInfo, open_stored_ifc, stat_object
+from jobs import register_worker_stats
+
+if TYPE_CHECKING:
+    import ifcopenshell
+
+# Byte budget per worker process. Entries are charged by the size of the
+# downloaded IFC; parsed models usually need a small multiple of that.
+IFC_CACHE_MAX_BYTES = int(os.environ.get("IFC_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Entries older than this are revalidated against storage (catches uploads
+# that were not confirmed through /files/upload-complete, or confirmed to
+# another API process)
+IFC_CACHE_REVALIDATE_SECONDS = int(os.environ.get("IFC_CACHE_REVALIDATE_SECONDS", "300"))
+
+
+class CacheEntry:
+    def __init__(self, model: "ifcopenshell.file", version: Optional[str], size: int, generation: int, sha256: Optional[str] = None):
+        self.model = model
+        self.version = version
+        self.size = size
+        self.generation = generation
+        # Content hash, if the model was read through the artifact store
+        self.sha256 = sha256
+        self.validated_at = time.time()
+
+
+class IfcModelCache:
+    """Byte-bounded LRU mapping (bucket, path) to the parsed model of one object version."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple[str, str], CacheEntry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Tuple[str, str]) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: Tuple[str, str], entry: CacheEntry):
+        with self._lock:
+            self._remove(key)
+            if entry.size > self.max_bytes:
+                return
+            self._entries[key] = entry
+            self._bytes += entry.size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+                self.evictions += 1
+
+    def invalidate(self, key: Tuple[str, str]):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key: Tuple[str, str]):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+model_cache = IfcModelCache(IFC_CACHE_MAX_BYTES)
+register_worker_stats("ifc_models", model_cache.stats)
+
+# Invalidation generations, maintained in each API process (not shared between them)
+_generations: Dict[Tuple[str, str], int] = {}
+
+
+def current_generation(bucket_name: str, file_path: str) -> int:
+    return _generations.get((bucket_name, file_path), 0)
+
+
+def invalidate_model(bucket_name: str, file_path: str):
+    """Mark cached models of this path as stale (called once an upload has completed)."""
+    key = (bucket_name, file_path)
+    _generations[key] = _generations.get(key, 0) + 1
+    model_cache.invalidate(key)
+
+
+def get_model(bucket_name: str, file_path: str, generation: int = 0) -> "ifcopenshell.file":
+    """Return the parsed model for a storage object, from cache when possible (see get_entry)."""
+    return get_entry(bucket_name, file_path, generation).model
+
+
+def get_entry(bucket_name: str, file_path: str, generation: int = 0, info: Optional[ObjectInfo] = None) -> CacheEntry:
+    """
+    Return the cache entry (parsed model and its version) for a storage object.
+    A cached entry is trusted without any network call while its generation is
+    current and it was validated recently; otherwise its version is checked
+    with a HEAD request and the object is only re-downloaded if it changed.
+    A caller that already has the object's current version info passes it as
+    `info`; the entry is then checked against it instead.
+    """
+    key = (bucket_name, file_path)
+    entry = model_cache.get(key)
+
+    if entry is not None:
+        fresh = time.time() - entry.validated_at < IFC_CACHE_REVALIDATE_SECONDS
+        if info is None and entry.generation == generation and fresh:
+            model_cache.hits += 1
+            return entry
+        if info is None:
+            info = stat_object(bucket_name, file_path)
+        if info.version is not None and info.version == entry.version:
+            entry.generation = generation
+            entry.validated_at = time.time()
+            model_cache.hits += 1
+            return entry
+
+    model_cache.misses += 1
+    model, info = open_stored_ifc(bucket_name, file_path, info)
+    entry = CacheEntry(model, info.version, info.size or 0, generation, info.sha256)
+    model_cache.put(key, entry)
+    return entry
@@ -0,0 +1,81 @@
+"""
+Element index API router.
+Triggers ingest jobs and answers filter/count queries from the precomputed
+element index of a project's model, without opening the IFC.
+"""
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Depends, Query, status
+from auth import get_current_user
+from jobs import job_manager
+from element_index import open_index, submit_ingest
+from routers.projects import get_project_file_path
+
+router = APIRouter(prefix="/projects", tags=["elements"])
+
+BUCKET = "bim-files"
+GROUP_BY_FIELDS = ("type", "storey", "material")
+
+@router.post("/{project_id}/ingest", status_code=status.HTTP_202_ACCEPTED)
+def ingest_project(project_id: str, file_path: str = Depends(get_project_file_path), user: dict = Depends(get_current_user)):
+    """(Re)build the element index of a project's model as a background job."""
+    job = submit_ingest(user["id"], BUCKET, file_path)
+    return {"job_id": job.id, "status": job.status}
+
+@router.get("/{project_id}/ingest/{job_id}")
+def get_ingest_job(project_id: str, job_id: str, user: dict = Depends(get_current_user)):
+    """Status of an ingest job."""
+    return job_manager.get(job_id, user["id"]).to_dict()
+
+@router.get("/{project_id}/elements")
+def query_elements(
+    project_id: str,
+    ifc_type: Optional[List[str]] = Query(None),
+    storey: Optional[List[str]] = Query(None),
+    material: Optional[List[str]] = Query(None),
+    name_prefix: Optional[str] = None,
+    global_id: Optional[List[str]] = Query(None),
+    bbox: Optional[str] = Query(None, description="minx,miny,minz,maxx,maxy,maxz"),
+    group_by: Optional[str] = None,
+    count_only: bool = False,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    file_path: str = Depends(get_project_file_path),
+):
+    """
+    Filter and count the elements of a project's model.
+    Filters are ANDed; repeated parameters (e.g. ?ifc_type=IfcWall&ifc_type=IfcDoor) are ORed.
+    """
+    if group_by is not None and group_by not in GROUP_BY_FIELDS:
+        raise HTTPException(status_code=400, detail=f"Invalid group_by. Must be one of {', '.join(GROUP_BY_FIELDS)}")
+
+    box = None
+    if bbox:
+        try:
+            box = [float(value) for value in bbox.split(",")]
+        except ValueError:
+            box = []
+        if len(box) != 6:
+            raise HTTPException(status_code=400, detail="bbox must be six comma-separated numbers")
+
+    try:
+        index = open_index(BUCKET, file_path)
+    except Exception as e:
+        import traceback
+        print(f"Error opening element index: {e}")
+        print(traceback.format_exc())
+        raise HTTPException(status_code=404, detail="Element index not available. Run POST /projects/{project_id}/ingest first.")
+
+    mask = index.filter(
+        ifc_types=ifc_type,
+        storeys=storey,
+        materials=material,
+        name_prefix=name_prefix,
+        global_ids=global_id,
+        bbox=box,
+    )
+    response = {"total": int(mask.sum())}
+    if group_by:
+        response["groups"] = index.group_counts(mask, group_by)
+    if not count_only:
+        response["elements"] = index.rows(mask, offset, limit)
+    return response
@@ -2,12 +2,19 @@
 Projects API router with permission management.
 Handles CRUD operations for projects with user/team/company ownership and sharing.
 """
-from typing import List, Optional
-from fastapi import APIRouter, HTTPException, Depends, status
+import os
+import json
+import asyncio
+import base64
+import uuid
+from typing import Any, Dict, List, Optional
+from fastapi import APIRouter, HTTPException, Depends, Query, status
 from pydantic import BaseModel
-from datetime import datetime
+from datetime import datetime, timezone
 from auth import get_current_user
-from supabase_client import supabase
+import data_access as db
+from element_index import submit_background_ingest
+from fragments import submit_background_conversion
 
 router = APIRouter(prefix="/projects", tags=["projects"])
 
@@ -35,6 +42,20 @@ class ProjectShare(BaseModel):
     permission: str = "read"  # "read", "write", "admin"
     expires_at: Optional[datetime] = None
 
+class BulkProjectCreate(BaseModel):
+    projects: List[ProjectCreate]
+
+class ShareTarget(BaseModel):
+    share_with_type: str  # "user", "team", or "company"
+    share_with_id: str  # UUID
+
+class BulkProjectShare(BaseModel):
+    # Every project is shared with every target
+    project_ids: List[str]
+    targets: List[ShareTarget]
+    permission: str = "read"  # "read", "write", "admin"
+    expires_at: Optional[datetime] = None
+
 class ProjectResponse(BaseModel):
     id: str
     name: str
@@ -49,6 +70,82 @@ class ProjectResponse(BaseModel):
     created_at: datetime
     updated_at: datetime
     tags: Optional[List[str]]
+    permission: Optional[str] = None  # caller's permission: "read", "write", "admin" or "owner"
+
+class ProjectPage(BaseModel):
+    projects: List[Dict[str, Any]]
+    next_cursor: Optional[str] = None  # pass as ?cursor= for the next page; None on the last page
+
+# Permissions in project_access that allow editing a project
+WRITE_PERMISSIONS = ("write", "admin", "owner")
+
+# GET /projects page size (default and maximum)
+PROJECTS_PAGE_SIZE = int(os.environ.get("PROJECTS_PAGE_SIZE", "50"))
+PROJECTS_PAGE_MAX = int(os.environ.get("PROJECTS_PAGE_MAX", "500"))
+# Columns selectable with ?fields=; id and updated_at are always returned (the cursor needs them)
+PROJECT_FIELDS = [name for name in ProjectResponse.model_fields if name != "permission"]
+OWNER_COLUMNS = {"user": "owner_user_id", "team": "owner_team_id", "company": "owner_company_id"}
+SHARE_COLUMNS = {"user": "shared_with_user_id", "team": "shared_with_team_id", "company": "shared_with_company_id"}
+SHARE_PERMISSIONS = ("read", "write", "admin")
+# Items (projects, or project x target pairs) accepted by one bulk request
+PROJECTS_BULK_MAX = int(os.environ.get("PROJECTS_BULK_MAX", "5000"))
+
+def _same_expiry(stored: Optional[str], requested: Optional[datetime]) -> bool:
+    """Whether a share's stored expires_at is the requested one (naive datetimes are UTC, as in the database)."""
+    if stored is None or requested is None:
+        return stored is None and requested is None
+    if requested.tzinfo is None:
+        requested = requested.replace(tzinfo=timezone.utc)
+    return datetime.fromisoformat(stored) == requested
+
+def _encode_cursor(project: dict) -> str:
+    raw = json.dumps([project["updated_at"], project["id"]], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> tuple:
+    """
+    (updated_at, id) of a cursor, re-serialised from a parsed timestamp and
+    UUID: they end up in a PostgREST filter, so nothing else may pass through.
+    """
+    try:
+        updated_at, project_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(updated_at, str) or not isinstance(project_id, str):
+            raise ValueError("cursor values must be strings")
+        return datetime.fromisoformat(updated_at).isoformat(timespec="microseconds"), str(uuid.UUID(project_id))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _select_columns(fields: Optional[str]) -> str:
+    if not fields:
+        return ",".join(PROJECT_FIELDS)
+    requested = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in requested if name not in PROJECT_FIELDS and name != "permission"]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(PROJECT_FIELDS)}")
+    columns = ["id", "updated_at"] + [name for name in requested if name not in ("id", "updated_at", "permission")]
+    return ",".join(dict.fromkeys(columns))
+
+async def get_project_file_path(project_id: str, user: dict = Depends(get_current_user)) -> str:
+    """
+    Storage path (in the bim-files bucket) of a project's model file.
+    Dependency for the element, ingest and spatial endpoints: resolves the project
+    through the caller's project_access rows, so a project the caller cannot read
+    is a 404 like one that does not exist.
+    """
+    project = await db.get_project(project_id, user["id"])
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    return project["file_path"]
+
+def _precompute(file_path: str) -> bool:
+    """
+    Queue the element index and viewer geometry of a new project's file as
+    background jobs (not counted against the user's job limit). Returns False
+    if the ingest was deferred until earlier background jobs finish.
+    """
+    queued = submit_background_ingest("bim-files", file_path) is not None
+    submit_background_conversion("bim-files", file_path)
+    return queued
 
 @router.post("", response_model=ProjectResponse, status_code=status.HTTP_201_CREATED)
 async def create_project(project: ProjectCreate, user: dict = Depends(get_current_user)):
@@ -71,26 +168,28 @@ async def create_project(project: ProjectCreate, user: dict = Depends(get_curren
             project_data["owner_user_id"] = user["id"]
         elif project.owner_type == "team":
             # Verify user is member/admin of the team
-            team_check = supabase.table("team_members").select("*").eq("team_id", project.owner_id).eq("user_id", user["id"]).single().execute()
-            if not team_check.data:
+            if not await db.is_team_member(project.owner_id, user["id"]):
                 raise HTTPException(status_code=403, detail="You are not a member of this team")
             project_data["owner_team_id"] = project.owner_id
         elif project.owner_type == "company":
             # Verify user is member/admin of the company
-            company_check = supabase.table("company_members").select("*").eq("company_id", project.owner_id).eq("user_id", user["id"]).single().execute()
-            if not company_check.data:
+            if not await db.is_company_member(project.owner_id, user["id"]):
                 raise HTTPException(status_code=403, detail="You are not a member of this company")
             project_data["owner_company_id"] = project.owner_id
         else:
             raise HTTPException(status_code=400, detail="Invalid owner_type. Must be 'user', 'team', or 'company'")
         
         # Insert project
-        result = supabase.table("projects").insert(project_data).execute()
+        created = await db.insert_project(project_data)
         
-        if not result.data or len(result.data) == 0:
+        if not created:
             raise HTTPException(status_code=500, detail="Failed to create project")
         
-        return ProjectResponse(**result.data[0])
+        # Precompute the element index and viewer geometry in the background;
+        # the project is usable without them
+        _precompute(project.file_path)
+        
+        return ProjectResponse(**created)
     
     except HTTPException:
         raise
@@ -100,23 +199,121 @@ async def create_project(project: ProjectCreate, user: dict = Depends(get_curren
         print(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Error creating project: {str(e)}")
 
-@router.get("", response_model=List[ProjectResponse])
-async def list_projects(user: dict = Depends(get_current_user)):
+@router.post("/bulk")
+async def create_projects(request: BulkProjectCreate, user: dict = Depends(get_current_user)):
+    """
+    Create many projects in one call.
+    Team and company memberships are checked with one query per owner type and
+    the accepted projects are inserted with one bulk insert. Returns a result per
+    item, in request order: {"index", "status_code", "project" | "detail"}.
     """
-    List all projects the user has access to.
+    try:
+        items = request.projects
+        if len(items) > PROJECTS_BULK_MAX:
+            raise HTTPException(status_code=413, detail=f"At most {PROJECTS_BULK_MAX} projects per request")
+        
+        team_ids = {item.owner_id for item in items if item.owner_type == "team" and item.owner_id}
+        company_ids = {item.owner_id for item in items if item.owner_type == "company" and item.owner_id}
+        teams, companies = await asyncio.gather(
+            db.team_memberships(user["id"], team_ids),
+            db.company_memberships(user["id"], company_ids),
+        )
+        
+        results: List[Optional[dict]] = [None] * len(items)
+        accepted = []
+        rows = []
+        for index, item in enumerate(items):
+            row = {
+                "name": item.name,
+                "description": item.description,
+                "file_path": item.file_path,
+                "file_name": item.file_name,
+                "file_size": item.file_size,
+                "file_type": item.file_type,
+                "tags": item.tags or [],
+                "settings": {}
+            }
+            if item.owner_type == "user":
+                row["owner_user_id"] = user["id"]
+            elif item.owner_type == "team" and item.owner_id in teams:
+                row["owner_team_id"] = item.owner_id
+            elif item.owner_type == "company" and item.owner_id in companies:
+                row["owner_company_id"] = item.owner_id
+            elif item.owner_type in ("team", "company"):
+                results[index] = {"index": index, "status_code": 403, "detail": f"You are not a member of this {item.owner_type}"}
+                continue
+            else:
+                results[index] = {"index": index, "status_code": 400, "detail": "Invalid owner_type. Must be 'user', 'team', or 'company'"}
+                continue
+            accepted.append(index)
+            rows.append(row)
+        
+        created = await db.insert_projects(rows)
+        if len(created) != len(rows):
+            raise HTTPException(status_code=500, detail="Failed to create projects")
+        for index, project in zip(accepted, created):
+            results[index] = {"index": index, "status_code": 201, "project": ProjectResponse(**project)}
+        
+        # Background ingest as in create_project; what exceeds the background
+        # job limit is deferred and runs as earlier jobs finish
+        queued = sum(_precompute(project["file_path"]) for project in created)
+        
+        return {
+            "created": len(created),
+            "failed": len(items) - len(created),
+            "ingest_queued": queued,
+            "ingest_deferred": len(created) - queued,
+            "results": results,
+        }
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        import traceback
+        print(f"Error creating projects: {e}")
+        print(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=f"Error creating projects: {str(e)}")
+
+@router.get("", response_model=ProjectPage)
+async def list_projects(
+    limit: int = Query(PROJECTS_PAGE_SIZE, ge=1, le=PROJECTS_PAGE_MAX),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return (default: all)"),
+    tag: Optional[List[str]] = Query(None, description="Only projects carrying all of these tags"),
+    owner_type: Optional[str] = Query(None, description="'user', 'team' or 'company'"),
+    name_prefix: Optional[str] = Query(None, description="Case-insensitive name prefix"),
+    user: dict = Depends(get_current_user),
+):
+    """
+    List the projects the user has access to, newest first, one page at a time.
     This includes projects owned by the user, their teams, their companies, or shared with them.
+    Pages are keyed on (updated_at, id), so every page costs the same however deep it is.
     """
     try:
-        # The RLS policies in the database handle filtering
-        # We just query and the database returns only accessible projects
-        result = supabase.table("projects").select("*").order("updated_at", desc=True).execute()
+        if owner_type is not None and owner_type not in OWNER_COLUMNS:
+            raise HTTPException(status_code=400, detail="Invalid owner_type. Must be 'user', 'team', or 'company'")
+        
+        # project_access holds one row per (user, project, permission), maintained by
+        # triggers on ownership, memberships and shares, so this is an indexed lookup
+        rows = await db.list_projects(
+            user["id"],
+            limit + 1,
+            columns=_select_columns(fields),
+            after=_decode_cursor(cursor) if cursor else None,
+            tags=tag,
+            owner_column=OWNER_COLUMNS.get(owner_type),
+            name_prefix=name_prefix,
+        )
         
-        projects = []
-        for project in result.data:
-            projects.append(ProjectResponse(**project))
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = _encode_cursor(rows[-1])
         
-        return projects
+        return {"projects": rows, "next_cursor": next_cursor}
     
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         print(f"Error listing projects: {e}")
@@ -127,13 +324,13 @@ async def list_projects(user: dict = Depends(get_current_user)):
 async def get_project(project_id: str, user: dict = Depends(get_current_user)):
     """Get a specific project (only if user has access)."""
     try:
-        result = supabase.table("projects").select("*").eq("id", project_id).single().execute()
+        # Only returned if the user has an unexpired project_access row
+        project = await db.get_project(project_id, user["id"])
         
-        if not result.data:
+        if not project:
             raise HTTPException(status_code=404, detail="Project not found")
         
-        # RLS ensures user can only access projects they have permission for
-        return ProjectResponse(**result.data)
+        return ProjectResponse(**project)
     
     except HTTPException:
         raise
@@ -147,6 +344,10 @@ async def get_project(project_id: str, user: dict = Depends(get_current_user)):
 async def update_project(project_id: str, project: ProjectUpdate, user: dict = Depends(get_current_user)):
     """Update a project (only if user has write/admin access)."""
     try:
+        permission = await db.get_project_permission(project_id, user["id"])
+        if permission not in WRITE_PERMISSIONS:
+            raise HTTPException(status_code=404, detail="Project not found or access denied")
+        
         # Build update data (only include provided fields)
         update_data = {}
         if project.name is not None:
@@ -158,18 +359,17 @@ async def update_project(project_id: str, project: ProjectUpdate, user: dict = D
         
         if not update_data:
             # No fields to update
-            result = supabase.table("projects").select("*").eq("id", project_id).single().execute()
-            if not result.data:
+            current = await db.get_project(project_id, user["id"])
+            if not current:
                 raise HTTPException(status_code=404, detail="Project not found")
-            return ProjectResponse(**result.data)
+            return ProjectResponse(**current)
         
-        # Update project (RLS ensures only authorized users can update)
-        result = supabase.table("projects").update(update_data).eq("id", project_id).execute()
+        updated = await db.update_project(project_id, update_data)
         
-        if not result.data or len(result.data) == 0:
+        if not updated:
             raise HTTPException(status_code=404, detail="Project not found or access denied")
         
-        return ProjectResponse(**result.data[0])
+        return ProjectResponse(**updated, permission=permission)
     
     except HTTPException:
         raise
@@ -183,13 +383,18 @@ async def update_project(project_id: str, project: ProjectUpdate, user: dict = D
 async def delete_project(project_id: str, user: dict = Depends(get_current_user)):
     """Delete a project (only if user is owner)."""
     try:
-        # RLS ensures only owners can delete
-        result = supabase.table("projects").delete().eq("id", project_id).execute()
+        permission = await db.get_project_permission(project_id, user["id"])
+        if permission is None:
+            raise HTTPException(status_code=404, detail="Project not found")
+        if permission != "owner":
+            raise HTTPException(status_code=403, detail="Only project owners can delete projects")
+        
+        await db.delete_project(project_id)
         
-        # Check if project was deleted (or didn't exist)
-        # Supabase returns empty array if nothing was deleted
         return None
     
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         print(f"Error deleting project: {e}")
@@ -204,9 +409,7 @@ async def share_project(project_id: str, share: ProjectShare, user: dict = Depen
     """
     try:
         # Verify user owns the project
-        project_check = supabase.table("projects").select("owner_user_id").eq("id", project_id).single().execute()
-        
-        if not project_check.data or project_check.data["owner_user_id"] != user["id"]:
+        if await db.get_project_owner(project_id) != user["id"]:
             raise HTTPException(status_code=403, detail="Only project owners can share projects")
         
         # Prepare share data
@@ -230,12 +433,12 @@ async def share_project(project_id: str, share: ProjectShare, user: dict = Depen
             raise HTTPException(status_code=400, detail="Invalid share_with_type. Must be 'user', 'team', or 'company'")
         
         # Insert share
-        result = supabase.table("project_shares").insert(share_data).execute()
+        created = await db.insert_share(share_data)
         
-        if not result.data or len(result.data) == 0:
+        if not created:
             raise HTTPException(status_code=500, detail="Failed to create share")
         
-        return {"message": "Project shared successfully", "share": result.data[0]}
+        return {"message": "Project shared successfully", "share": created}
     
     except HTTPException:
         raise
@@ -245,18 +448,105 @@ async def share_project(project_id: str, share: ProjectShare, user: dict = Depen
         print(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Error sharing project: {str(e)}")
 
+@router.post("/shares/bulk")
+async def share_projects(request: BulkProjectShare, user: dict = Depends(get_current_user)):
+    """
+    Share many projects with many users, teams or companies in one call.
+    Ownership of all projects is checked with one query and existing shares
+    are looked up with one query. New shares are inserted with one bulk insert;
+    existing shares with another permission or expiry are overwritten with one
+    bulk upsert. Returns a result per (project, target) pair:
+    {"project_id", "share_with_type", "share_with_id", "status_code", "share" | "detail"},
+    with status_code 201 for created or updated shares and 200 for shares that
+    already had the requested permission and expiry.
+    """
+    try:
+        if request.permission not in SHARE_PERMISSIONS:
+            raise HTTPException(status_code=400, detail="Invalid permission. Must be 'read', 'write', or 'admin'")
+        for target in request.targets:
+            if target.share_with_type not in SHARE_COLUMNS:
+                raise HTTPException(status_code=400, detail="Invalid share_with_type. Must be 'user', 'team', or 'company'")
+        
+        project_ids = list(dict.fromkeys(request.project_ids))
+        targets = list(dict.fromkeys((target.share_with_type, target.share_with_id) for target in request.targets))
+        if len(project_ids) * len(targets) > PROJECTS_BULK_MAX:
+            raise HTTPException(status_code=413, detail=f"At most {PROJECTS_BULK_MAX} project/target pairs per request")
+        
+        owners, existing_shares = await asyncio.gather(
+            db.get_project_owners(project_ids),
+            db.list_shares_for_projects(project_ids),
+        )
+        existing = {}
+        for share in existing_shares:
+            for share_type, column in SHARE_COLUMNS.items():
+                if share.get(column):
+                    existing[(share["project_id"], share_type, share[column])] = share
+        
+        results = []
+        pending = []
+        rows = []
+        changed = []
+        updates = []
+        for project_id in project_ids:
+            for share_type, share_id in targets:
+                result = {"project_id": project_id, "share_with_type": share_type, "share_with_id": share_id}
+                results.append(result)
+                if project_id not in owners:
+                    result.update(status_code=404, detail="Project not found")
+                elif owners[project_id] != user["id"]:
+                    result.update(status_code=403, detail="Only project owners can share projects")
+                elif (project_id, share_type, share_id) in existing:
+                    share = existing[(project_id, share_type, share_id)]
+                    if share.get("permission") == request.permission and _same_expiry(share.get("expires_at"), request.expires_at):
+                        result.update(status_code=200, share=share)
+                        continue
+                    # Same columns in every row, as one bulk upsert needs
+                    update = {column: share.get(column) for column in ("id", "project_id", *SHARE_COLUMNS.values())}
+                    update.update(
+                        permission=request.permission,
+                        shared_by_user_id=user["id"],
+                        expires_at=request.expires_at.isoformat() if request.expires_at else None,
+                    )
+                    changed.append(result)
+                    updates.append(update)
+                else:
+                    row = {
+                        "project_id": project_id,
+                        "permission": request.permission,
+                        "shared_by_user_id": user["id"],
+                        SHARE_COLUMNS[share_type]: share_id,
+                    }
+                    if request.expires_at:
+                        row["expires_at"] = request.expires_at.isoformat()
+                    pending.append(result)
+                    rows.append(row)
+        
+        created, updated = await asyncio.gather(db.insert_shares(rows), db.upsert_shares(updates))
+        if len(created) != len(rows) or len(updated) != len(updates):
+            raise HTTPException(status_code=500, detail="Failed to create shares")
+        for result, share in zip(pending + changed, created + updated):
+            result.update(status_code=201, share=share)
+        
+        return {"created": len(created), "updated": len(updated), "results": results}
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        import traceback
+        print(f"Error sharing projects: {e}")
+        print(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=f"Error sharing projects: {str(e)}")
+
 @router.delete("/{project_id}/share/{share_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def unshare_project(project_id: str, share_id: str, user: dict = Depends(get_current_user)):
     """Remove a share from a project. Only project owners can unshare."""
     try:
         # Verify user owns the project
-        project_check = supabase.table("projects").select("owner_user_id").eq("id", project_id).single().execute()
-        
-        if not project_check.data or project_check.data["owner_user_id"] != user["id"]:
+        if await db.get_project_owner(project_id) != user["id"]:
             raise HTTPException(status_code=403, detail="Only project owners can unshare projects")
         
         # Delete share
-        supabase.table("project_shares").delete().eq("id", share_id).eq("project_id", project_id).execute()
+        await db.delete_share(project_id, share_id)
         
         return None
     
@@ -273,15 +563,11 @@ async def list_project_shares(project_id: str, user: dict = Depends(get_current_
     """List all shares for a project. Only project owners can view shares."""
     try:
         # Verify user owns the project
-        project_check = supabase.table("projects").select("owner_user_id").eq("id", project_id).single().execute()
-        
-        if not project_check.data or project_check.data["owner_user_id"] != user["id"]:
+        if await db.get_project_owner(project_id) != user["id"]:
             raise HTTPException(status_code=403, detail="Only project owners can view shares")
         
         # Get shares
-        result = supabase.table("project_shares").select("*").eq("project_id", project_id).execute()
-        
-        return {"shares": result.data}
+        return {"shares": await db.list_shares(project_id)}
     
     except HTTPException:
         raise
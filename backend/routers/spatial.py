@@ -0,0 +1,122 @@
+"""
+Spatial query API router.
+Answers region, section, nearest-neighbour and ray-pick queries from the
+spatial index over the element bounding boxes of a project's model.
+"""
+from typing import List, Optional
+import numpy as np
+from fastapi import APIRouter, HTTPException, Depends, Query
+from spatial_index import open_spatial_index
+from routers.projects import get_project_file_path
+
+router = APIRouter(prefix="/projects", tags=["spatial"])
+
+BUCKET = "bim-files"
+PLANE_MODES = ("intersect", "front", "back")
+
+def _vector(text: str, length: int, name: str) -> np.ndarray:
+    try:
+        values = [float(value) for value in text.split(",")]
+    except ValueError:
+        values = []
+    if len(values) != length or not np.all(np.isfinite(values)):
+        raise HTTPException(status_code=400, detail=f"{name} must be {length} comma-separated numbers")
+    return np.array(values, dtype=np.float64)
+
+def _open(file_path: str):
+    try:
+        return open_spatial_index(BUCKET, file_path)
+    except Exception as e:
+        import traceback
+        print(f"Error opening spatial index: {e}")
+        print(traceback.format_exc())
+        raise HTTPException(status_code=404, detail="Element index not available. Run POST /projects/{project_id}/ingest first.")
+
+def _type_filter(index, rows: np.ndarray, ifc_type: Optional[List[str]]) -> np.ndarray:
+    if not ifc_type:
+        return rows
+    return rows[index.filter(ifc_types=ifc_type)[rows]]
+
+def _response(index, rows: np.ndarray, offset: int, limit: int, count_only: bool) -> dict:
+    response = {"total": int(len(rows))}
+    if not count_only:
+        response["elements"] = index.rows_at(rows[offset:offset + limit])
+    return response
+
+@router.get("/{project_id}/spatial/box")
+def query_box(
+    project_id: str,
+    bbox: str = Query(..., description="minx,miny,minz,maxx,maxy,maxz"),
+    ifc_type: Optional[List[str]] = Query(None),
+    count_only: bool = False,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    file_path: str = Depends(get_project_file_path),
+):
+    """Elements whose bounding box overlaps the given box."""
+    box = _vector(bbox, 6, "bbox")
+    index, tree = _open(file_path)
+    rows = _type_filter(index, tree.intersect_box(box[:3], box[3:]), ifc_type)
+    return _response(index, rows, offset, limit, count_only)
+
+@router.get("/{project_id}/spatial/plane")
+def query_plane(
+    project_id: str,
+    normal: str = Query(..., description="nx,ny,nz"),
+    distance: float = Query(0.0, description="d in the plane equation dot(normal, x) = d"),
+    mode: str = "intersect",
+    ifc_type: Optional[List[str]] = Query(None),
+    count_only: bool = False,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    file_path: str = Depends(get_project_file_path),
+):
+    """
+    Elements cut by a section plane ("intersect"), or on its front/back side.
+    "back" is what stays visible behind a clipping plane whose normal points at the viewer.
+    """
+    if mode not in PLANE_MODES:
+        raise HTTPException(status_code=400, detail=f"Invalid mode. Must be one of {', '.join(PLANE_MODES)}")
+    n = _vector(normal, 3, "normal")
+    length = np.linalg.norm(n)
+    if length == 0:
+        raise HTTPException(status_code=400, detail="normal must not be zero")
+    index, tree = _open(file_path)
+    rows = _type_filter(index, tree.intersect_plane(n / length, distance / length, mode), ifc_type)
+    return _response(index, rows, offset, limit, count_only)
+
+@router.get("/{project_id}/spatial/nearest")
+def query_nearest(
+    project_id: str,
+    point: str = Query(..., description="x,y,z"),
+    k: int = Query(10, ge=1, le=1000),
+    file_path: str = Depends(get_project_file_path),
+):
+    """The k elements whose bounding boxes are closest to a point (0 = point inside the box)."""
+    p = _vector(point, 3, "point")
+    index, tree = _open(file_path)
+    rows, distances = tree.nearest(p, k)
+    elements = index.rows_at(rows)
+    for element, distance in zip(elements, distances):
+        element["distance"] = float(distance)
+    return {"elements": elements}
+
+@router.get("/{project_id}/spatial/ray")
+def query_ray(
+    project_id: str,
+    origin: str = Query(..., description="x,y,z"),
+    direction: str = Query(..., description="dx,dy,dz"),
+    limit: int = Query(10, ge=1, le=1000),
+    file_path: str = Depends(get_project_file_path),
+):
+    """Elements whose bounding boxes are hit by a ray, nearest first (candidates for picking)."""
+    o = _vector(origin, 3, "origin")
+    d = _vector(direction, 3, "direction")
+    if not np.any(d):
+        raise HTTPException(status_code=400, detail="direction must not be zero")
+    index, tree = _open(file_path)
+    rows, distances = tree.ray(o, d / np.linalg.norm(d), limit)
+    elements = index.rows_at(rows)
+    for element, distance in zip(elements, distances):
+        element["distance"] = float(distance)
+    return {"elements": elements}
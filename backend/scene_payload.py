@@ -0,0 +1,83 @@
+"""
+Compact binary encoding of a scene for the EnergyPlus export, as an
+alternative to the JSON SceneModelRequest. Vectors arrive as packed float32
+columns and the marketplace properties, which most items share, are sent once
+and referenced by index, so the payload decodes straight into a PackedScene
+without building one Pydantic object per item.
+
+Layout (little-endian):
+    0   b"VXSC"
+    4   uint32 format version
+    8   uint32 header length N (JSON, space-padded to a multiple of 4)
+    12  header JSON: {"name": str, "count": n, "item_ids": [str, ...],
+                      "properties": [{...}, ...]}
+    12+N  float32 (n, 3) positions
+          float32 (n, 3) rotations (Euler XYZ, radians)
+          float32 (n, 3) scales
+          uint32  (n,)   index into item_ids
+          uint32  (n,)   index into properties
+
+instanceId is not part of the format; the export does not use it.
+"""
+import json
+import struct
+from typing import List, Tuple
+import numpy as np
+from energyplus import PackedScene, check_item_properties, item_extent
+
+SCENE_MAGIC = b"VXSC"
+SCENE_FORMAT_VERSION = 1
+SCENE_CONTENT_TYPE = "application/vnd.voxel.scene"
+
+
+def decode_scene(payload: bytes) -> Tuple[str, PackedScene]:
+    """(scene name, PackedScene) of a binary scene payload. Raises ValueError if it is malformed."""
+    if len(payload) < 12 or payload[:4] != SCENE_MAGIC:
+        raise ValueError("Not a scene payload")
+    version, header_length = struct.unpack_from("<II", payload, 4)
+    if version != SCENE_FORMAT_VERSION:
+        raise ValueError(f"Unsupported scene format version {version}")
+    try:
+        header = json.loads(payload[12:12 + header_length])
+        count = int(header["count"])
+        item_ids: List[str] = header["item_ids"]
+        properties: List[dict] = header["properties"]
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Invalid scene header: {e}") from None
+    if count < 0 or not isinstance(item_ids, list) or not isinstance(properties, list) \
+            or not all(isinstance(value, str) for value in item_ids) \
+            or not all(isinstance(value, dict) for value in properties):
+        raise ValueError("Invalid scene header")
+
+    start = 12 + header_length
+    expected = start + count * (9 * 4 + 2 * 4)
+    if len(payload) != expected:
+        raise ValueError(f"Scene payload is {len(payload)} bytes, expected {expected} for {count} items")
+    vectors = np.frombuffer(payload, dtype="<f4", count=count * 9, offset=start).astype(np.float64)
+    indices = np.frombuffer(payload, dtype="<u4", count=count * 2, offset=start + count * 36).reshape(2, count)
+    item_index, property_index = indices
+    if count and (item_index.max() >= len(item_ids) or property_index.max() >= len(properties)):
+        raise ValueError("Scene payload references a missing item id or properties entry")
+
+    # Per-entry values, then one gather per column
+    try:
+        extents = np.array([item_extent(props) for props in properties], dtype=np.float64).reshape(-1, 3)
+        ifc_types = [props.get("ifc_type", "") for props in properties]
+        physics = [props.get("physics", {}) for props in properties]
+        check_item_properties(ifc_types, physics)
+    except ValueError as e:
+        raise ValueError(f"Invalid scene properties: {e}") from None
+    item_rows = item_index.tolist()
+    property_rows = property_index.tolist()
+
+    positions, rotations, scales = vectors.reshape(3, count, 3)
+    scene = PackedScene(
+        item_ids=[item_ids[row] for row in item_rows],
+        ifc_types=[ifc_types[row] for row in property_rows],
+        physics=[physics[row] for row in property_rows],
+        positions=positions,
+        rotations=rotations,
+        scales=scales,
+        extents=extents[property_index],
+    )
+    return str(header.get("name", "Untitled Model")), scene
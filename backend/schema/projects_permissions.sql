@@ -127,6 +127,11 @@ CREATE INDEX IF NOT EXISTS idx_company_members_user_id ON company_members(user_i
 CREATE INDEX IF NOT EXISTS idx_projects_owner_user_id ON projects(owner_user_id);
 CREATE INDEX IF NOT EXISTS idx_projects_owner_team_id ON projects(owner_team_id);
 CREATE INDEX IF NOT EXISTS idx_projects_owner_company_id ON projects(owner_company_id);
+-- GET /projects: keyset pagination on (updated_at, id), tag containment, ILIKE name prefix
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS idx_projects_updated_at_id ON projects(updated_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_projects_tags ON projects USING GIN (tags);
+CREATE INDEX IF NOT EXISTS idx_projects_name_trgm ON projects USING GIN (name gin_trgm_ops);
 CREATE INDEX IF NOT EXISTS idx_project_shares_project_id ON project_shares(project_id);
 CREATE INDEX IF NOT EXISTS idx_project_shares_user_id ON project_shares(shared_with_user_id);
 CREATE INDEX IF NOT EXISTS idx_project_shares_team_id ON project_shares(shared_with_team_id);
@@ -149,6 +154,202 @@ CREATE TRIGGER update_projects_updated_at
     FOR EACH ROW
     EXECUTE FUNCTION update_updated_at_column();
 
+-- Project Access Table (maintained by triggers, read by the project policies and /projects)
+CREATE TABLE IF NOT EXISTS project_access (
+    user_id UUID REFERENCES auth.users(id) ON DELETE CASCADE NOT NULL,
+    project_id UUID REFERENCES projects(id) ON DELETE CASCADE NOT NULL,
+    permission TEXT NOT NULL, -- 'read', 'write', 'admin', 'owner'
+    expires_at TIMESTAMP WITH TIME ZONE, -- NULL = does not expire
+
+    PRIMARY KEY (user_id, project_id, permission)
+);
+
+CREATE INDEX IF NOT EXISTS idx_project_access_project_id ON project_access(project_id);
+CREATE INDEX IF NOT EXISTS idx_project_access_expires_at ON project_access(expires_at) WHERE expires_at IS NOT NULL;
+
+-- Every grant a user has on a project, one row per source:
+-- owners, members of the owning team/company and (unexpired) shares
+CREATE OR REPLACE VIEW project_access_grants AS
+    SELECT p.owner_user_id AS user_id, p.id AS project_id, 'owner'::TEXT AS permission, NULL::TIMESTAMP WITH TIME ZONE AS expires_at
+    FROM projects p
+    WHERE p.owner_user_id IS NOT NULL
+    UNION ALL
+    SELECT t.owner_id, p.id, 'owner', NULL
+    FROM projects p JOIN teams t ON t.id = p.owner_team_id
+    UNION ALL
+    SELECT c.owner_id, p.id, 'owner', NULL
+    FROM projects p JOIN companies c ON c.id = p.owner_company_id
+    UNION ALL
+    SELECT tm.user_id, p.id, CASE WHEN tm.role IN ('owner', 'admin') THEN 'admin' ELSE 'read' END, NULL
+    FROM projects p JOIN team_members tm ON tm.team_id = p.owner_team_id
+    UNION ALL
+    SELECT cm.user_id, p.id, CASE WHEN cm.role IN ('owner', 'admin') THEN 'admin' ELSE 'read' END, NULL
+    FROM projects p JOIN company_members cm ON cm.company_id = p.owner_company_id
+    UNION ALL
+    SELECT ps.shared_with_user_id, ps.project_id, COALESCE(ps.permission, 'read'), ps.expires_at
+    FROM project_shares ps
+    WHERE ps.shared_with_user_id IS NOT NULL
+    AND (ps.expires_at IS NULL OR ps.expires_at > NOW())
+    UNION ALL
+    SELECT tm.user_id, ps.project_id, COALESCE(ps.permission, 'read'), ps.expires_at
+    FROM project_shares ps JOIN team_members tm ON tm.team_id = ps.shared_with_team_id
+    WHERE ps.expires_at IS NULL OR ps.expires_at > NOW()
+    UNION ALL
+    SELECT cm.user_id, ps.project_id, COALESCE(ps.permission, 'read'), ps.expires_at
+    FROM project_shares ps JOIN company_members cm ON cm.company_id = ps.shared_with_company_id
+    WHERE ps.expires_at IS NULL OR ps.expires_at > NOW();
+
+-- The view reads across all users' memberships; only the trigger functions below use it
+REVOKE ALL ON project_access_grants FROM anon, authenticated;
+
+-- Rebuild the access rows of one project (ownership or share changes)
+CREATE OR REPLACE FUNCTION refresh_project_access_for_project(project_uuid UUID)
+RETURNS VOID AS $$
+BEGIN
+    DELETE FROM project_access WHERE project_id = project_uuid;
+    INSERT INTO project_access (user_id, project_id, permission, expires_at)
+    SELECT g.user_id, g.project_id, g.permission,
+           CASE WHEN bool_or(g.expires_at IS NULL) THEN NULL ELSE MAX(g.expires_at) END
+    FROM project_access_grants g
+    WHERE g.project_id = project_uuid
+    GROUP BY g.user_id, g.project_id, g.permission
+    -- Concurrent refreshes (e.g. a share and a membership change at once) may both insert a row
+    ON CONFLICT (user_id, project_id, permission) DO UPDATE SET expires_at = EXCLUDED.expires_at;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- Rebuild the access rows of one user (membership or team/company ownership changes)
+CREATE OR REPLACE FUNCTION refresh_project_access_for_user(user_uuid UUID)
+RETURNS VOID AS $$
+BEGIN
+    DELETE FROM project_access WHERE user_id = user_uuid;
+    INSERT INTO project_access (user_id, project_id, permission, expires_at)
+    SELECT g.user_id, g.project_id, g.permission,
+           CASE WHEN bool_or(g.expires_at IS NULL) THEN NULL ELSE MAX(g.expires_at) END
+    FROM project_access_grants g
+    WHERE g.user_id = user_uuid
+    GROUP BY g.user_id, g.project_id, g.permission
+    -- Concurrent refreshes (e.g. a share and a membership change at once) may both insert a row
+    ON CONFLICT (user_id, project_id, permission) DO UPDATE SET expires_at = EXCLUDED.expires_at;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- Drop rows whose share has expired. Reads already ignore them; this keeps the table small.
+-- With pg_cron enabled:
+--   SELECT cron.schedule('purge-expired-project-access', '*/15 * * * *', 'SELECT purge_expired_project_access()');
+CREATE OR REPLACE FUNCTION purge_expired_project_access()
+RETURNS INTEGER AS $$
+DECLARE
+    purged INTEGER;
+BEGIN
+    DELETE FROM project_access WHERE expires_at IS NOT NULL AND expires_at <= NOW();
+    GET DIAGNOSTICS purged = ROW_COUNT;
+    RETURN purged;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- Triggers
+CREATE OR REPLACE FUNCTION project_access_on_project_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM refresh_project_access_for_project(NEW.id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- Share changes refresh each touched project once per statement (bulk shares)
+CREATE OR REPLACE FUNCTION project_access_on_shares_change()
+RETURNS TRIGGER AS $$
+DECLARE
+    project_uuid UUID;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        FOR project_uuid IN SELECT DISTINCT project_id FROM new_shares LOOP
+            PERFORM refresh_project_access_for_project(project_uuid);
+        END LOOP;
+    ELSIF TG_OP = 'DELETE' THEN
+        FOR project_uuid IN SELECT DISTINCT project_id FROM old_shares LOOP
+            PERFORM refresh_project_access_for_project(project_uuid);
+        END LOOP;
+    ELSE
+        FOR project_uuid IN SELECT project_id FROM old_shares UNION SELECT project_id FROM new_shares LOOP
+            PERFORM refresh_project_access_for_project(project_uuid);
+        END LOOP;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+CREATE OR REPLACE FUNCTION project_access_on_member_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM refresh_project_access_for_user(OLD.user_id);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND (TG_OP = 'INSERT' OR NEW.user_id IS DISTINCT FROM OLD.user_id) THEN
+        PERFORM refresh_project_access_for_user(NEW.user_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+CREATE OR REPLACE FUNCTION project_access_on_owner_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM refresh_project_access_for_user(OLD.owner_id);
+    IF NEW.owner_id IS DISTINCT FROM OLD.owner_id THEN
+        PERFORM refresh_project_access_for_user(NEW.owner_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- Deleted projects, users, teams and companies cascade into project_access
+-- (directly or through the memberships and shares they remove)
+CREATE TRIGGER project_access_projects
+    AFTER INSERT OR UPDATE OF owner_user_id, owner_team_id, owner_company_id ON projects
+    FOR EACH ROW
+    EXECUTE FUNCTION project_access_on_project_change();
+
+-- Transition tables allow only one event per trigger
+CREATE TRIGGER project_access_project_shares_insert
+    AFTER INSERT ON project_shares
+    REFERENCING NEW TABLE AS new_shares
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION project_access_on_shares_change();
+
+CREATE TRIGGER project_access_project_shares_update
+    AFTER UPDATE ON project_shares
+    REFERENCING OLD TABLE AS old_shares NEW TABLE AS new_shares
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION project_access_on_shares_change();
+
+CREATE TRIGGER project_access_project_shares_delete
+    AFTER DELETE ON project_shares
+    REFERENCING OLD TABLE AS old_shares
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION project_access_on_shares_change();
+
+CREATE TRIGGER project_access_team_members
+    AFTER INSERT OR UPDATE OF user_id, team_id, role OR DELETE ON team_members
+    FOR EACH ROW
+    EXECUTE FUNCTION project_access_on_member_change();
+
+CREATE TRIGGER project_access_company_members
+    AFTER INSERT OR UPDATE OF user_id, company_id, role OR DELETE ON company_members
+    FOR EACH ROW
+    EXECUTE FUNCTION project_access_on_member_change();
+
+CREATE TRIGGER project_access_teams
+    AFTER UPDATE OF owner_id ON teams
+    FOR EACH ROW
+    EXECUTE FUNCTION project_access_on_owner_change();
+
+CREATE TRIGGER project_access_companies
+    AFTER UPDATE OF owner_id ON companies
+    FOR EACH ROW
+    EXECUTE FUNCTION project_access_on_owner_change();
+
 -- Row Level Security (RLS)
 
 -- Companies
@@ -231,41 +432,17 @@ CREATE POLICY "Company owners can manage members"
 -- Projects
 ALTER TABLE projects ENABLE ROW LEVEL SECURITY;
 
--- Helper function to check if user has access to a project
-CREATE OR REPLACE FUNCTION user_has_project_access(project_uuid UUID)
+-- Helper function to check if user has access to a project (optionally with one of the given permissions)
+CREATE OR REPLACE FUNCTION user_has_project_access(project_uuid UUID, permissions TEXT[] DEFAULT NULL)
 RETURNS BOOLEAN AS $$
-BEGIN
-    RETURN EXISTS (
-        SELECT 1 FROM projects p
-        WHERE p.id = project_uuid
-        AND (
-            -- User is owner (directly, via team, or via company)
-            p.owner_user_id = auth.uid() OR
-            (p.owner_team_id IS NOT NULL AND p.owner_team_id IN (
-                SELECT team_id FROM team_members WHERE user_id = auth.uid()
-            )) OR
-            (p.owner_company_id IS NOT NULL AND p.owner_company_id IN (
-                SELECT company_id FROM company_members WHERE user_id = auth.uid()
-            )) OR
-            -- User has explicit share
-            EXISTS (
-                SELECT 1 FROM project_shares ps
-                WHERE ps.project_id = p.id
-                AND (
-                    ps.shared_with_user_id = auth.uid() OR
-                    (ps.shared_with_team_id IS NOT NULL AND ps.shared_with_team_id IN (
-                        SELECT team_id FROM team_members WHERE user_id = auth.uid()
-                    )) OR
-                    (ps.shared_with_company_id IS NOT NULL AND ps.shared_with_company_id IN (
-                        SELECT company_id FROM company_members WHERE user_id = auth.uid()
-                    ))
-                )
-                AND (ps.expires_at IS NULL OR ps.expires_at > NOW())
-            )
-        )
+    SELECT EXISTS (
+        SELECT 1 FROM project_access a
+        WHERE a.user_id = auth.uid()
+        AND a.project_id = project_uuid
+        AND (permissions IS NULL OR a.permission = ANY(permissions))
+        AND (a.expires_at IS NULL OR a.expires_at > NOW())
     );
-END;
-$$ LANGUAGE plpgsql SECURITY DEFINER;
+$$ LANGUAGE sql STABLE SECURITY DEFINER SET search_path = public;
 
 CREATE POLICY "Users can view projects they own or have access to"
     ON projects FOR SELECT
@@ -285,27 +462,11 @@ CREATE POLICY "Users can create projects"
 
 CREATE POLICY "Project owners and admins can update projects"
     ON projects FOR UPDATE
-    USING (
-        owner_user_id = auth.uid() OR
-        (owner_team_id IS NOT NULL AND owner_team_id IN (
-            SELECT team_id FROM team_members WHERE user_id = auth.uid() AND role IN ('owner', 'admin')
-        )) OR
-        (owner_company_id IS NOT NULL AND owner_company_id IN (
-            SELECT company_id FROM company_members WHERE user_id = auth.uid() AND role IN ('owner', 'admin')
-        ))
-    );
+    USING (user_has_project_access(id, ARRAY['write', 'admin', 'owner']));
 
 CREATE POLICY "Project owners can delete projects"
     ON projects FOR DELETE
-    USING (
-        owner_user_id = auth.uid() OR
-        (owner_team_id IS NOT NULL AND owner_team_id IN (
-            SELECT id FROM teams WHERE owner_id = auth.uid()
-        )) OR
-        (owner_company_id IS NOT NULL AND owner_company_id IN (
-            SELECT id FROM companies WHERE owner_id = auth.uid()
-        ))
-    );
+    USING (user_has_project_access(id, ARRAY['owner']));
 
 -- Project Shares
 ALTER TABLE project_shares ENABLE ROW LEVEL SECURITY;
@@ -334,4 +495,10 @@ CREATE POLICY "Project owners can delete shares"
         )
     );
 
+-- Project Access
+ALTER TABLE project_access ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can view their own project access"
+    ON project_access FOR SELECT
+    USING (user_id = auth.uid());
 
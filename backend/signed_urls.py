@@ -0,0 +1,141 @@
+"""
+Cache of signed download URLs.
+A signed URL stays valid for its whole lifetime, so one issued for a path is
+handed out again until SIGNED_URL_MARGIN seconds before it expires instead of
+asking Storage for a new one on every request. Misses of a batch are signed
+with a single create_signed_urls call.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import data_access as db
+from supabase_client import get_supabase
+
+# Lifetime of issued download URLs, and how long before expiry the cache stops serving them
+SIGNED_URL_TTL = int(os.environ.get("SIGNED_URL_TTL", "3600"))
+SIGNED_URL_MARGIN = int(os.environ.get("SIGNED_URL_MARGIN", "300"))
+SIGNED_URL_CACHE_SIZE = int(os.environ.get("SIGNED_URL_CACHE_SIZE", "10000"))
+
+
+def read_signed_url(result) -> Optional[str]:
+    """The URL of a create_signed_url(s) response item ('signedURL' key), or None."""
+    if isinstance(result, dict):
+        return result.get('signedURL') or result.get('signedUrl')
+    return getattr(result, 'signedURL', None) or getattr(result, 'signedUrl', None)
+
+
+class SignedUrlCache:
+    """Bounded LRU of signed URLs keyed by (bucket, path), each served until its expiry minus the margin."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[Tuple[str, str], Tuple[str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.signed = 0
+        self.storage_calls = 0
+
+    def get(self, bucket: str, path: str) -> Optional[str]:
+        key = (bucket, path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= time.time():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, bucket: str, path: str, url: str, expires_in: int):
+        key = (bucket, path)
+        with self._lock:
+            self._entries[key] = (url, time.time() + expires_in - SIGNED_URL_MARGIN)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, bucket: str, path: str):
+        with self._lock:
+            self._entries.pop((bucket, path), None)
+
+    def record_call(self, signed: int):
+        with self._lock:
+            self.storage_calls += 1
+            self.signed += signed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "storage_calls": self.storage_calls,
+                "signed": self.signed,
+                "ttl_seconds": SIGNED_URL_TTL,
+                "margin_seconds": SIGNED_URL_MARGIN,
+            }
+
+
+signed_url_cache = SignedUrlCache(SIGNED_URL_CACHE_SIZE)
+
+
+async def signed_url(bucket: str, path: str) -> Optional[str]:
+    """Signed download URL of one object (cached)."""
+    url = signed_url_cache.get(bucket, path)
+    if url is None:
+        url = read_signed_url(await db.create_signed_url(bucket, path, SIGNED_URL_TTL))
+        signed_url_cache.record_call(1)
+        if url:
+            signed_url_cache.put(bucket, path, url, SIGNED_URL_TTL)
+    return url
+
+
+def signed_url_sync(bucket: str, path: str) -> Optional[str]:
+    """Sync variant for `def` endpoints."""
+    url = signed_url_cache.get(bucket, path)
+    if url is None:
+        url = read_signed_url(get_supabase().storage.from_(bucket).create_signed_url(path, SIGNED_URL_TTL))
+        signed_url_cache.record_call(1)
+        if url:
+            signed_url_cache.put(bucket, path, url, SIGNED_URL_TTL)
+    return url
+
+
+async def signed_urls(bucket: str, paths: List[str]) -> Dict[str, Dict[str, Optional[str]]]:
+    """
+    Signed download URLs of many objects: {path: {"signed_url", "error"}}.
+    Cached URLs are reused; all misses are signed with one Storage call.
+    """
+    results: Dict[str, Dict[str, Optional[str]]] = {}
+    missing = []
+    for path in dict.fromkeys(paths):
+        url = signed_url_cache.get(bucket, path)
+        if url is None:
+            missing.append(path)
+        else:
+            results[path] = {"signed_url": url, "error": None}
+
+    if missing:
+        signed = await db.create_signed_urls(bucket, missing, SIGNED_URL_TTL)
+        signed_url_cache.record_call(len(missing))
+        for item in signed:
+            path = item.get("path")
+            url = read_signed_url(item) if not item.get("error") else None
+            if url:
+                signed_url_cache.put(bucket, path, url, SIGNED_URL_TTL)
+            results[path] = {"signed_url": url, "error": item.get("error") or (None if url else "Not signed")}
+        for path in missing:
+            results.setdefault(path, {"signed_url": None, "error": "Not signed"})
+    return results
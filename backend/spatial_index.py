@@ -0,0 +1,189 @@
+"""
+Spatial index over element bounding boxes.
+Builds a packed bounding volume hierarchy (Morton-ordered leaves, fixed fan-out)
+from the element index bounding boxes, so region, section, nearest-neighbour
+and ray-pick queries never need the IFC or its geometry. Traversal is done
+one tree level at a time with vectorised NumPy box tests.
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+import numpy as np
+from element_index import ElementIndex, open_index
+
+FANOUT = 16
+SPATIAL_INDEX_CACHE_ENTRIES = int(os.environ.get("SPATIAL_INDEX_CACHE_ENTRIES", "16"))
+
+
+def _spread_bits(v: np.ndarray) -> np.ndarray:
+    """Interleave the low 21 bits of v with two zero bits each (3D Morton code)."""
+    v = v & np.uint64(0x1FFFFF)
+    v = (v | (v << np.uint64(32))) & np.uint64(0x1F00000000FFFF)
+    v = (v | (v << np.uint64(16))) & np.uint64(0x1F0000FF0000FF)
+    v = (v | (v << np.uint64(8))) & np.uint64(0x100F00F00F00F00F)
+    v = (v | (v << np.uint64(4))) & np.uint64(0x10C30C30C30C30C3)
+    v = (v | (v << np.uint64(2))) & np.uint64(0x1249249249249249)
+    return v
+
+
+def _morton_order(boxes: np.ndarray) -> np.ndarray:
+    centers = 0.5 * (boxes[:, :3] + boxes[:, 3:])
+    lo = centers.min(axis=0)
+    extent = np.maximum(centers.max(axis=0) - lo, 1e-9)
+    q = ((centers - lo) / extent * 0x1FFFFF).astype(np.uint64)
+    code = _spread_bits(q[:, 0]) | (_spread_bits(q[:, 1]) << np.uint64(1)) | (_spread_bits(q[:, 2]) << np.uint64(2))
+    return np.argsort(code, kind="stable")
+
+
+def _expand(frontier: np.ndarray, child_count: int) -> np.ndarray:
+    """Child indices of the given nodes in a packed tree with FANOUT children per node."""
+    starts = frontier * FANOUT
+    lengths = np.minimum(starts + FANOUT, child_count) - starts
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.repeat(starts, lengths) + offsets
+
+
+def _min_distance(point: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    gap = np.maximum(np.maximum(boxes[:, :3] - point, point - boxes[:, 3:]), 0.0)
+    return np.sqrt((gap * gap).sum(axis=1))
+
+
+def _max_distance(point: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    far = np.maximum(np.abs(point - boxes[:, :3]), np.abs(boxes[:, 3:] - point))
+    return np.sqrt((far * far).sum(axis=1))
+
+
+def _plane_range(normal: np.ndarray, boxes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Min and max of dot(normal, x) over each box."""
+    center = 0.5 * (boxes[:, :3] + boxes[:, 3:])
+    radius = 0.5 * (boxes[:, 3:] - boxes[:, :3]) @ np.abs(normal)
+    projected = center @ normal
+    return projected - radius, projected + radius
+
+
+def _ray_entry(origin: np.ndarray, direction: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    """Slab test: distance along the ray where it enters each box, +inf for misses."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        inverse = 1.0 / direction
+        t1 = (boxes[:, :3] - origin) * inverse
+        t2 = (boxes[:, 3:] - origin) * inverse
+    # Axis-parallel rays: inside the slab -> (-inf, inf), outside -> empty
+    parallel = direction == 0
+    inside = (origin >= boxes[:, :3]) & (origin <= boxes[:, 3:])
+    t_near = np.where(parallel, np.where(inside, -np.inf, np.inf), np.minimum(t1, t2)).max(axis=1)
+    t_far = np.where(parallel, np.where(inside, np.inf, -np.inf), np.maximum(t1, t2)).min(axis=1)
+    hit = (t_near <= t_far) & (t_far >= 0)
+    return np.where(hit, np.maximum(t_near, 0.0), np.inf)
+
+
+class SpatialIndex:
+    """Packed BVH over element AABBs. Query results are element index row numbers."""
+
+    def __init__(self, bbox: np.ndarray):
+        valid = np.flatnonzero(~np.isnan(bbox).any(axis=1))
+        boxes = np.asarray(bbox[valid], dtype=np.float64)
+        order = _morton_order(boxes) if len(boxes) else np.empty(0, dtype=np.int64)
+        self.rows = valid[order]
+
+        # levels[0] is the root, levels[-1] the element boxes themselves
+        current = boxes[order]
+        counts = np.ones(len(current), dtype=np.int64)
+        self.levels: List[np.ndarray] = [current]
+        self.counts: List[np.ndarray] = [counts]
+        while len(current) > 1:
+            starts = np.arange(0, len(current), FANOUT)
+            current = np.hstack([
+                np.minimum.reduceat(current[:, :3], starts),
+                np.maximum.reduceat(current[:, 3:], starts),
+            ])
+            counts = np.add.reduceat(counts, starts)
+            self.levels.insert(0, current)
+            self.counts.insert(0, counts)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _traverse(self, test: Callable[[np.ndarray], np.ndarray]) -> np.ndarray:
+        """Positions (in leaf order) of all items whose box passes test, pruning subtrees that fail."""
+        if not len(self.rows):
+            return np.empty(0, dtype=np.int64)
+        frontier = np.arange(len(self.levels[0]))
+        for depth, boxes in enumerate(self.levels):
+            frontier = frontier[test(boxes[frontier])]
+            if depth + 1 < len(self.levels):
+                frontier = _expand(frontier, len(self.levels[depth + 1]))
+        return frontier
+
+    def intersect_box(self, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+        """Rows whose box overlaps the query box."""
+        positions = self._traverse(
+            lambda boxes: np.all(boxes[:, :3] <= hi, axis=1) & np.all(boxes[:, 3:] >= lo, axis=1)
+        )
+        return np.sort(self.rows[positions])
+
+    def intersect_plane(self, normal: np.ndarray, offset: float, mode: str = "intersect") -> np.ndarray:
+        """
+        Rows relative to the plane dot(normal, x) = offset.
+        mode "intersect": boxes cut by the plane; "front": boxes reaching the
+        positive side; "back": boxes reaching the negative side (what a
+        clipping plane keeps).
+        """
+        def test(boxes: np.ndarray) -> np.ndarray:
+            low, high = _plane_range(normal, boxes)
+            if mode == "front":
+                return high >= offset
+            if mode == "back":
+                return low <= offset
+            return (low <= offset) & (high >= offset)
+
+        return np.sort(self.rows[self._traverse(test)])
+
+    def ray(self, origin: np.ndarray, direction: np.ndarray, limit: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Rows hit by the ray, nearest first, with their entry distances."""
+        positions = self._traverse(lambda boxes: np.isfinite(_ray_entry(origin, direction, boxes)))
+        distance = _ray_entry(origin, direction, self.levels[-1][positions])
+        order = np.argsort(distance, kind="stable")[:limit]
+        scale = np.linalg.norm(direction)
+        return self.rows[positions[order]], distance[order] * scale
+
+    def nearest(self, point: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """The k rows whose boxes are closest to point, with their distances."""
+        if not len(self.rows):
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        frontier = np.arange(len(self.levels[0]))
+        for depth, boxes in enumerate(self.levels):
+            near = _min_distance(point, boxes[frontier])
+            if depth + 1 == len(self.levels):
+                order = np.argsort(near, kind="stable")[:k]
+                return self.rows[frontier[order]], near[order]
+            # The closest nodes (by farthest corner) holding >= k items bound the answer
+            far = _max_distance(point, boxes[frontier])
+            by_far = np.argsort(far)
+            covered = np.cumsum(self.counts[depth][frontier][by_far])
+            bound = far[by_far[min(np.searchsorted(covered, k), len(by_far) - 1)]]
+            frontier = _expand(frontier[near <= bound], len(self.levels[depth + 1]))
+        return np.empty(0, dtype=np.int64), np.empty(0)
+
+
+_trees: OrderedDict[Tuple[str, str], Tuple[Optional[str], SpatialIndex]] = OrderedDict()
+_trees_lock = threading.Lock()
+
+
+def open_spatial_index(bucket_name: str, file_path: str) -> Tuple[ElementIndex, SpatialIndex]:
+    """Element index plus its spatial index, rebuilt whenever the element index version changes."""
+    index = open_index(bucket_name, file_path)
+    key = (bucket_name, file_path)
+    with _trees_lock:
+        cached = _trees.get(key)
+        if cached is not None and cached[0] == index.version:
+            _trees.move_to_end(key)
+            return index, cached[1]
+
+    tree = SpatialIndex(index.bbox)
+    with _trees_lock:
+        _trees[key] = (index.version, tree)
+        _trees.move_to_end(key)
+        while len(_trees) > SPATIAL_INDEX_CACHE_ENTRIES:
+            _trees.popitem(last=False)
+    return index, tree
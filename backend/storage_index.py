@@ -0,0 +1,168 @@
+"""
+In-memory index of a storage folder for /files/list.
+The folder is listed page by page (Storage caps a list call at `limit` rows)
+and kept as sorted views, so a read is a bisect and a slice instead of a
+Storage round trip. The index is served stale while a background task
+refreshes it; completed uploads register the uploaded name, and the index
+keeps refreshing (rate limited) until a listing taken after the upload shows it.
+"""
+import os
+import asyncio
+import bisect
+import time
+from typing import Any, Dict, List, Optional
+import data_access as db
+
+# Age after which a read triggers a background refresh
+STORAGE_INDEX_TTL = float(os.environ.get("STORAGE_INDEX_TTL", "60"))
+# Minimum time between refreshes while uploads are pending
+STORAGE_INDEX_MIN_INTERVAL = float(os.environ.get("STORAGE_INDEX_MIN_INTERVAL", "2"))
+# Rows per Storage list call
+STORAGE_INDEX_PAGE = int(os.environ.get("STORAGE_INDEX_PAGE", "1000"))
+# A completed upload that is still not listed after this long is given up on
+STORAGE_INDEX_PENDING_TTL = 2 * 3600
+
+# Sizes and timestamps can be missing; those sort first
+SORT_KEYS = {
+    "name": lambda entry: entry["name"].casefold(),
+    "size": lambda entry: (entry["size"] is not None, entry["size"] or 0),
+    "updated_at": lambda entry: entry["updated_at"] or "",
+}
+
+
+def _entry(item: dict) -> Optional[dict]:
+    """Index entry of a list() row, or None for folders and placeholder/hidden files."""
+    name = item.get("name")
+    if not name or name.startswith(".") or item.get("id") is None:
+        return None
+    metadata = item.get("metadata") or {}
+    return {
+        "name": name,
+        "size": metadata.get("size"),
+        "content_type": metadata.get("mimetype"),
+        "updated_at": item.get("updated_at") or item.get("created_at"),
+    }
+
+
+class StorageIndex:
+    """Sorted listing of one folder of a bucket, refreshed in the background."""
+
+    def __init__(self, bucket: str, folder: str):
+        self.bucket = bucket
+        self.folder = folder
+        self._by_name: List[dict] = []
+        self._folded: List[str] = []
+        self._sorted: Dict[str, List[dict]] = {key: [] for key in SORT_KEYS}
+        self._pending: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.loaded = False
+        self.refreshed_at = 0.0
+        self._started_at = 0.0
+        self.refreshes = 0
+        self.failures = 0
+        self.storage_calls = 0
+
+    async def _list_all(self) -> List[dict]:
+        items: List[dict] = []
+        offset = 0
+        while True:
+            page = await db.list_objects(self.bucket, self.folder, limit=STORAGE_INDEX_PAGE, offset=offset)
+            self.storage_calls += 1
+            items.extend(page or [])
+            if not page or len(page) < STORAGE_INDEX_PAGE:
+                return items
+            offset += len(page)
+
+    async def _refresh(self):
+        started = time.time()
+        try:
+            entries = [entry for entry in map(_entry, await self._list_all()) if entry is not None]
+        except Exception as e:
+            self.failures += 1
+            print(f"Storage index refresh of {self.bucket}/{self.folder} failed: {e}")
+            return
+        self._sorted = {sort: sorted(entries, key=key) for sort, key in SORT_KEYS.items()}
+        entries = self._sorted["name"]
+        self._by_name = entries
+        self._folded = [entry["name"].casefold() for entry in entries]
+        now = time.time()
+        names = {entry["name"] for entry in entries}
+        # Names registered while the listing ran may have been listed before their upload
+        self._pending = {
+            name: since for name, since in self._pending.items()
+            if (name not in names or since >= started) and now - since < STORAGE_INDEX_PENDING_TTL
+        }
+        self.loaded = True
+        self.refreshed_at = now
+        self.refreshes += 1
+
+    def _start_refresh(self) -> asyncio.Task:
+        if self._task is None or self._task.done():
+            self._started_at = time.time()
+            self._task = asyncio.create_task(self._refresh())
+        return self._task
+
+    def invalidate(self, name: str):
+        """A file was uploaded: refresh on the next reads (rate limited) until it is listed."""
+        self._pending[name] = time.time()
+
+    async def _ensure_fresh(self):
+        if not self.loaded:
+            # Nothing to serve yet
+            await self._start_refresh()
+            return
+        now = time.time()
+        due = bool(self._pending) or now - self.refreshed_at >= STORAGE_INDEX_TTL
+        if due and now - self._started_at >= STORAGE_INDEX_MIN_INTERVAL:
+            self._start_refresh()
+
+    def get(self, name: str) -> Optional[dict]:
+        """The entry of a file of the folder, or None if it is not (yet) indexed. Does not refresh."""
+        index = bisect.bisect_left(self._folded, name.casefold())
+        while index < len(self._by_name) and self._folded[index] == name.casefold():
+            if self._by_name[index]["name"] == name:
+                return self._by_name[index]
+            index += 1
+        return None
+
+    async def query(
+        self,
+        limit: int,
+        offset: int = 0,
+        prefix: Optional[str] = None,
+        sort: str = "name",
+        descending: bool = False,
+    ) -> Dict[str, Any]:
+        """A page of entries (optionally only names starting with prefix, case-insensitive) and the total."""
+        await self._ensure_fresh()
+        if prefix:
+            folded = prefix.casefold()
+            start = bisect.bisect_left(self._folded, folded)
+            end = bisect.bisect_left(self._folded, folded + "\U0010ffff", start)
+            matches = self._by_name[start:end]
+            if sort != "name":
+                matches = sorted(matches, key=SORT_KEYS[sort])
+        else:
+            matches = self._sorted[sort]
+        if descending:
+            end = len(matches) - offset
+            page = matches[max(end - limit, 0):end][::-1] if end > 0 else []
+        else:
+            page = matches[offset:offset + limit]
+        return {"entries": page, "total": len(matches)}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "bucket": self.bucket,
+            "folder": self.folder,
+            "entries": len(self._by_name),
+            "loaded": self.loaded,
+            "refreshed_at": self.refreshed_at or None,
+            "pending_uploads": len(self._pending),
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "storage_calls": self.storage_calls,
+        }
+
+
+bim_files_index = StorageIndex("bim-files", "public")
@@ -0,0 +1,9 @@
+-- Indexes for GET /projects
+-- Keyset pagination orders by (updated_at, id); ?tag= is an array containment
+-- filter and ?name_prefix= a case-insensitive ILIKE 'prefix%'.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_projects_updated_at_id ON projects(updated_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_projects_tags ON projects USING GIN (tags);
+CREATE INDEX IF NOT EXISTS idx_projects_name_trgm ON projects USING GIN (name gin_trgm_ops);
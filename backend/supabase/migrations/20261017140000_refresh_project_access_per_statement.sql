@@ -0,0 +1,48 @@
+-- Refresh project_access once per statement on share changes
+-- A bulk insert of shares (POST /projects/shares/bulk) touching the same
+-- project many times now rebuilds that project's access rows once, instead of
+-- once per inserted row.
+
+DROP TRIGGER IF EXISTS project_access_project_shares ON project_shares;
+DROP FUNCTION IF EXISTS project_access_on_share_change();
+
+CREATE OR REPLACE FUNCTION project_access_on_shares_change()
+RETURNS TRIGGER AS $$
+DECLARE
+    project_uuid UUID;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        FOR project_uuid IN SELECT DISTINCT project_id FROM new_shares LOOP
+            PERFORM refresh_project_access_for_project(project_uuid);
+        END LOOP;
+    ELSIF TG_OP = 'DELETE' THEN
+        FOR project_uuid IN SELECT DISTINCT project_id FROM old_shares LOOP
+            PERFORM refresh_project_access_for_project(project_uuid);
+        END LOOP;
+    ELSE
+        FOR project_uuid IN SELECT project_id FROM old_shares UNION SELECT project_id FROM new_shares LOOP
+            PERFORM refresh_project_access_for_project(project_uuid);
+        END LOOP;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- Transition tables allow only one event per trigger
+CREATE TRIGGER project_access_project_shares_insert
+    AFTER INSERT ON project_shares
+    REFERENCING NEW TABLE AS new_shares
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION project_access_on_shares_change();
+
+CREATE TRIGGER project_access_project_shares_update
+    AFTER UPDATE ON project_shares
+    REFERENCING OLD TABLE AS old_shares NEW TABLE AS new_shares
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION project_access_on_shares_change();
+
+CREATE TRIGGER project_access_project_shares_delete
+    AFTER DELETE ON project_shares
+    REFERENCING OLD TABLE AS old_shares
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION project_access_on_shares_change();
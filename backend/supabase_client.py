@@ -1,12 +1,42 @@
+"""
+The synchronous Supabase client (REST and Storage) for code on the threadpool
+and in job workers. Created by the app's lifespan at startup, or on first use
+in processes without one, so importing this module does not load the
+supabase package.
+"""
 import os
+import threading
+from typing import TYPE_CHECKING, Optional
+import httpx
 from dotenv import load_dotenv
-from supabase import create_client, Client
+import metrics
+
+if TYPE_CHECKING:
+    from supabase import Client
 
 load_dotenv()
 
 url: str = os.environ.get("SUPABASE_URL")
 key: str = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
 
+_client: Optional["Client"] = None
+_lock = threading.Lock()
+
+
+def get_supabase() -> "Client":
+    """The process-wide sync Supabase client (created on first use)."""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                from supabase import create_client
+                from supabase.lib.client_options import SyncClientOptions
+
+                # One client for REST and Storage so every call is timed (see metrics.py)
+                http_client = httpx.Client(timeout=httpx.Timeout(120.0, connect=10.0), event_hooks=metrics.SUPABASE_EVENT_HOOKS)
+                _client = create_client(url, key, SyncClientOptions(httpx_client=http_client))
+    return _client
 
 
+def client_ready() -> bool:
+    return _client is not None
@@ -0,0 +1,205 @@
+"""AdmissionController accounting: admission, queueing, shedding, timeouts and rate limits."""
+import asyncio
+import pytest
+from fastapi import HTTPException
+from admission import AdmissionController
+
+ROUTE = "/heavy"
+OTHER = "/other"
+
+
+def controller(**options) -> AdmissionController:
+    settings = dict(memory_mb=100, max_concurrent=2, max_queue=4, max_wait_seconds=1.0, user_rate=0, user_burst=1)
+    settings.update(options)
+    return AdmissionController(**settings)
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def assert_idle(admission: AdmissionController):
+    stats = admission.stats()
+    assert stats["in_flight"] == 0 and stats["queued"] == 0 and stats["reserved_mb"] == 0
+
+
+def test_admits_within_budget_and_queues_beyond():
+    async def scenario():
+        admission = controller()
+        first = await admission.acquire(ROUTE, "a", 10)
+        second = await admission.acquire(ROUTE, "b", 10)
+        waiting = asyncio.ensure_future(admission.acquire(ROUTE, "c", 10))
+        await asyncio.sleep(0)
+        assert admission.stats()["queued"] == 1 and not waiting.done()
+
+        first.release()
+        third = await asyncio.wait_for(waiting, 1)
+        assert admission.stats()["in_flight"] == 2 and admission.stats()["reserved_mb"] == 20
+        second.release()
+        third.release()
+        assert_idle(admission)
+
+    run(scenario())
+
+
+def test_release_is_idempotent():
+    async def scenario():
+        admission = controller()
+        permit = await admission.acquire(ROUTE, "a", 10)
+        permit.release()
+        permit.release()
+        assert_idle(admission)
+
+    run(scenario())
+
+
+def test_memory_budget():
+    async def scenario():
+        admission = controller(memory_mb=100, max_concurrent=8)
+        large = await admission.acquire(ROUTE, "a", 80)
+        waiting = asyncio.ensure_future(admission.acquire(ROUTE, "b", 30))
+        await asyncio.sleep(0)
+        assert not waiting.done()
+        large.release()
+        (await asyncio.wait_for(waiting, 1)).release()
+
+        # A request over the whole budget still runs, alone
+        huge = await admission.acquire(ROUTE, "a", 500)
+        assert admission.stats()["reserved_mb"] == 500
+        huge.release()
+        assert_idle(admission)
+
+    run(scenario())
+
+
+def test_queue_is_fifo_and_not_starved_by_small_requests():
+    async def scenario():
+        admission = controller(memory_mb=100, max_concurrent=8)
+        held = await admission.acquire(ROUTE, "a", 60)
+        large = asyncio.ensure_future(admission.acquire(ROUTE, "b", 60))
+        await asyncio.sleep(0)
+        small = asyncio.ensure_future(admission.acquire(ROUTE, "c", 10))
+        await asyncio.sleep(0)
+        # The small one would fit, but waits behind the large one
+        assert not large.done() and not small.done()
+        held.release()
+        (await asyncio.wait_for(large, 1)).release()
+        (await asyncio.wait_for(small, 1)).release()
+        assert_idle(admission)
+
+    run(scenario())
+
+
+def test_route_limit_passes_over_a_full_route():
+    async def scenario():
+        admission = controller(max_concurrent=4, route_limits={ROUTE: 1})
+        held = await admission.acquire(ROUTE, "a", 1)
+        blocked = asyncio.ensure_future(admission.acquire(ROUTE, "b", 1))
+        await asyncio.sleep(0)
+        other = await asyncio.wait_for(admission.acquire(OTHER, "c", 1), 1)
+        assert not blocked.done()
+        assert admission.stats()["routes"][ROUTE]["in_flight"] == 1
+        held.release()
+        (await asyncio.wait_for(blocked, 1)).release()
+        other.release()
+        assert_idle(admission)
+
+    run(scenario())
+
+
+def test_full_queue_is_rejected():
+    async def scenario():
+        admission = controller(max_concurrent=1, max_queue=1, max_wait_seconds=10)
+        held = await admission.acquire(ROUTE, "a", 1)
+        queued = asyncio.ensure_future(admission.acquire(ROUTE, "b", 1))
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as error:
+            await admission.acquire(ROUTE, "c", 1)
+        assert error.value.status_code == 429
+        assert 1 <= int(error.value.headers["Retry-After"]) <= 60
+        assert admission.stats()["queued"] == 1
+        held.release()
+        (await asyncio.wait_for(queued, 1)).release()
+        assert_idle(admission)
+
+    run(scenario())
+
+
+def test_request_expected_to_time_out_is_shed():
+    async def scenario():
+        admission = controller(max_concurrent=1, max_wait_seconds=1.0)
+        # Permits of this route have been held for 5 s on average
+        admission._hold_seconds[ROUTE] = 5.0
+        held = await admission.acquire(ROUTE, "a", 1)
+        queued = asyncio.ensure_future(admission.acquire(ROUTE, "b", 1))
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as error:
+            await admission.acquire(ROUTE, "c", 1)
+        assert error.value.status_code == 429
+        assert int(error.value.headers["Retry-After"]) >= 5
+        assert admission.stats()["queued"] == 1
+        held.release()
+        (await asyncio.wait_for(queued, 1)).release()
+        assert_idle(admission)
+
+    run(scenario())
+
+
+def test_wait_times_out():
+    async def scenario():
+        admission = controller(max_concurrent=1, max_wait_seconds=0.05)
+        held = await admission.acquire(ROUTE, "a", 1)
+        with pytest.raises(HTTPException) as error:
+            await admission.acquire(ROUTE, "b", 1)
+        assert error.value.status_code == 429
+        assert admission.stats()["queued"] == 0
+        assert admission.stats()["in_flight"] == 1
+        held.release()
+        assert_idle(admission)
+
+    run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        admission = controller(max_concurrent=1, max_wait_seconds=10)
+        held = await admission.acquire(ROUTE, "a", 1)
+        waiting = asyncio.ensure_future(admission.acquire(ROUTE, "b", 1))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert admission.stats()["queued"] == 0
+        held.release()
+        assert_idle(admission)
+
+    run(scenario())
+
+
+def test_user_rate_limit():
+    async def scenario():
+        admission = controller(max_concurrent=10, user_rate=0.1, user_burst=2)
+        permits = [await admission.acquire(ROUTE, "a", 1) for _ in range(2)]
+        with pytest.raises(HTTPException) as error:
+            await admission.acquire(ROUTE, "a", 1)
+        assert error.value.status_code == 429
+        assert int(error.value.headers["Retry-After"]) >= 1
+        # Other users have their own bucket
+        permits.append(await admission.acquire(ROUTE, "b", 1))
+        for permit in permits:
+            permit.release()
+        assert_idle(admission)
+
+    run(scenario())
+
+
+def test_disabled_admits_everything():
+    async def scenario():
+        admission = controller(max_concurrent=1, enabled=False)
+        permits = [await admission.acquire(ROUTE, "a", 1000) for _ in range(5)]
+        assert admission.stats()["in_flight"] == 0
+        for permit in permits:
+            permit.release()
+        assert_idle(admission)
+
+    run(scenario())
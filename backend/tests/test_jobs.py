@@ -0,0 +1,147 @@
+"""JobManager quota, cancel, expiry and background deferral logic, on an executor the test drives."""
+from concurrent.futures import Future
+import pytest
+from fastapi import HTTPException
+from jobs import CANCELLED, DEFERRED, QUEUED, RUNNING, SUCCEEDED, SYSTEM_USER_ID, JobManager
+
+
+class ManualExecutor:
+    """Stands in for the process pool: work runs only when the test says so."""
+
+    def __init__(self):
+        self.pending = []
+
+    def submit(self, fn, *args) -> Future:
+        future: Future = Future()
+        self.pending.append((future, fn, args))
+        return future
+
+    def start(self, index: int = 0) -> Future:
+        future = self.pending[index][0]
+        assert future.set_running_or_notify_cancel()
+        return future
+
+    def finish(self, index: int = 0):
+        future, fn, args = self.pending.pop(index)
+        if not future.running():
+            future.set_running_or_notify_cancel()
+        future.set_result(fn(*args))
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+@pytest.fixture
+def executor() -> ManualExecutor:
+    return ManualExecutor()
+
+
+@pytest.fixture
+def manager(executor, monkeypatch) -> JobManager:
+    manager = JobManager(max_workers=2, max_jobs_per_user=2, ttl_seconds=3600, max_background_jobs=1)
+    monkeypatch.setattr(manager, "_get_executor", lambda: executor)
+    return manager
+
+
+def add(a, b):
+    return a + b
+
+
+def test_per_user_limit(manager, executor):
+    first = manager.submit("alice", "analysis", add, 1, 2)
+    manager.submit("alice", "analysis", add, 3, 4)
+    with pytest.raises(HTTPException) as error:
+        manager.submit("alice", "analysis", add, 5, 6)
+    assert error.value.status_code == 429
+    # Other users have their own limit
+    manager.submit("bob", "analysis", add, 1, 1)
+
+    executor.finish(0)
+    assert first.status == SUCCEEDED
+    assert first.to_dict()["result"] == 3
+    manager.submit("alice", "analysis", add, 5, 6)
+
+
+def test_jobs_are_private(manager):
+    job = manager.submit("alice", "analysis", add, 1, 2)
+    assert manager.get(job.id, "alice") is job
+    with pytest.raises(HTTPException) as error:
+        manager.get(job.id, "bob")
+    assert error.value.status_code == 404
+    with pytest.raises(HTTPException):
+        manager.cancel(job.id, "bob")
+
+
+def test_cancel_queued_job_frees_the_slot(manager, executor):
+    job = manager.submit("alice", "analysis", add, 1, 2)
+    manager.submit("alice", "analysis", add, 3, 4)
+    assert job.status == QUEUED
+    assert manager.cancel(job.id, "alice").status == CANCELLED
+    assert not job.active
+    manager.submit("alice", "analysis", add, 5, 6)
+
+
+def test_cancel_running_job_discards_the_result(manager, executor):
+    job = manager.submit("alice", "analysis", add, 1, 2)
+    executor.start()
+    assert job.status == RUNNING
+    manager.cancel(job.id, "alice")
+    assert job.status == CANCELLED
+    # Still occupies its worker until it finishes
+    assert job.active
+    executor.finish()
+    assert job.status == CANCELLED
+    assert "result" not in job.to_dict()
+
+
+def test_background_work_is_deferred_and_drained(manager, executor):
+    first = manager.submit_background("ingest", add, 1, 1)
+    assert first is not None and first.user_id == SYSTEM_USER_ID
+    assert manager.submit_background("ingest", add, 2, 2) is None
+    assert manager.submit_background("ingest", add, 3, 3) is None
+    assert manager.status_counts() == {QUEUED: 1, DEFERRED: 2}
+
+    # Background work does not use up a user's limit
+    manager.submit("alice", "analysis", add, 0, 0)
+    manager.submit("alice", "analysis", add, 0, 0)
+
+    executor.finish(0)
+    assert manager.status_counts()[DEFERRED] == 1
+    # Deferred work starts in order: the oldest next
+    assert executor.pending[-1][2][1] == (2, 2)
+    executor.finish(len(executor.pending) - 1)
+    executor.finish(len(executor.pending) - 1)
+    assert DEFERRED not in manager.status_counts()
+    assert manager.status_counts()[SUCCEEDED] == 3
+
+
+def test_repeated_background_work_is_not_added_twice(manager, executor):
+    job = manager.submit_background("ingest", add, 1, 1)
+    assert manager.submit_background("ingest", add, 1, 1) is job
+    assert manager.submit_background("ingest", add, 2, 2) is None
+    assert manager.submit_background("ingest", add, 2, 2) is None
+    assert manager.status_counts()[DEFERRED] == 1
+    # The same arguments under another kind are other work
+    assert manager.submit_background("conversion", add, 1, 1) is None
+    assert manager.status_counts()[DEFERRED] == 2
+
+
+def test_completed_job(manager):
+    job = manager.completed("alice", "analysis", {"cached": True})
+    assert job.status == SUCCEEDED
+    assert manager.get(job.id, "alice").to_dict()["result"] == {"cached": True}
+
+
+def test_finished_jobs_expire(manager, executor):
+    job = manager.submit("alice", "analysis", add, 1, 2)
+    executor.finish()
+    job.finished_at -= manager.ttl_seconds + 1
+    with pytest.raises(HTTPException):
+        manager.get(job.id, "alice")
+
+
+def test_shutdown_drops_deferred_work(manager):
+    manager.submit_background("ingest", add, 1, 1)
+    manager.submit_background("ingest", add, 2, 2)
+    manager.shutdown()
+    assert DEFERRED not in manager.status_counts()
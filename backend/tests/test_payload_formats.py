@@ -0,0 +1,189 @@
+"""Round trips through the binary formats: scene payloads, fragments and tiles."""
+import json
+import struct
+from types import SimpleNamespace
+import numpy as np
+import pytest
+import tiles
+from bench.generators import scene_items, synthetic_ifc
+from energyplus import PackedScene
+from fragments import FRAGMENTS_FORMAT_VERSION, build_fragments, read_fragments
+from scene_payload import SCENE_FORMAT_VERSION, SCENE_MAGIC, decode_scene
+from tiles import TILES_MAGIC, build_tiles, manifest_size
+
+
+def encode_scene(items: list, name: str = "Test", header: dict = None) -> bytes:
+    """The scene payload layout of scene_payload.py, as the viewer writes it."""
+    item_ids = sorted({item["itemId"] for item in items})
+    properties = []
+    property_index = []
+    for item in items:
+        if item["properties"] not in properties:
+            properties.append(item["properties"])
+        property_index.append(properties.index(item["properties"]))
+    header_bytes = json.dumps(header or {"name": name, "count": len(items), "item_ids": item_ids, "properties": properties}).encode()
+    header_bytes += b" " * (-len(header_bytes) % 4)
+    vectors = np.array([[item[name] for item in items] for name in ("position", "rotation", "scale")], dtype="<f4")
+    indices = np.array([[item_ids.index(item["itemId"]) for item in items], property_index], dtype="<u4")
+    return SCENE_MAGIC + struct.pack("<II", SCENE_FORMAT_VERSION, len(header_bytes)) + header_bytes + vectors.tobytes() + indices.tobytes()
+
+
+def from_items(items: list) -> PackedScene:
+    return PackedScene.from_items([SimpleNamespace(**item) for item in items])
+
+
+@pytest.mark.parametrize("count", [0, 1, 700])
+def test_scene_round_trip(count):
+    items = scene_items(count, seed=count)
+    name, scene = decode_scene(encode_scene(items, name="Round trip"))
+    expected = from_items(items)
+    assert name == "Round trip"
+    assert scene.item_ids == expected.item_ids
+    assert scene.ifc_types == expected.ifc_types
+    assert scene.physics == expected.physics
+    # Vectors travel as float32
+    for column in ("positions", "rotations", "scales", "extents"):
+        np.testing.assert_allclose(getattr(scene, column), getattr(expected, column), rtol=1e-6, atol=1e-5)
+
+
+def test_scene_default_extents():
+    items = scene_items(3)
+    for item in items:
+        item["properties"] = {"ifc_type": "IfcWall"}
+    _, scene = decode_scene(encode_scene(items))
+    np.testing.assert_array_equal(scene.extents, from_items(items).extents)
+
+
+@pytest.mark.parametrize("change", [
+    lambda payload: payload[:-4],
+    lambda payload: b"XXXX" + payload[4:],
+    lambda payload: payload[:4] + struct.pack("<I", SCENE_FORMAT_VERSION + 1) + payload[8:],
+])
+def test_scene_rejects_corrupt_payloads(change):
+    with pytest.raises(ValueError):
+        decode_scene(change(encode_scene(scene_items(5))))
+
+
+@pytest.mark.parametrize("header", [
+    {"count": 1, "item_ids": "item-0", "properties": [{}]},
+    {"count": 1, "item_ids": {"item-0": 0}, "properties": [{}]},
+    {"count": 1, "item_ids": [0], "properties": [{}]},
+    {"count": 1, "item_ids": ["item-0"], "properties": {}},
+    {"count": 1, "item_ids": ["item-0"], "properties": [{"width": None}]},
+    {"count": 1, "item_ids": ["item-0"], "properties": [{"depth": "0.2"}]},
+    {"count": 1, "item_ids": ["item-0"], "properties": [{"physics": []}]},
+    {"count": 1, "item_ids": [], "properties": [{}]},
+    {"item_ids": ["item-0"], "properties": [{}]},
+])
+def test_scene_rejects_invalid_headers(header):
+    with pytest.raises(ValueError):
+        decode_scene(encode_scene(scene_items(1), header=header))
+
+
+@pytest.fixture(scope="module")
+def model():
+    import ifcopenshell
+
+    return ifcopenshell.file.from_string(synthetic_ifc(60).decode())
+
+
+@pytest.fixture(scope="module")
+def fragments(model):
+    return read_fragments(build_fragments(model, "0" * 64))
+
+
+def test_fragments_round_trip(model, fragments):
+    header, buffers = fragments
+    assert header["format_version"] == FRAGMENTS_FORMAT_VERSION
+    assert header["source_sha256"] == "0" * 64
+    assert header["schema"] == model.schema
+    count = len(header["global_ids"])
+    assert count == 60
+    for name in ("instance_geometry", "instance_matrix", "instance_express_id", "instance_type"):
+        assert len(buffers[name]) == count
+    for express_id, global_id in zip(buffers["instance_express_id"], header["global_ids"]):
+        assert model.by_id(int(express_id)).GlobalId == global_id
+    assert {model.by_id(int(express_id)).is_a() for express_id in buffers["instance_express_id"]} == set(header["types"])
+
+    # Every geometry's meshes cover its triangles and stay within its vertices
+    geometries = buffers["geometries"]
+    meshes = buffers["meshes"]
+    assert geometries[:, 1].sum() == len(buffers["positions"]) == len(buffers["normals"])
+    assert meshes[:, 1].sum() == len(buffers["indices"])
+    for first_vertex, vertex_count, first_mesh, mesh_count in geometries:
+        start, _ = meshes[first_mesh]
+        last_start, last_count = meshes[first_mesh + mesh_count - 1]
+        assert buffers["indices"][start:last_start + last_count].max() < vertex_count
+
+
+def test_read_fragments_rejects_other_formats(fragments):
+    with pytest.raises(ValueError):
+        read_fragments(b"XXXX" + b"\0" * 8)
+    with pytest.raises(ValueError):
+        read_fragments(b"VXFR" + struct.pack("<II", FRAGMENTS_FORMAT_VERSION + 1, 0))
+
+
+def decode_tile(payload: bytes, lo: np.ndarray, hi: np.ndarray):
+    """Positions (dequantised) and triangles of a tile payload, as the viewer reads it."""
+    vertex_count, index_count = struct.unpack_from("<II", payload)
+    quantised = np.frombuffer(payload, dtype="<u2", count=vertex_count * 3, offset=8).reshape(-1, 3)
+    offset = 8 + vertex_count * 6 + (-(vertex_count * 6) % 4) + vertex_count * 4
+    index_type = "<u2" if vertex_count <= 65535 else "<u4"
+    faces = np.frombuffer(payload, dtype=index_type, count=index_count, offset=offset).reshape(-1, 3)
+    assert offset + index_count * np.dtype(index_type).itemsize == len(payload)
+    return lo + quantised / 65535 * np.where(hi > lo, hi - lo, 1.0), faces
+
+
+@pytest.mark.parametrize("max_triangles", [100000, 100])
+def test_tiles_round_trip(fragments, monkeypatch, max_triangles):
+    monkeypatch.setattr(tiles, "TILE_MAX_TRIANGLES", max_triangles)
+    header, buffers = fragments
+    data = build_tiles(buffers, header["source_sha256"])
+    assert data[:4] == TILES_MAGIC
+    start = manifest_size(data[:12])
+    manifest = json.loads(data[12:start])
+    assert manifest["source_sha256"] == header["source_sha256"]
+    assert sum(tile["elements"] for tile in manifest["tiles"]) == len(buffers["instance_geometry"])
+    if max_triangles < len(buffers["indices"]) // 3:
+        assert len(manifest["tiles"]) > 1
+
+    model_lo, model_hi = np.array(manifest["bounds"][:3]), np.array(manifest["bounds"][3:])
+    full_triangles = 0
+    for tile in manifest["tiles"]:
+        lo, hi = np.array(tile["bounds"][:3]), np.array(tile["bounds"][3:])
+        assert np.all(lo >= model_lo - 1e-9) and np.all(hi <= model_hi + 1e-9)
+        assert len(tile["lods"]) == manifest["lod_count"]
+        previous = None
+        for offset, length, triangle_count, error in tile["lods"]:
+            points, faces = decode_tile(data[start + offset:start + offset + length], lo, hi)
+            assert len(faces) == triangle_count
+            if len(faces):
+                assert faces.max() < len(points)
+            assert np.all(points >= lo - 1e-6) and np.all(points <= hi + 1e-6)
+            # Coarser levels never have more triangles
+            assert previous is None or triangle_count <= previous
+            previous = triangle_count
+        full_triangles += tile["lods"][0][2]
+    # Level 0 is the full geometry: every instance's triangles, once
+    triangles_per_geometry = buffers["meshes"][:, 1]
+    per_geometry = np.add.reduceat(triangles_per_geometry, buffers["geometries"][:, 2].astype(np.int64)) // 3
+    assert full_triangles == per_geometry[buffers["instance_geometry"]].sum()
+
+
+def test_manifest_size_rejects_other_files():
+    with pytest.raises(ValueError):
+        manifest_size(b"VXFR" + b"\0" * 8)
+
+
+@pytest.mark.parametrize("change", [
+    lambda item: item.update(position=[1.0, 2.0]),
+    lambda item: item.update(scale=[1.0, 1.0, 1.0, 1.0]),
+    lambda item: item["properties"].update(width=None),
+    lambda item: item["properties"].update(height="2"),
+    lambda item: item["properties"].update(physics=None),
+])
+def test_from_items_rejects_invalid_items(change):
+    items = scene_items(3)
+    change(items[1])
+    with pytest.raises(ValueError):
+        from_items(items)
@@ -0,0 +1,114 @@
+"""SpatialIndex queries against brute-force answers over random boxes."""
+import numpy as np
+import pytest
+from spatial_index import FANOUT, SpatialIndex
+
+
+def random_boxes(count: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    lo = rng.uniform(-50, 50, size=(count, 3))
+    return np.hstack([lo, lo + rng.uniform(0.1, 5, size=(count, 3))])
+
+
+def box_distance(point: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    gap = np.maximum(np.maximum(boxes[:, :3] - point, point - boxes[:, 3:]), 0.0)
+    return np.sqrt((gap * gap).sum(axis=1))
+
+
+# Sizes around the fan-out, so trees of one, two and three levels are covered
+@pytest.fixture(params=[1, FANOUT, FANOUT + 1, 2000])
+def boxes(request) -> np.ndarray:
+    return random_boxes(request.param, seed=request.param)
+
+
+def test_intersect_box(boxes):
+    tree = SpatialIndex(boxes)
+    rng = np.random.default_rng(1)
+    for _ in range(20):
+        lo = rng.uniform(-60, 40, size=3)
+        hi = lo + rng.uniform(0, 40, size=3)
+        expected = np.flatnonzero(np.all(boxes[:, :3] <= hi, axis=1) & np.all(boxes[:, 3:] >= lo, axis=1))
+        np.testing.assert_array_equal(tree.intersect_box(lo, hi), expected)
+
+
+@pytest.mark.parametrize("mode", ["intersect", "front", "back"])
+def test_intersect_plane(boxes, mode):
+    tree = SpatialIndex(boxes)
+    rng = np.random.default_rng(2)
+    corners = np.stack(np.meshgrid([0, 3], [1, 4], [2, 5], indexing="ij"), axis=-1).reshape(-1, 3)
+    for _ in range(10):
+        normal = rng.normal(size=3)
+        normal /= np.linalg.norm(normal)
+        offset = float(rng.uniform(-30, 30))
+        projected = np.stack([boxes[:, corner] @ normal for corner in corners], axis=1)
+        low, high = projected.min(axis=1), projected.max(axis=1)
+        expected = {"intersect": (low <= offset) & (high >= offset), "front": high >= offset, "back": low <= offset}[mode]
+        # Corners and the centre/radius form used by the index may differ in the last bits
+        result = set(tree.intersect_plane(normal, offset, mode).tolist())
+        assert set(np.flatnonzero(expected).tolist()) ^ result <= set(
+            np.flatnonzero(np.isclose(low, offset) | np.isclose(high, offset)).tolist()
+        )
+
+
+def test_nearest(boxes):
+    tree = SpatialIndex(boxes)
+    rng = np.random.default_rng(3)
+    for k in (1, 5, 50):
+        point = rng.uniform(-60, 60, size=3)
+        rows, distances = tree.nearest(point, k)
+        expected = np.sort(box_distance(point, boxes))[:k]
+        np.testing.assert_allclose(distances, expected)
+        np.testing.assert_allclose(box_distance(point, boxes[rows]), distances)
+
+
+def slab_entry(origin: np.ndarray, direction: np.ndarray, box: np.ndarray) -> float:
+    """Distance along the ray to where it enters the box (in units of direction), inf for a miss."""
+    near, far = 0.0, np.inf
+    for axis in range(3):
+        if direction[axis] == 0:
+            if not box[axis] <= origin[axis] <= box[axis + 3]:
+                return np.inf
+            continue
+        t1 = (box[axis] - origin[axis]) / direction[axis]
+        t2 = (box[axis + 3] - origin[axis]) / direction[axis]
+        near, far = max(near, min(t1, t2)), min(far, max(t1, t2))
+    return near if near <= far else np.inf
+
+
+def test_ray(boxes):
+    tree = SpatialIndex(boxes)
+    rng = np.random.default_rng(4)
+    for _ in range(20):
+        origin = rng.uniform(-60, 60, size=3)
+        # Aim at a random box so most rays hit something
+        direction = 0.5 * (boxes[rng.integers(len(boxes)), :3] + boxes[rng.integers(len(boxes)), 3:]) - origin
+        entries = np.array([slab_entry(origin, direction, box) for box in boxes])
+        hit = np.flatnonzero(np.isfinite(entries))
+        expected = np.sort(entries[hit]) * np.linalg.norm(direction)
+        for limit in (1, len(boxes)):
+            rows, distances = tree.ray(origin, direction, limit)
+            np.testing.assert_allclose(distances, expected[:limit])
+            assert set(rows.tolist()) <= set(hit.tolist())
+
+
+def test_axis_parallel_ray():
+    boxes = np.array([[0, 0, 0, 1, 1, 1], [3, 0, 0, 4, 1, 1], [3, 2, 0, 4, 3, 1]], dtype=np.float64)
+    rows, distances = SpatialIndex(boxes).ray(np.array([-1.0, 0.5, 0.5]), np.array([2.0, 0.0, 0.0]), limit=10)
+    np.testing.assert_array_equal(rows, [0, 1])
+    np.testing.assert_allclose(distances, [1.0, 4.0])
+
+
+def test_rows_without_bounds_are_skipped():
+    boxes = random_boxes(40)
+    boxes[[3, 17]] = np.nan
+    tree = SpatialIndex(boxes)
+    assert len(tree) == 38
+    rows = tree.intersect_box(np.full(3, -1e9), np.full(3, 1e9))
+    np.testing.assert_array_equal(rows, np.setdiff1d(np.arange(40), [3, 17]))
+
+
+def test_empty_index():
+    tree = SpatialIndex(np.empty((0, 6)))
+    assert len(tree.intersect_box(np.zeros(3), np.ones(3))) == 0
+    assert len(tree.nearest(np.zeros(3), 3)[0]) == 0
+    assert len(tree.ray(np.zeros(3), np.ones(3), 5)[0]) == 0
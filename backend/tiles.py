@@ -0,0 +1,235 @@
+"""
+Spatially tiled, multi-resolution model geometry for streaming.
+Splits the world-space triangles of a converted model (see fragments.py) into
+tiles of bounded size and stores every tile at several levels of detail,
+decimated by vertex clustering. All tiles and levels go into one file with a
+manifest up front, so the viewer reads the manifest once and then fetches only
+the visible tiles at the level it needs with HTTP range requests.
+
+File layout (little-endian):
+    0   b"VXTL"
+    4   uint32 format version
+    8   uint32 manifest length N (JSON, space-padded to a multiple of 4)
+    12  manifest JSON
+    12+N  tile payloads; manifest offsets are relative to this point
+
+Manifest:
+    {"bounds": [minx, miny, minz, maxx, maxy, maxz], "lod_count": L,
+     "tiles": [{"bounds": [...], "elements": n,
+                "lods": [[offset, length, triangles, geometric_error], ...]}]}
+    lods[0] is the full geometry; geometric_error is the clustering cell size
+    in metres (0 for the full geometry). Payloads of coarse levels are stored
+    first so an overview of the whole model is one contiguous range.
+
+Tile payload:
+    uint32 vertex count V, uint32 index count I
+    uint16 (V, 3) positions, quantised to the tile bounds (padded to 4 bytes)
+    uint8  (V, 4) RGBA colours
+    uint16 or uint32 (I,) triangle indices (uint16 when V <= 65535)
+"""
+import io
+import os
+import json
+import struct
+from typing import Dict, List
+import numpy as np
+from element_index import ARTIFACT_PREFIX
+
+TILES_MAGIC = b"VXTL"
+TILES_FORMAT_VERSION = 1
+TILES_CONTENT_TYPE = "application/vnd.voxel.tiles"
+
+# Triangle budget of one tile at full detail
+TILE_MAX_TRIANGLES = int(os.environ.get("TILE_MAX_TRIANGLES", "100000"))
+# Clustering grids of the coarser levels, in cells along the longest tile axis
+TILE_LOD_GRIDS = tuple(int(value) for value in os.environ.get("TILE_LOD_GRIDS", "256,64,16").split(","))
+# A coarser level that keeps more than this share of the triangles is not worth storing
+TILE_MIN_REDUCTION = 0.75
+
+
+def tiles_path(sha256: str) -> str:
+    """Storage path of the content-addressed tile file (per format version, like fragments_path)."""
+    return f"{ARTIFACT_PREFIX}/tiles/v{TILES_FORMAT_VERSION}/{sha256}.vxtl"
+
+
+def _world_mesh(buffers: Dict[str, np.ndarray]):
+    """
+    Place every instance of a fragments file in world coordinates.
+    Returns vertices, colours, triangles (indices into vertices) and the
+    instance each triangle belongs to.
+    """
+    geometries = buffers["geometries"]
+    meshes = buffers["meshes"]
+    positions = buffers["positions"]
+    indices = buffers["indices"]
+    colors = buffers["mesh_colors"]
+    instance_geometry = buffers["instance_geometry"]
+    # Stored column-major (three.js order)
+    matrices = buffers["instance_matrix"].reshape(-1, 4, 4).transpose(0, 2, 1).astype(np.float64)
+
+    order = np.argsort(instance_geometry, kind="stable")
+    numbers, starts = np.unique(instance_geometry[order], return_index=True)
+
+    vertices: List[np.ndarray] = []
+    vertex_colors: List[np.ndarray] = []
+    triangles: List[np.ndarray] = []
+    owners: List[np.ndarray] = []
+    vertex_total = 0
+    for number, instances in zip(numbers, np.split(order, starts[1:])):
+        first_vertex, vertex_count, first_mesh, mesh_count = (int(value) for value in geometries[number])
+        local = positions[first_vertex:first_vertex + vertex_count].astype(np.float64)
+
+        # Meshes of one geometry are stored back to back
+        first_index = int(meshes[first_mesh, 0])
+        last = first_mesh + mesh_count - 1
+        faces = indices[first_index:int(meshes[last, 0] + meshes[last, 1])].reshape(-1, 3).astype(np.int64)
+        color = np.empty((vertex_count, 4), dtype=np.uint8)
+        for mesh in range(first_mesh, first_mesh + mesh_count):
+            start, count = (int(value) for value in meshes[mesh])
+            color[indices[start:start + count]] = colors[mesh]
+
+        placement = matrices[instances]
+        world = np.einsum("vj,kij->kvi", local, placement[:, :3, :3]) + placement[:, None, :3, 3]
+        copies = len(instances)
+        vertices.append(world.reshape(-1, 3))
+        vertex_colors.append(np.tile(color, (copies, 1)))
+        offsets = vertex_total + vertex_count * np.arange(copies)
+        triangles.append((faces[None] + offsets[:, None, None]).reshape(-1, 3))
+        owners.append(np.repeat(instances, len(faces)))
+        vertex_total += copies * vertex_count
+
+    if not vertices:
+        return (np.empty((0, 3)), np.empty((0, 4), dtype=np.uint8),
+                np.empty((0, 3), dtype=np.int64), np.empty(0, dtype=np.int64))
+    return np.concatenate(vertices), np.concatenate(vertex_colors), np.concatenate(triangles), np.concatenate(owners)
+
+
+def _split(centers: np.ndarray, weights: np.ndarray, max_weight: int) -> List[np.ndarray]:
+    """k-d split of items (by centre) into groups of at most max_weight, halving the weight each time."""
+    groups = []
+    stack = [np.arange(len(centers))]
+    while stack:
+        members = stack.pop()
+        if len(members) <= 1 or weights[members].sum() <= max_weight:
+            groups.append(members)
+            continue
+        points = centers[members]
+        axis = int(np.argmax(points.max(axis=0) - points.min(axis=0)))
+        members = members[np.argsort(points[:, axis], kind="stable")]
+        cumulative = np.cumsum(weights[members])
+        cut = min(max(int(np.searchsorted(cumulative, cumulative[-1] / 2)), 1), len(members) - 1)
+        stack.extend((members[:cut], members[cut:]))
+    return groups
+
+
+def _cluster(points: np.ndarray, colors: np.ndarray, faces: np.ndarray, origin: np.ndarray, cell: float):
+    """Vertex-clustering decimation: merge all vertices in a grid cell and drop collapsed triangles."""
+    cells = np.floor((points - origin) / cell).astype(np.int64)
+    cells -= cells.min(axis=0)
+    span = cells.max(axis=0) + 1
+    keys = (cells[:, 0] * span[1] + cells[:, 1]) * span[2] + cells[:, 2]
+    _, first, representative = np.unique(keys, return_index=True, return_inverse=True)
+    counts = np.bincount(representative)
+    merged = np.stack([np.bincount(representative, weights=points[:, axis]) for axis in range(3)], axis=1) / counts[:, None]
+
+    faces = representative[faces]
+    faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])]
+    if len(faces):
+        _, unique_faces = np.unique(np.sort(faces, axis=1), axis=0, return_index=True)
+        faces = faces[np.sort(unique_faces)]
+    used, remapped = np.unique(faces, return_inverse=True)
+    return merged[used], colors[first][used], remapped.reshape(-1, 3)
+
+
+def _encode_tile(points: np.ndarray, colors: np.ndarray, faces: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> bytes:
+    extent = np.where(hi > lo, hi - lo, 1.0)
+    quantised = np.round((points - lo) / extent * 65535).clip(0, 65535).astype("<u2")
+    index_type = "<u2" if len(points) <= 65535 else "<u4"
+    position_bytes = quantised.tobytes()
+    return b"".join((
+        struct.pack("<II", len(points), faces.size),
+        position_bytes, b"\0" * (-len(position_bytes) % 4),
+        colors.astype(np.uint8).tobytes(),
+        faces.astype(index_type).tobytes(),
+    ))
+
+
+def build_tiles(buffers: Dict[str, np.ndarray], source_sha256: str = "") -> bytes:
+    """Build the tile file of a model from its parsed fragments buffers."""
+    vertices, colors, triangles, owner = _world_mesh(buffers)
+    instance_count = len(buffers["instance_geometry"])
+
+    # Instance centres and triangle counts drive the split
+    lo = np.full((instance_count, 3), np.inf)
+    hi = np.full((instance_count, 3), -np.inf)
+    corner_owner = np.repeat(owner, 3)
+    np.minimum.at(lo, corner_owner, vertices[triangles.ravel()])
+    np.maximum.at(hi, corner_owner, vertices[triangles.ravel()])
+    weights = np.bincount(owner, minlength=instance_count)
+    present = np.flatnonzero(weights)
+    groups = [present[group] for group in _split(0.5 * (lo[present] + hi[present]), weights[present], TILE_MAX_TRIANGLES)] if len(present) else []
+
+    tile_of = np.zeros(instance_count, dtype=np.int64)
+    for number, group in enumerate(groups):
+        tile_of[group] = number
+    by_tile = np.argsort(tile_of[owner], kind="stable")
+    bounds = np.searchsorted(tile_of[owner][by_tile], np.arange(len(groups) + 1))
+
+    lod_count = 1 + len(TILE_LOD_GRIDS)
+    tiles = []
+    payloads: List[List[bytes]] = []
+    for number, group in enumerate(groups):
+        faces = triangles[by_tile[bounds[number]:bounds[number + 1]]]
+        used, remapped = np.unique(faces, return_inverse=True)
+        points, point_colors, faces = vertices[used], colors[used], remapped.reshape(-1, 3)
+        tile_lo, tile_hi = points.min(axis=0), points.max(axis=0)
+
+        levels = [(_encode_tile(points, point_colors, faces, tile_lo, tile_hi), len(faces), 0.0)]
+        size = float((tile_hi - tile_lo).max())
+        for grid in TILE_LOD_GRIDS:
+            cell = size / grid if size > 0 else 1.0
+            coarse = _cluster(points, point_colors, faces, tile_lo, cell)
+            if len(coarse[2]) > TILE_MIN_REDUCTION * levels[-1][1]:
+                levels.append(levels[-1])
+                continue
+            levels.append((_encode_tile(*coarse, tile_lo, tile_hi), len(coarse[2]), cell))
+
+        tiles.append({
+            "bounds": [float(value) for value in (*tile_lo, *tile_hi)],
+            "elements": int(len(group)),
+        })
+        payloads.append(levels)
+
+    # Coarsest levels first; a level identical to the finer one shares its bytes
+    data = io.BytesIO()
+    for tile in tiles:
+        tile["lods"] = [None] * lod_count
+    for level in reversed(range(lod_count)):
+        for tile, levels in zip(tiles, payloads):
+            payload, triangle_count, error = levels[level]
+            if level + 1 < lod_count and levels[level + 1][0] is payload:
+                tile["lods"][level] = [*tile["lods"][level + 1][:2], triangle_count, error]
+                continue
+            tile["lods"][level] = [data.tell(), len(payload), triangle_count, error]
+            data.write(payload)
+
+    model_bounds = (
+        [float(value) for value in (*vertices.min(axis=0), *vertices.max(axis=0))] if len(vertices) else [0.0] * 6
+    )
+    manifest = json.dumps({
+        "format_version": TILES_FORMAT_VERSION,
+        "source_sha256": source_sha256,
+        "bounds": model_bounds,
+        "lod_count": lod_count,
+        "tiles": tiles,
+    }, separators=(",", ":")).encode()
+    manifest += b" " * (-len(manifest) % 4)
+    return TILES_MAGIC + struct.pack("<II", TILES_FORMAT_VERSION, len(manifest)) + manifest + data.getvalue()
+
+
+def manifest_size(prefix: bytes) -> int:
+    """Bytes to read from the start of a tile file to get the whole manifest (needs the first 12)."""
+    if prefix[:4] != TILES_MAGIC:
+        raise ValueError("Not a tile file")
+    _, manifest_length = struct.unpack_from("<II", prefix, 4)
+    return 12 + manifest_length
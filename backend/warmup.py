@@ -0,0 +1,82 @@
+"""
+Background warm-up of the API process after start.
+Importing the app loads only what serving a request needs. The app's lifespan
+starts WarmUp.run(), which creates the Supabase clients, imports the JWT
+backends and starts the IFC job workers (each importing ifcopenshell) while the
+app already answers requests. GET /readyz reports when every step is done.
+"""
+import os
+import time
+import asyncio
+import importlib
+import traceback
+from typing import Any, Dict
+from starlette.concurrency import run_in_threadpool
+import data_access as db
+from jobs import job_manager
+from supabase_client import get_supabase
+
+# IFC_WARMUP: start the job workers at startup (0: start them with the first job)
+# IFC_WARMUP_TIMEOUT_SECONDS: the IFC engine step fails if the workers take longer
+IFC_WARMUP = os.environ.get("IFC_WARMUP", "1") == "1"
+IFC_WARMUP_TIMEOUT_SECONDS = float(os.environ.get("IFC_WARMUP_TIMEOUT_SECONDS", "120"))
+
+PENDING = "pending"
+READY = "ready"
+SKIPPED = "skipped"
+FAILED = "failed"
+
+STEPS = ("clients", "auth", "ifc_engine")
+
+
+class WarmUp:
+    """The warm-up steps and their state (pending, ready, skipped or failed)."""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._steps: Dict[str, Dict[str, Any]] = {name: {"state": PENDING} for name in STEPS}
+
+    async def run(self):
+        for name, step in (("clients", self._clients), ("auth", self._auth), ("ifc_engine", self._ifc_engine)):
+            started = time.perf_counter()
+            try:
+                state = await step()
+                self._steps[name] = {"state": state, "seconds": round(time.perf_counter() - started, 3)}
+            except Exception as e:
+                traceback.print_exc()
+                self._steps[name] = {"state": FAILED, "error": str(e)}
+
+    async def _clients(self) -> str:
+        # The supabase import is the slow part; do it off the event loop
+        await run_in_threadpool(get_supabase)
+        db.get_db()
+        return READY
+
+    async def _auth(self) -> str:
+        await run_in_threadpool(importlib.import_module, "jwt")
+        return READY
+
+    async def _ifc_engine(self) -> str:
+        if not IFC_WARMUP or job_manager.max_workers < 1:
+            return SKIPPED
+        await run_in_threadpool(job_manager.warm_up)
+        deadline = time.monotonic() + IFC_WARMUP_TIMEOUT_SECONDS
+        while job_manager.started_workers() < job_manager.max_workers:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{job_manager.started_workers()} of {job_manager.max_workers} workers started")
+            await asyncio.sleep(0.05)
+        return READY
+
+    def ready(self) -> bool:
+        return all(step["state"] in (READY, SKIPPED) for step in self._steps.values())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready(),
+            "uptime_seconds": round(time.time() - self.started_at, 3),
+            "workers": {"started": job_manager.started_workers(), "max": job_manager.max_workers},
+            "steps": {name: dict(step) for name, step in self._steps.items()},
+        }
+
+
+warm_up = WarmUp()
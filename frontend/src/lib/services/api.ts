@@ -66,6 +66,77 @@ export async function post(path: string, data: any) {
   return await response.json();
 }
 
+/**
+ * GET with If-None-Match: resolves to notModified = true on 304, otherwise
+ * to the JSON body and the response's ETag.
+ */
+export async function getConditional(path: string, etag: string | null) {
+  const headers = (await getAuthHeaders()) as Record<string, string>;
+  if (etag) {
+    headers['If-None-Match'] = etag;
+  }
+  const response = await fetch(`${API_URL}/${path}`, { headers });
+
+  if (response.status === 304) {
+    return { notModified: true, etag, data: null };
+  }
+  if (!response.ok) {
+    let errorMessage = `HTTP error! status: ${response.status}`;
+    try {
+      const errorData = await response.json();
+      if (errorData.detail) {
+        errorMessage = errorData.detail;
+      } else if (errorData.message) {
+        errorMessage = errorData.message;
+      }
+    } catch {
+      errorMessage = response.statusText || errorMessage;
+    }
+    throw new Error(errorMessage);
+  }
+  return { notModified: false, etag: response.headers.get('ETag'), data: await response.json() };
+}
+
+/**
+ * POST with If-None-Match: resolves to notModified = true on 304, otherwise
+ * to the JSON body and the response's ETag.
+ * An ArrayBuffer is sent as is with the given content type, anything else as JSON.
+ */
+export async function postConditional(path: string, data: any, etag: string | null, contentType?: string) {
+  const headers = (await getAuthHeaders()) as Record<string, string>;
+  if (etag) {
+    headers['If-None-Match'] = etag;
+  }
+  const binary = data instanceof ArrayBuffer;
+  if (binary) {
+    headers['Content-Type'] = contentType ?? 'application/octet-stream';
+  }
+  const response = await fetch(`${API_URL}/${path}`, {
+    method: 'POST',
+    headers,
+    body: binary ? data : JSON.stringify(data),
+  });
+
+  if (response.status === 304) {
+    return { notModified: true, etag, data: null };
+  }
+  if (!response.ok) {
+    let errorMessage = `HTTP error! status: ${response.status}`;
+    try {
+      const errorData = await response.json();
+      if (errorData.detail) {
+        errorMessage = errorData.detail;
+      } else if (errorData.message) {
+        errorMessage = errorData.message;
+      }
+    } catch {
+      errorMessage = response.statusText || errorMessage;
+    }
+    throw new Error(errorMessage);
+  }
+  return { notModified: false, etag: response.headers.get('ETag'), data: await response.json() };
+}
+
 export async function put(path: string, data: any) {
   const headers = await getAuthHeaders();
   const response = await fetch(`${API_URL}/${path}`, {
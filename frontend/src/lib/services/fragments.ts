@@ -0,0 +1,156 @@
+import * as THREE from 'three';
+
+/**
+ * Reader for the backend's pre-tessellated geometry format (see backend/fragments.py).
+ * Builds one (instanced) mesh per geometry, material and IFC type, so
+ * repeated elements share GPU buffers and categories can be toggled cheaply.
+ */
+
+export const FRAGMENTS_FORMAT_VERSION = 1;
+
+type BufferLayout = [offset: number, byteLength: number, dtype: string, shape: number[]];
+
+export type FragmentsHeader = {
+  format_version: number;
+  source_sha256: string;
+  schema: string;
+  types: string[];
+  global_ids: string[];
+  buffers: Record<string, BufferLayout>;
+};
+
+const ARRAY_TYPES = {
+  f4: Float32Array,
+  i1: Int8Array,
+  u1: Uint8Array,
+  u2: Uint16Array,
+  u4: Uint32Array
+} as const;
+
+function readHeader(buffer: ArrayBuffer): { header: FragmentsHeader; binaryStart: number } {
+  const view = new DataView(buffer);
+  const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+  if (magic !== 'VXFR') {
+    throw new Error('Not a fragments file');
+  }
+  const version = view.getUint32(4, true);
+  if (version !== FRAGMENTS_FORMAT_VERSION) {
+    throw new Error(`Unsupported fragments format version ${version}`);
+  }
+  const headerLength = view.getUint32(8, true);
+  const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 12, headerLength)));
+  return { header, binaryStart: 12 + headerLength };
+}
+
+export type ParsedFragments = {
+  header: FragmentsHeader;
+  group: THREE.Group;
+  /** Element count per IFC category (upper-case, like the classifier's entity names) */
+  categories: Map<string, number>;
+};
+
+export function parseFragments(buffer: ArrayBuffer): ParsedFragments {
+  const { header, binaryStart } = readHeader(buffer);
+
+  const read = (name: string) => {
+    const [offset, byteLength, dtype] = header.buffers[name];
+    const ArrayType = ARRAY_TYPES[dtype as keyof typeof ARRAY_TYPES];
+    return new ArrayType(buffer, binaryStart + offset, byteLength / ArrayType.BYTES_PER_ELEMENT);
+  };
+
+  const positions = read('positions') as Float32Array;
+  const normals = read('normals') as Int8Array;
+  const indices = read('indices') as Uint32Array;
+  const geometries = read('geometries') as Uint32Array;
+  const meshes = read('meshes') as Uint32Array;
+  const meshColors = read('mesh_colors') as Uint8Array;
+  const instanceGeometry = read('instance_geometry') as Uint32Array;
+  const instanceMatrix = read('instance_matrix') as Float32Array;
+  const instanceExpressId = read('instance_express_id') as Uint32Array;
+  const instanceType = read('instance_type') as Uint16Array;
+
+  // Instances grouped by geometry and type
+  const batches = new Map<string, number[]>();
+  const categories = new Map<string, number>();
+  for (let i = 0; i < instanceGeometry.length; i++) {
+    const category = header.types[instanceType[i]].toUpperCase();
+    categories.set(category, (categories.get(category) ?? 0) + 1);
+    const key = `${instanceGeometry[i]}:${instanceType[i]}`;
+    let batch = batches.get(key);
+    if (!batch) {
+      batch = [];
+      batches.set(key, batch);
+    }
+    batch.push(i);
+  }
+
+  const materials = new Map<number, THREE.Material>();
+  const materialFor = (mesh: number) => {
+    const [r, g, b, a] = meshColors.subarray(mesh * 4, mesh * 4 + 4);
+    const key = (r << 24) | (g << 16) | (b << 8) | a;
+    let material = materials.get(key);
+    if (!material) {
+      material = new THREE.MeshLambertMaterial({
+        color: new THREE.Color(r / 255, g / 255, b / 255),
+        transparent: a < 255,
+        opacity: a / 255,
+        side: THREE.DoubleSide
+      });
+      materials.set(key, material);
+    }
+    return material;
+  };
+
+  const attributes = new Map<number, [THREE.BufferAttribute, THREE.BufferAttribute]>();
+  const matrix = new THREE.Matrix4();
+  const group = new THREE.Group();
+
+  for (const [key, batch] of batches) {
+    const [geometryId, typeCode] = key.split(':').map(Number);
+    const [firstVertex, vertexCount, firstMesh, meshCount] = geometries.subarray(geometryId * 4, geometryId * 4 + 4);
+
+    let shared = attributes.get(geometryId);
+    if (!shared) {
+      shared = [
+        new THREE.BufferAttribute(positions.subarray(firstVertex * 3, (firstVertex + vertexCount) * 3), 3),
+        new THREE.BufferAttribute(normals.subarray(firstVertex * 3, (firstVertex + vertexCount) * 3), 3, true)
+      ];
+      attributes.set(geometryId, shared);
+    }
+
+    const ifcType = header.types[typeCode];
+    const userData = {
+      ifcCategory: ifcType.toUpperCase(),
+      expressIds: batch.map((i) => instanceExpressId[i]),
+      globalIds: batch.map((i) => header.global_ids[i])
+    };
+
+    for (let mesh = firstMesh; mesh < firstMesh + meshCount; mesh++) {
+      const firstIndex = meshes[mesh * 2];
+      const indexCount = meshes[mesh * 2 + 1];
+      const geometry = new THREE.BufferGeometry();
+      geometry.setAttribute('position', shared[0]);
+      geometry.setAttribute('normal', shared[1]);
+      geometry.setIndex(new THREE.BufferAttribute(indices.subarray(firstIndex, firstIndex + indexCount), 1));
+
+      let object: THREE.Mesh;
+      if (batch.length === 1) {
+        object = new THREE.Mesh(geometry, materialFor(mesh));
+        object.applyMatrix4(matrix.fromArray(instanceMatrix, batch[0] * 16));
+      } else {
+        const instanced = new THREE.InstancedMesh(geometry, materialFor(mesh), batch.length);
+        batch.forEach((instance, i) => instanced.setMatrixAt(i, matrix.fromArray(instanceMatrix, instance * 16)));
+        instanced.instanceMatrix.needsUpdate = true;
+        instanced.computeBoundingSphere();
+        object = instanced;
+      }
+      object.userData = userData;
+      group.add(object);
+    }
+  }
+
+  // IFC is Z-up, the viewer is Y-up (same convention as the web-ifc loader)
+  group.rotation.x = -Math.PI / 2;
+  group.userData = { preconverted: true, schema: header.schema, sha256: header.source_sha256 };
+  return { header, group, categories };
+}
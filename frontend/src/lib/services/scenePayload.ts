@@ -0,0 +1,71 @@
+import type { SceneModelItem } from '$lib/components/BimViewer.svelte';
+
+/**
+ * Encoder for the backend's binary scene format (see backend/scene_payload.py).
+ * Vectors are packed as float32 columns and shared item ids and properties
+ * are sent once and referenced by index.
+ */
+
+export const SCENE_CONTENT_TYPE = 'application/vnd.voxel.scene';
+export const SCENE_FORMAT_VERSION = 1;
+
+export function encodeScene(sceneModel: SceneModelItem[], name: string): ArrayBuffer {
+  const count = sceneModel.length;
+  const itemIds: string[] = [];
+  const itemIndex = new Map<string, number>();
+  const properties: Record<string, any>[] = [];
+  const propertyIndex = new Map<string, number>();
+
+  const vectors = new Float32Array(count * 9);
+  const indices = new Uint32Array(count * 2);
+  // Most items share the properties object of their marketplace item; only stringify each object once
+  const keys = new Map<object, string>();
+
+  sceneModel.forEach((item, i) => {
+    vectors.set(item.position, i * 3);
+    vectors.set(item.rotation, (count + i) * 3);
+    vectors.set(item.scale, (2 * count + i) * 3);
+
+    let itemNumber = itemIndex.get(item.itemId);
+    if (itemNumber === undefined) {
+      itemNumber = itemIds.push(item.itemId) - 1;
+      itemIndex.set(item.itemId, itemNumber);
+    }
+
+    let key = keys.get(item.properties);
+    if (key === undefined) {
+      key = JSON.stringify(item.properties);
+      keys.set(item.properties, key);
+    }
+    let propertyNumber = propertyIndex.get(key);
+    if (propertyNumber === undefined) {
+      propertyNumber = properties.push(item.properties) - 1;
+      propertyIndex.set(key, propertyNumber);
+    }
+
+    indices[i] = itemNumber;
+    indices[count + i] = propertyNumber;
+  });
+
+  let header = new TextEncoder().encode(
+    JSON.stringify({ name, count, item_ids: itemIds, properties })
+  );
+  const padding = (4 - (header.length % 4)) % 4;
+  if (padding) {
+    const padded = new Uint8Array(header.length + padding).fill(0x20);
+    padded.set(header);
+    header = padded;
+  }
+
+  const buffer = new ArrayBuffer(12 + header.length + vectors.byteLength + indices.byteLength);
+  const bytes = new Uint8Array(buffer);
+  const view = new DataView(buffer);
+  bytes.set([0x56, 0x58, 0x53, 0x43]); // "VXSC"
+  view.setUint32(4, SCENE_FORMAT_VERSION, true);
+  view.setUint32(8, header.length, true);
+  bytes.set(header, 12);
+  // Typed arrays are little-endian on every platform browsers run on
+  bytes.set(new Uint8Array(vectors.buffer), 12 + header.length);
+  bytes.set(new Uint8Array(indices.buffer), 12 + header.length + vectors.byteLength);
+  return buffer;
+}
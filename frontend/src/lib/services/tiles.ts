@@ -0,0 +1,208 @@
+import * as THREE from 'three';
+
+/**
+ * Streaming reader for the backend's LOD tile files (see backend/tiles.py).
+ * Reads the manifest with one range request, then keeps every visible tile
+ * loaded at the coarsest level whose geometric error stays below
+ * maxScreenSpaceError pixels, fetching each tile level with its own range request.
+ */
+
+export const TILES_FORMAT_VERSION = 1;
+
+type TileLevel = [offset: number, length: number, triangles: number, geometricError: number];
+
+export type TileManifest = {
+  format_version: number;
+  source_sha256: string;
+  bounds: number[];
+  lod_count: number;
+  tiles: { bounds: number[]; elements: number; lods: TileLevel[] }[];
+};
+
+type TileState = {
+  box: THREE.Box3;
+  levels: TileLevel[];
+  loadedOffset: number | null;
+  pending: boolean;
+  mesh: THREE.Mesh | null;
+};
+
+async function fetchRange(url: string, start: number, length: number): Promise<ArrayBuffer> {
+  const response = await fetch(url, { headers: { Range: `bytes=${start}-${start + length - 1}` } });
+  if (!response.ok) {
+    throw new Error(`Tile request failed: ${response.status} ${response.statusText}`);
+  }
+  const buffer = await response.arrayBuffer();
+  // Servers that ignore Range answer 200 with the whole file
+  return response.status === 206 ? buffer : buffer.slice(start, start + length);
+}
+
+export class TileStreamer {
+  /** Holds the tile meshes; IFC Z-up is rotated to the viewer's Y-up. */
+  readonly group = new THREE.Group();
+  maxScreenSpaceError = 16;
+  maxConcurrentRequests = 6;
+
+  private tiles: TileState[];
+  private activeRequests = 0;
+  private material = new THREE.MeshLambertMaterial({
+    vertexColors: true,
+    flatShading: true,
+    side: THREE.DoubleSide
+  });
+  private frustum = new THREE.Frustum();
+  private matrix = new THREE.Matrix4();
+  private disposed = false;
+
+  private constructor(
+    private url: string,
+    readonly manifest: TileManifest,
+    private dataStart: number
+  ) {
+    this.tiles = manifest.tiles.map((tile) => ({
+      box: new THREE.Box3(
+        new THREE.Vector3(tile.bounds[0], tile.bounds[1], tile.bounds[2]),
+        new THREE.Vector3(tile.bounds[3], tile.bounds[4], tile.bounds[5])
+      ),
+      levels: tile.lods,
+      loadedOffset: null,
+      pending: false,
+      mesh: null
+    }));
+    this.group.rotation.x = -Math.PI / 2;
+    this.group.userData = { preconverted: true, tiled: true };
+  }
+
+  /** Read the manifest (the first manifestBytes bytes of the file). */
+  static async open(url: string, manifestBytes: number): Promise<TileStreamer> {
+    const buffer = await fetchRange(url, 0, manifestBytes);
+    const view = new DataView(buffer);
+    if (String.fromCharCode(...new Uint8Array(buffer, 0, 4)) !== 'VXTL') {
+      throw new Error('Not a tile file');
+    }
+    const version = view.getUint32(4, true);
+    if (version !== TILES_FORMAT_VERSION) {
+      throw new Error(`Unsupported tile format version ${version}`);
+    }
+    const manifestLength = view.getUint32(8, true);
+    const manifest = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 12, manifestLength)));
+    return new TileStreamer(url, manifest, 12 + manifestLength);
+  }
+
+  /** Model bounds in the group's (IFC) coordinates. */
+  get bounds(): THREE.Box3 {
+    const b = this.manifest.bounds;
+    return new THREE.Box3(new THREE.Vector3(b[0], b[1], b[2]), new THREE.Vector3(b[3], b[4], b[5]));
+  }
+
+  /** Pixels per metre of geometric error at the given distance. */
+  private pixelsPerMetre(camera: THREE.Camera, viewportHeight: number, distance: number): number {
+    if (camera instanceof THREE.OrthographicCamera) {
+      return (viewportHeight * camera.zoom) / (camera.top - camera.bottom);
+    }
+    const fov = THREE.MathUtils.degToRad((camera as THREE.PerspectiveCamera).fov ?? 60);
+    return viewportHeight / (2 * Math.tan(fov / 2) * Math.max(distance, 1e-3));
+  }
+
+  /** Call after every camera change; loads and swaps tile levels as needed. */
+  update(camera: THREE.Camera, viewportHeight: number) {
+    if (this.disposed) return;
+    this.group.updateMatrixWorld(true);
+    camera.updateMatrixWorld();
+    this.frustum.setFromProjectionMatrix(
+      this.matrix.multiplyMatrices(camera.projectionMatrix, camera.matrixWorldInverse)
+    );
+
+    const wanted: { tile: TileState; level: number; distance: number }[] = [];
+    const box = new THREE.Box3();
+    for (const tile of this.tiles) {
+      box.copy(tile.box).applyMatrix4(this.group.matrixWorld);
+      if (!this.frustum.intersectsBox(box)) {
+        if (tile.mesh) tile.mesh.visible = false;
+        continue;
+      }
+      if (tile.mesh) tile.mesh.visible = true;
+
+      const distance = box.distanceToPoint(camera.position);
+      const scale = this.pixelsPerMetre(camera, viewportHeight, distance);
+      let level = 0;
+      for (let candidate = tile.levels.length - 1; candidate > 0; candidate--) {
+        if (tile.levels[candidate][3] * scale <= this.maxScreenSpaceError) {
+          level = candidate;
+          break;
+        }
+      }
+      if (tile.levels[level][0] !== tile.loadedOffset && !tile.pending) {
+        wanted.push({ tile, level, distance });
+      }
+    }
+
+    // Nearest tiles first
+    wanted.sort((a, b) => a.distance - b.distance);
+    for (const { tile, level } of wanted) {
+      if (this.activeRequests >= this.maxConcurrentRequests) break;
+      this.load(tile, level, camera, viewportHeight);
+    }
+  }
+
+  private async load(tile: TileState, level: number, camera: THREE.Camera, viewportHeight: number) {
+    const [offset, length, triangles] = tile.levels[level];
+    tile.pending = true;
+    this.activeRequests++;
+    try {
+      const mesh = triangles > 0 ? this.decode(await fetchRange(this.url, this.dataStart + offset, length), tile.box) : null;
+      if (this.disposed) {
+        mesh?.geometry.dispose();
+        return;
+      }
+      if (tile.mesh) {
+        this.group.remove(tile.mesh);
+        tile.mesh.geometry.dispose();
+      }
+      tile.mesh = mesh;
+      if (mesh) this.group.add(mesh);
+      tile.loadedOffset = offset;
+    } catch (err) {
+      console.warn('Tile load failed:', err);
+    } finally {
+      tile.pending = false;
+      this.activeRequests--;
+    }
+    // Continue with tiles that were waiting for a free request slot
+    this.update(camera, viewportHeight);
+  }
+
+  private decode(buffer: ArrayBuffer, box: THREE.Box3): THREE.Mesh {
+    const view = new DataView(buffer);
+    const vertexCount = view.getUint32(0, true);
+    const indexCount = view.getUint32(4, true);
+    let offset = 8;
+    const positions = new Uint16Array(buffer, offset, vertexCount * 3);
+    offset += Math.ceil((vertexCount * 6) / 4) * 4;
+    const colors = new Uint8Array(buffer, offset, vertexCount * 4);
+    offset += vertexCount * 4;
+    const indices =
+      vertexCount <= 65535 ? new Uint16Array(buffer, offset, indexCount) : new Uint32Array(buffer, offset, indexCount);
+
+    const geometry = new THREE.BufferGeometry();
+    // Quantised positions: normalised to 0..1 here, scaled to the tile bounds by the mesh transform
+    geometry.setAttribute('position', new THREE.BufferAttribute(positions, 3, true));
+    geometry.setAttribute('color', new THREE.BufferAttribute(colors, 4, true));
+    geometry.setIndex(new THREE.BufferAttribute(indices, 1));
+
+    const mesh = new THREE.Mesh(geometry, this.material);
+    mesh.position.copy(box.min);
+    box.getSize(mesh.scale).max(new THREE.Vector3(1e-6, 1e-6, 1e-6));
+    return mesh;
+  }
+
+  dispose() {
+    this.disposed = true;
+    for (const tile of this.tiles) {
+      tile.mesh?.geometry.dispose();
+      tile.mesh = null;
+    }
+    this.material.dispose();
+    this.group.clear();
+  }
+}